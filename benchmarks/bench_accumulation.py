@@ -0,0 +1,48 @@
+# Check of gradient accumulation (common/optimizers.py) against training on the large batch: from the
+# same initial weights, the T unimodal model (LSTM and dense layers, without dropout) takes updates
+# with AccumulatedAdamax over accumulation_steps micro-batches and with Adamax on the concatenated
+# batches, and the weights are compared after every update. Also reports the time per update.
+# usage: python benchmarks/bench_accumulation.py [accumulation_steps] [micro_batch_size] [updates]
+
+from __future__ import print_function
+import os
+import sys
+import time
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make the shared helpers in common/ importable
+from common.models import build_model
+
+accumulation_steps = int(sys.argv[1]) if len(sys.argv) >= 2 else 4
+micro_batch_size = int(sys.argv[2]) if len(sys.argv) >= 3 else 32
+updates = int(sys.argv[3]) if len(sys.argv) == 4 else 5
+maxlen = 15
+# float32 sums of the micro-batch gradients differ from the gradient of the large batch in the last bits
+TOLERANCE = 1e-5
+
+
+rng = np.random.RandomState(0)
+batch_size = accumulation_steps * micro_batch_size
+x = rng.randn(updates * batch_size, maxlen, 300).astype('float32')
+y = rng.uniform(-1, 1, (updates * batch_size, 1)).astype('float32')
+
+accumulated = build_model('T', 'uno', maxlen, accumulation_steps=accumulation_steps)
+large_batch = build_model('T', 'uno', maxlen)
+large_batch.set_weights(accumulated.get_weights())
+
+t_accumulated = t_large_batch = 0.0
+for update in range(updates):
+    batch = slice(update * batch_size, (update + 1) * batch_size)
+    start = time.time()
+    for step in range(accumulation_steps):
+        micro_batch = slice(batch.start + step * micro_batch_size, batch.start + (step + 1) * micro_batch_size)
+        accumulated.train_on_batch(x[micro_batch], y[micro_batch])
+    t_accumulated += time.time() - start
+    start = time.time()
+    large_batch.train_on_batch(x[batch], y[batch])
+    t_large_batch += time.time() - start
+    difference = max(float(np.max(np.abs(a - b))) for a, b in zip(accumulated.get_weights(), large_batch.get_weights()))
+    print('update %d: largest weight difference %.2e' % (update + 1, difference))
+    assert difference <= TOLERANCE, 'the accumulated update differs from the update of the batch of %d' % batch_size
+
+print('%d x %d accumulated: %.1f ms per update, batch of %d: %.1f ms per update'
+      % (accumulation_steps, micro_batch_size, 1000.0 * t_accumulated / updates, batch_size, 1000.0 * t_large_batch / updates))
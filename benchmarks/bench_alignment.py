@@ -0,0 +1,34 @@
+# Benchmark of the parallel word level alignment against mmdata's serial Dataset.align,
+# checking that both give identical output
+# usage: python benchmarks/bench_alignment.py [max_processes]
+
+from __future__ import print_function
+import multiprocessing
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make the shared helpers in common/ importable
+from common.alignment import parallel_align, same_alignment
+from common.preprocessing import load_mosi_features
+
+max_processes = int(sys.argv[1]) if len(sys.argv) == 2 else multiprocessing.cpu_count()
+modalities = ['embeddings', 'facet', 'covarep']
+
+features, sentiments, split_vids = load_mosi_features(modalities)
+# mmdata's Dataset, or the synthetic one with MOSI_SYNTHETIC
+Dataset = type(features['embeddings'])
+merged = Dataset.merge(Dataset.merge(features['embeddings'], features['facet']), features['covarep'])
+
+start = time.time()
+serial = merged.align('embeddings')
+t_serial = time.time() - start
+print('serial Dataset.align: %.1f s' % t_serial)
+
+processes = 2
+while processes <= max_processes:
+    start = time.time()
+    aligned = parallel_align(merged, 'embeddings', modalities, processes)
+    t_parallel = time.time() - start
+    assert same_alignment(serial, aligned, modalities), 'parallel alignment differs from the serial one'
+    print('%2d processes: %.1f s  speedup: %.1fx' % (processes, t_parallel, t_serial / t_parallel))
+    processes *= 2
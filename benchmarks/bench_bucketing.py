@@ -0,0 +1,66 @@
+# Benchmark of length-bucketed batches against the fixed maxlen padding, on the T and DL model graphs
+# usage: python benchmarks/bench_bucketing.py [n_utterances] [maxlen]
+
+from __future__ import print_function
+import os
+import sys
+import time
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make the shared helpers in common/ importable
+from common.bucketing import BucketStream, fit_buckets
+from common.preprocessing import pad_sequences
+
+from keras.models import Model
+from keras.layers import Dense, Dropout, LSTM, Input, merge
+
+n_utterances = int(sys.argv[1]) if len(sys.argv) >= 2 else 2000
+maxlen = int(sys.argv[2]) if len(sys.argv) == 3 else 15
+batch_size = 128
+epochs = 3
+
+
+def text_model(timesteps):
+    text_input = Input(shape=(timesteps, 300), dtype='float32')
+    h = LSTM(128, return_sequences=False)(text_input)
+    h = Dense(64)(h)
+    model = Model(inputs=text_input, outputs=Dense(1, activation='tanh')(h))
+    model.compile('adamax', 'mae')
+    return model
+
+
+def dl_model(timesteps):
+    inputs = [Input(shape=(timesteps, dim), dtype='float32') for dim in (74, 46, 300)]
+    branches = [Dense(32, activation='relu')(Dropout(0.2)(inputs[0])), Dense(32, activation='relu')(Dropout(0.2)(inputs[1])),
+                Dense(64, activation='relu')(LSTM(128, return_sequences=True)(inputs[2]))]
+    h = LSTM(128, return_sequences=False)(Dropout(0.2)(merge(branches, mode='concat')))
+    model = Model(inputs=inputs, outputs=Dense(1, activation='tanh')(Dense(32, activation='relu')(h)))
+    model.compile('adamax', 'mae')
+    return model
+
+
+# ragged utterances, word counts roughly as in MOSI
+rng = np.random.RandomState(0)
+n_words = rng.randint(1, 40, size=n_utterances)
+x = [pad_sequences([rng.randn(n, dim).astype('float32') for n in n_words], maxlen, dtype='float32')
+     for dim in (74, 46, 300)]
+y = rng.uniform(-1, 1, size=n_utterances).astype('float32')
+
+for name, build, inputs in (('T', text_model, x[2]), ('DL', dl_model, x)):
+    bucketed, fixed = BucketStream(inputs, y, None, batch_size, shuffle=True).saved_steps()
+    # the same small validation set for both runs
+    valid = [a[:batch_size] for a in inputs] if isinstance(inputs, list) else inputs[:batch_size]
+
+    model = build(maxlen)
+    model.fit(inputs, y, batch_size=batch_size, epochs=1, verbose=0) # warm up
+    start = time.time()
+    model.fit(inputs, y, batch_size=batch_size, epochs=epochs, verbose=0, validation_data=(valid, y[:batch_size]))
+    t_fixed = (time.time() - start) / epochs
+
+    model = build(None)
+    fit_buckets(model, inputs, y, valid, y[:batch_size], batch_size, epochs=1, verbose=0) # warm up
+    start = time.time()
+    fit_buckets(model, inputs, y, valid, y[:batch_size], batch_size, epochs=epochs, verbose=0)
+    t_bucketed = (time.time() - start) / epochs
+
+    print('%-3s padded steps per epoch: %d fixed, %d bucketed (%.1f%% fewer)  epoch time: %.2f s fixed, %.2f s bucketed  speedup: %.2fx'
+          % (name, fixed, bucketed, 100.0 * (fixed - bucketed) / fixed, t_fixed, t_bucketed, t_fixed / t_bucketed))
@@ -0,0 +1,51 @@
+# Check of gradient checkpointing (common/checkpointing.py) against the plain graph: a model with all
+# its segments checkpointed gets the weights of the same model without checkpointing, and the
+# gradients of the weights (without dropout) are compared.
+# usage: python benchmarks/bench_checkpointing.py [model] [task] [batch_size]
+
+from __future__ import print_function
+import os
+import sys
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make the shared helpers in common/ importable
+from common.configs import CHECKPOINT_SEGMENTS
+from common.models import build_model
+from keras import backend as K
+
+model_type = sys.argv[1] if len(sys.argv) >= 2 else 'TFN'
+task = sys.argv[2] if len(sys.argv) >= 3 else 'uno'
+batch_size = int(sys.argv[3]) if len(sys.argv) == 4 else 32
+maxlen = 15
+# float32 sums are taken in another order in the recomputed segments
+TOLERANCE = 1e-4
+
+
+def weight_gradients(model, x):
+    """{(layer name, weight index): gradient of the summed outputs} in inference mode"""
+    keys, weights = [], []
+    for layer in model.layers:
+        for index, weight in enumerate(layer.trainable_weights):
+            keys.append((layer.name, index))
+            weights.append(weight)
+    gradients = K.function(model.inputs + [K.learning_phase()], K.gradients(sum(K.sum(output) for output in model.outputs), weights))
+    return dict(zip(keys, gradients(x + [0])))
+
+
+def relative_difference(a, b):
+    return float(np.max(np.abs(a - b)) / max(np.max(np.abs(a)), 1e-12))
+
+
+plain = build_model(model_type, task, maxlen)
+checkpointed = build_model(model_type, task, maxlen, checkpoint=CHECKPOINT_SEGMENTS[model_type])
+for layer in plain.layers:
+    if layer.weights:
+        checkpointed.get_layer(layer.name).set_weights(layer.get_weights())
+
+rng = np.random.RandomState(0)
+x = [rng.randn(batch_size, *K.int_shape(model_input)[1:]).astype('float32') for model_input in plain.inputs]
+expected, actual = weight_gradients(plain, x), weight_gradients(checkpointed, x)
+assert sorted(expected) == sorted(actual), 'the checkpointed model has other weights than the plain model'
+difference = max(relative_difference(expected[key], actual[key]) for key in expected)
+print('weight gradients: largest relative difference %.2e' % difference)
+assert difference <= TOLERANCE, 'the gradients of the checkpointed model differ from those of the plain model'
+
@@ -0,0 +1,86 @@
+# Memory report of the trimodal (FL/DL/HL/TFN) data pipeline with the old float64 arrays and the float32 policy
+# usage: python benchmarks/bench_dtype.py [scale], scale multiplies the MOSI size (2199 utterances)
+
+from __future__ import print_function
+import multiprocessing
+import os
+import resource
+import sys
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make the shared helpers in common/ importable
+from common.preprocessing import build_arrays, pad, MODALITY_CODES, NORMALIZED_MODALITIES, SPLITS
+
+scale = float(sys.argv[1]) if len(sys.argv) == 2 else 1.0
+max_len = 15
+modalities = ['covarep', 'facet', 'embeddings']
+dims = {'covarep': 74, 'facet': 46, 'embeddings': 300}
+split_sizes = dict((split, int(n * scale)) for split, n in (('train', 1284), ('valid', 229), ('test', 686)))
+
+
+def synthetic_dataset():
+    """MOSI-shaped aligned features, one segment per video, as lists of (start, end, vector) tuples"""
+    rng = np.random.RandomState(0)
+    dataset = dict((modality, {}) for modality in modalities)
+    set_ids, scores = {}, {}
+    for split in SPLITS:
+        set_ids[split] = [('%s%d' % (split, i), '1') for i in range(split_sizes[split])]
+        scores[split] = list(rng.uniform(-3, 3, size=split_sizes[split]))
+        for vid, sid in set_ids[split]:
+            n_words = rng.randint(1, 40)
+            for modality in modalities:
+                dataset[modality][vid] = {sid: [(i * 0.3, (i + 1) * 0.3, rng.randn(dims[modality])) for i in range(n_words)]}
+    return dataset, set_ids, scores
+
+
+def legacy_pipeline(dataset, set_ids, scores):
+    """The preprocessing of the original scripts: float64 pad(), normalized copies and the FL concatenation"""
+    data = {}
+    for modality in modalities:
+        x = [np.stack([pad(dataset[modality][vid][sid], max_len) for (vid, sid) in set_ids[split]]) for split in SPLITS]
+        if modality in NORMALIZED_MODALITIES:
+            feature_max = np.max(np.max(np.abs(x[0]), axis=0), axis=0)
+            feature_max[feature_max == 0] = 1
+            x = [xi / feature_max for xi in x]
+            for xi in x:
+                xi[xi != xi] = 0
+        for split, xi in zip(SPLITS, x):
+            data['x_%s_%s' % (MODALITY_CODES[modality], split)] = xi
+    for split in SPLITS:
+        data['y_' + split] = np.array(scores[split])
+    return data
+
+
+def float32_pipeline(dataset, set_ids, scores):
+    return build_arrays(dataset, modalities, set_ids, scores, max_len)
+
+
+def measure(pipeline, results):
+    dataset, set_ids, scores = synthetic_dataset()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    data = pipeline(dataset, set_ids, scores)
+    # the early fusion (FL) models concatenate the modalities in the order (V, A, T)
+    fused = [np.concatenate((data['x_V_' + split], data['x_A_' + split], data['x_T_' + split]), axis=2) for split in SPLITS]
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    arrays = sum(value.nbytes for key, value in data.items() if key.startswith('x_'))
+    results.put((arrays, sum(x.nbytes for x in fused), (after - before) * 1024, fused[0].dtype.name))
+
+
+def run(pipeline):
+    # every pipeline in a fresh process, so that the peak RSS of one does not hide the other
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure, args=(pipeline, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+print('trimodal pipeline, %d utterances, max_len=%d' % (sum(split_sizes.values()), max_len))
+mb = 1024.0 ** 2
+legacy = run(legacy_pipeline)
+policy = run(float32_pipeline)
+for name, (arrays, fused, peak, dtype) in (('before', legacy), ('after', policy)):
+    print('%-6s %-7s  x_* arrays: %7.1f MB  FL input: %7.1f MB  peak RSS increase: %7.1f MB'
+          % (name, dtype, arrays / mb, fused / mb, peak / mb))
+print('float16 storage of the x_* arrays (storage_dtype=\'float16\'): %.1f MB on disk and in the page cache' % (policy[0] / 2 / mb))
+print('reduction: x_* arrays %.1fx, peak RSS %.1fx' % (legacy[0] / float(policy[0]), legacy[2] / float(max(policy[2], 1))))
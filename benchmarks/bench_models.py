@@ -0,0 +1,184 @@
+# Benchmark of every model graph (the A/V/T unimodal and FL/DL/HL/TFN fusion models with the uno/pol/int/tri heads):
+# training step latency, inference latency at several batch sizes, parameter count, peak memory and preprocessing time.
+# usage: python benchmarks/bench_models.py [--data synthetic|mosi] [--scale 1] [--threads T] [--tfn-fusion lowrank] [--output FILE] [config ...]
+# configs are names or patterns as in run_experiments.py, all by default. The results are written to a JSON file
+# (benchmarks/results/ by default) with the benchmark version, the git revision and the library versions.
+
+from __future__ import print_function
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT) # make the shared helpers in common/ importable
+from common.configs import all_names, dataset_spec, inputs_for, parse_name, targets_for, TFN_FUSIONS
+from common.profiling import current_rss
+
+# bump when the measurements change, so that results of different versions are not compared
+BENCHMARK_VERSION = 2
+TRAIN_BATCH_SIZE = 128
+INFERENCE_BATCH_SIZES = (1, 32, 128, 1024)
+WARMUP_STEPS = 3
+TIMED_STEPS = 20
+MAXLEN = 15
+
+# the preprocessed datasets, inherited by the forked workers
+_DATA = {}
+
+
+def latency(step, repeats):
+    """Median, 90th percentile and mean of repeats calls of step() in milliseconds, after WARMUP_STEPS calls"""
+    for _ in range(WARMUP_STEPS):
+        step()
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        step()
+        times.append(1000.0 * (time.time() - start))
+    return {'median_ms': float(np.median(times)), 'p90_ms': float(np.percentile(times, 90)), 'mean_ms': float(np.mean(times))}
+
+
+def batch_of(arrays, batch_size):
+    """The first batch_size samples of an array, a list or a dict of arrays, repeated if there are fewer"""
+    if isinstance(arrays, dict):
+        return dict((key, batch_of(value, batch_size)) for key, value in arrays.items())
+    if isinstance(arrays, list):
+        return [batch_of(array, batch_size) for array in arrays]
+    return np.asarray(arrays[np.resize(np.arange(len(arrays)), batch_size)])
+
+
+def peak_rss(baseline=0):
+    """Peak resident memory of this process in bytes above baseline.
+
+    A forked worker starts with the resident memory of the parent, which holds the preprocessed
+    arrays of all models; pass its current_rss() at the start of the worker to measure only the
+    memory of the work done since.
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (maxrss if sys.platform == 'darwin' else maxrss * 1024) - baseline
+
+
+def bench_model(job):
+    """Benchmark one configuration in a fresh worker process, returns (name, results)"""
+    name, threads, tfn_fusion = job
+    # the memory the worker inherited from the parent at the fork
+    rss_start = current_rss()
+    if threads:
+        from common.scheduler import limit_threads
+        limit_threads(threads)
+    from common.models import build_model
+    model_type, task = parse_name(name)
+    data = _DATA[dataset_spec(model_type)]
+    x, y = inputs_for(model_type, data, 'train'), targets_for(task, data, 'train')
+
+    start = time.time()
+    model = build_model(model_type, task, MAXLEN, tfn_fusion=tfn_fusion)
+    results = {'build_seconds': time.time() - start, 'params': int(model.count_params()), 'rss_start': rss_start}
+    x_batch, y_batch = batch_of(x, TRAIN_BATCH_SIZE), batch_of(y, TRAIN_BATCH_SIZE)
+    results['train_step'] = dict(latency(lambda: model.train_on_batch(x_batch, y_batch), TIMED_STEPS), batch_size=TRAIN_BATCH_SIZE)
+    results['train_step']['samples_per_second'] = 1000.0 * TRAIN_BATCH_SIZE / results['train_step']['median_ms']
+    x_test = inputs_for(model_type, data, 'test')
+    results['inference'] = {}
+    for batch_size in INFERENCE_BATCH_SIZES:
+        x_batch = batch_of(x_test, batch_size)
+        timing = latency(lambda: model.predict_on_batch(x_batch), TIMED_STEPS)
+        timing['samples_per_second'] = 1000.0 * batch_size / timing['median_ms']
+        results['inference'][str(batch_size)] = timing
+    # the worker only ran this model, on the memory-mapped or inherited arrays
+    results['peak_rss'] = peak_rss(rss_start)
+    return name, results
+
+
+def preprocess(specs):
+    """Prepare every dataset from scratch (no cache), returns {spec name: seconds and sizes}"""
+    from common.cache import load_mosi
+    timings = {}
+    for modalities, anchor in specs:
+        start = time.time()
+        data = load_mosi(list(modalities), anchor=anchor, max_len=MAXLEN, cache_dir=None)
+        seconds = time.time() - start
+        _DATA[(modalities, anchor)] = data
+        timings['%s_%s' % ('-'.join(sorted(modalities)), anchor or 'unaligned')] = {
+            'seconds': seconds, 'utterances': dict((split, len(data['y_' + split])) for split in ('train', 'valid', 'test'))}
+    return timings
+
+
+def environment():
+    """Versions of the software and hardware the benchmark ran on"""
+    env = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+           'processor': platform.processor(), 'cpus': multiprocessing.cpu_count()}
+    try:
+        env['git'] = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        env['git'] = None
+    # the installed versions, without importing Keras into the parent process
+    import pkg_resources
+    for package in ('keras', 'tensorflow', 'theano'):
+        try:
+            env[package] = pkg_resources.get_distribution(package).version
+        except pkg_resources.DistributionNotFound:
+            env[package] = None
+    return env
+
+
+def write_results(results, prefix, output=None):
+    """Write the results to output, by default benchmarks/results/<prefix>_<date>_<revision>.json, returns the path"""
+    if output is None:
+        revision = (results['environment']['git'] or 'unknown')[:8]
+        output = os.path.join(ROOT, 'benchmarks', 'results', '%s_%s_%s.json' % (prefix, datetime.date.today().strftime('%Y%m%d'), revision))
+    if os.path.dirname(output) and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    return output
+
+
+def main():
+    from run_experiments import select
+    parser = argparse.ArgumentParser(description='Benchmark the latency, size and memory of the model graphs')
+    parser.add_argument('configs', nargs='*', default=['*'], help='configuration names or patterns, e.g. DL_tri TFN_* *_uno')
+    parser.add_argument('--data', choices=('synthetic', 'mosi'), default='synthetic',
+                        help='synthetic MOSI-shaped data (common/synthetic.py) or the MOSI corpus from mmdata')
+    parser.add_argument('--scale', type=float, default=1.0, help='size of the synthetic data in multiples of MOSI')
+    parser.add_argument('--threads', type=int, default=None, help='threads of TensorFlow and the BLAS libraries')
+    parser.add_argument('--tfn-fusion', choices=TFN_FUSIONS, default='tensor', help='fusion of the TFN models')
+    parser.add_argument('--output', default=None, help='results file, by default benchmarks/results/models_<date>_<revision>.json')
+    args = parser.parse_args()
+    names = select(args.configs, all_names())
+    if args.data == 'synthetic':
+        os.environ['MOSI_SYNTHETIC'] = str(args.scale)
+
+    # Keras is only imported by the workers, every model is benchmarked in a fresh process
+    specs = sorted(set(dataset_spec(parse_name(name)[0]) for name in names))
+    results = {'version': BENCHMARK_VERSION, 'created': datetime.datetime.now().isoformat(), 'environment': environment(),
+               'settings': {'data': args.data, 'scale': args.scale if args.data == 'synthetic' else None, 'maxlen': MAXLEN,
+                            'threads': args.threads, 'tfn_fusion': args.tfn_fusion, 'train_batch_size': TRAIN_BATCH_SIZE, 'timed_steps': TIMED_STEPS},
+               'preprocessing': preprocess(specs), 'models': {}}
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        for name, model_results in pool.imap(bench_model, [(name, args.threads, args.tfn_fusion) for name in names]):
+            results['models'][name] = model_results
+            print('%-16s %9d params  train step %8.1f ms  inference %s ms  peak RSS %7.1f MB'
+                  % (name, model_results['params'], model_results['train_step']['median_ms'],
+                     ' / '.join('%.1f' % model_results['inference'][str(b)]['median_ms'] for b in INFERENCE_BATCH_SIZES),
+                     model_results['peak_rss'] / 1024.0 / 1024.0))
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    output = write_results(results, 'models', args.output)
+    print('Inference latency at batch sizes %s. Results written to %s' % ('/'.join(map(str, INFERENCE_BATCH_SIZES)), output))
+
+
+if __name__ == '__main__':
+    main()
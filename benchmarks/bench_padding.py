@@ -0,0 +1,30 @@
+# Benchmark of the bulk pad_sequences() against the per-utterance pad() helper
+# usage: python benchmarks/bench_padding.py [n_utterances]
+
+from __future__ import print_function
+import os
+import sys
+import timeit
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make the shared helpers in common/ importable
+from common.preprocessing import pad, pad_sequences
+
+n_utterances = int(sys.argv[1]) if len(sys.argv) == 2 else 2000
+max_len = 15
+repeats = 5
+
+# ragged utterances of (start, end, vector) tuples, word counts roughly as in MOSI
+rng = np.random.RandomState(0)
+for name, dim in (('covarep', 74), ('facet', 46), ('embeddings', 300)):
+    sequences = []
+    for n_words in rng.randint(1, 40, size=n_utterances):
+        sequences.append([(i * 0.3, (i + 1) * 0.3, rng.randn(dim).astype('float32')) for i in range(n_words)])
+
+    legacy = np.stack([pad(seq, max_len) for seq in sequences], axis=0)
+    bulk = pad_sequences(sequences, max_len)
+    assert np.array_equal(legacy, bulk), 'pad_sequences() does not match pad()'
+
+    t_legacy = min(timeit.repeat(lambda: np.stack([pad(seq, max_len) for seq in sequences], axis=0), number=1, repeat=repeats))
+    t_bulk = min(timeit.repeat(lambda: pad_sequences(sequences, max_len), number=1, repeat=repeats))
+    print('%-10s dim=%3d  pad()+np.stack: %7.1f ms  pad_sequences(): %7.1f ms  speedup: %.1fx'
+          % (name, dim, t_legacy * 1000, t_bulk * 1000, t_legacy / t_bulk))
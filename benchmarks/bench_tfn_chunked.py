@@ -0,0 +1,74 @@
+# Check of the chunked TFN fusion (TensorFusionLSTM, common/fusion.py) against the tensor graph of the
+# scripts: the weights of a TFN model with the full fused tensor, saved as the scripts save them, are
+# loaded into the chunked model, and the predictions and the gradients of the weights (without dropout,
+# through the recomputed chunks of the backward pass) are compared. Also reports the inference time of both.
+# usage: python benchmarks/bench_tfn_chunked.py [task] [batch_size]
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make the shared helpers in common/ importable
+from common.models import build_model
+from keras import backend as K
+
+task = sys.argv[1] if len(sys.argv) >= 2 else 'uno'
+batch_size = int(sys.argv[2]) if len(sys.argv) == 3 else 32
+maxlen = 15 # the TFN graph is built for the padded length of the scripts
+# float32 sums over the chunks are taken in another order than over the whole tensor
+TOLERANCE = 1e-4
+
+
+def weight_gradients(model, x):
+    """{(layer name, weight index): gradient of the summed outputs} in inference mode"""
+    keys, weights = [], []
+    for layer in model.layers:
+        for index, weight in enumerate(layer.trainable_weights):
+            keys.append((layer.name, index))
+            weights.append(weight)
+    gradients = K.function(model.inputs + [K.learning_phase()], K.gradients(sum(K.sum(output) for output in model.outputs), weights))
+    return dict(zip(keys, gradients(x + [0])))
+
+
+def outputs(predictions):
+    """The predictions of every output head, predict() returns an array for one"""
+    return predictions if isinstance(predictions, list) else [predictions]
+
+
+def relative_difference(a, b):
+    return float(np.max(np.abs(a - b)) / max(np.max(np.abs(a)), 1e-12))
+
+
+tensor = build_model('TFN', task, maxlen)
+chunked = build_model('TFN', task, maxlen, tfn_fusion='chunked')
+weights_dir = tempfile.mkdtemp()
+try:
+    tensor.save_weights(os.path.join(weights_dir, 'weights_TFN_%s.h5' % task))
+    chunked.load_weights(os.path.join(weights_dir, 'weights_TFN_%s.h5' % task))
+finally:
+    shutil.rmtree(weights_dir)
+
+rng = np.random.RandomState(0)
+x = [rng.randn(batch_size, *K.int_shape(model_input)[1:]).astype('float32') for model_input in tensor.inputs]
+timings = {}
+predictions = {}
+for fusion, model in (('tensor', tensor), ('chunked', chunked)):
+    model.predict(x, batch_size=batch_size) # warm-up
+    start = time.time()
+    predictions[fusion] = model.predict(x, batch_size=batch_size)
+    timings[fusion] = time.time() - start
+for head, expected, actual in zip(tensor.output_names, outputs(predictions['tensor']), outputs(predictions['chunked'])):
+    difference = relative_difference(expected, actual)
+    print('%s predictions: largest relative difference %.2e' % (head, difference))
+    assert difference <= TOLERANCE, 'the chunked model predicts differently with the weights of the tensor model'
+
+expected, actual = weight_gradients(tensor, x), weight_gradients(chunked, x)
+assert sorted(expected) == sorted(actual), 'the chunked model has other weights than the tensor model'
+difference = max(relative_difference(expected[key], actual[key]) for key in expected)
+print('weight gradients: largest relative difference %.2e' % difference)
+assert difference <= TOLERANCE, 'the gradients of the chunked model differ from those of the tensor model'
+
+print('predict %d samples: tensor %.1f ms, chunked %.1f ms' % (batch_size, 1000.0 * timings['tensor'], 1000.0 * timings['chunked']))
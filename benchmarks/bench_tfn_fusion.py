@@ -0,0 +1,82 @@
+# Comparison of the TFN fusion modes (see common/fusion.py): parameter count, training step and inference
+# latency, peak memory, and the accuracy of the best validation epoch after training to early stopping as the scripts do
+# usage: python benchmarks/bench_tfn_fusion.py [--task uno] [--data synthetic|mosi] [--scale 1] [--epochs N] [--threads T] [--output FILE]
+
+from __future__ import print_function
+import argparse
+import datetime
+import multiprocessing
+import os
+import time
+from bench_models import bench_model, environment, peak_rss, preprocess, write_results, _DATA, MAXLEN
+from common.configs import dataset_spec, inputs_for, targets_for, TASKS, TFN_FUSIONS
+
+# bump when the measurements change, so that results of different versions are not compared
+BENCHMARK_VERSION = 3
+
+
+def bench_fusion(job):
+    """Latency, size and accuracy of TFN with one fusion mode, in a fresh worker process"""
+    fusion, task, epochs, threads = job
+    name, results = bench_model(('TFN_' + task, threads, fusion))
+    from keras.callbacks import EarlyStopping
+    from common.models import build_model, BATCH_SIZE, PATIENCE
+    from common.snapshots import BestWeights
+    data = _DATA[dataset_spec('TFN')]
+    x = dict((split, inputs_for('TFN', data, split)) for split in ('train', 'valid', 'test'))
+    y = dict((split, targets_for(task, data, split)) for split in ('train', 'valid', 'test'))
+    model = build_model('TFN', task, MAXLEN, tfn_fusion=fusion)
+    start = time.time()
+    history = model.fit(x['train'], y['train'], batch_size=BATCH_SIZE, epochs=epochs, verbose=0,
+                        validation_data=[x['valid'], y['valid']],
+                        callbacks=[EarlyStopping(monitor='val_loss', patience=PATIENCE), BestWeights('val_loss')])
+    results['training'] = {'seconds': time.time() - start, 'epochs': len(history.history['loss']),
+                           'peak_rss': peak_rss(results['rss_start'])}
+    results['training']['seconds_per_epoch'] = results['training']['seconds'] / results['training']['epochs']
+    results['test'] = dict((metric, float(value)) for metric, value
+                           in zip(model.metrics_names, model.evaluate(x['test'], y['test'], batch_size=BATCH_SIZE, verbose=0)))
+    return fusion, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the fusion modes of the TFN model')
+    parser.add_argument('--task', choices=TASKS, default='uno', help='output heads of the TFN model')
+    parser.add_argument('--data', choices=('synthetic', 'mosi'), default='synthetic',
+                        help='synthetic MOSI-shaped data (common/synthetic.py) or the MOSI corpus from mmdata')
+    parser.add_argument('--scale', type=float, default=1.0, help='size of the synthetic data in multiples of MOSI')
+    parser.add_argument('--epochs', type=int, default=1000, help='maximum number of training epochs, training stops early as in the scripts')
+    parser.add_argument('--threads', type=int, default=None, help='threads of TensorFlow and the BLAS libraries')
+    parser.add_argument('--output', default=None, help='results file, by default benchmarks/results/tfn_fusion_<date>_<revision>.json')
+    args = parser.parse_args()
+    if args.data == 'synthetic':
+        os.environ['MOSI_SYNTHETIC'] = str(args.scale)
+
+    results = {'version': BENCHMARK_VERSION, 'created': datetime.datetime.now().isoformat(), 'environment': environment(),
+               'settings': {'task': args.task, 'data': args.data, 'scale': args.scale if args.data == 'synthetic' else None,
+                            'epochs': args.epochs, 'threads': args.threads},
+               'preprocessing': preprocess([dataset_spec('TFN')]), 'fusions': {}}
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        for fusion, fusion_results in pool.imap(bench_fusion, [(fusion, args.task, args.epochs, args.threads) for fusion in TFN_FUSIONS]):
+            results['fusions'][fusion] = fusion_results
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    print('%-8s %10s %14s %14s %14s %12s %8s %8s' % ('fusion', 'params', 'train step ms', 'predict128 ms', 'epoch s',
+                                                      'peak RSS MB', 'test cc', 'test mae'))
+    for fusion in TFN_FUSIONS:
+        r = results['fusions'][fusion]
+        metrics = dict((metric.replace('main_output_', ''), value) for metric, value in r['test'].items())
+        print('%-8s %10d %14.1f %14.1f %14.2f %12.1f %8.4f %8.4f'
+              % (fusion, r['params'], r['train_step']['median_ms'], r['inference']['128']['median_ms'],
+                 r['training']['seconds_per_epoch'], r['training']['peak_rss'] / 1024.0 / 1024.0,
+                 metrics['pearson_cc'], metrics['mean_absolute_error']))
+    print('Results written to %s' % write_results(results, 'tfn_fusion', args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2 @@
+# Shared data preparation helpers for the unimodal and multimodal scripts
+# for ACL2018 Computational Modeling of Human Multimodal Language Workshop paper
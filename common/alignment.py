@@ -0,0 +1,119 @@
+# Word level alignment of merged mmdata features, run in parallel over videos.
+# Videos are aligned independently, so the video IDs are split into partitions that a
+# process pool aligns with mmdata's own Dataset.align, and the results are merged back.
+
+import copy
+import multiprocessing
+import os
+import warnings
+import numpy as np
+
+# the merged Dataset to align, inherited by forked workers instead of being pickled to them
+_SHARED = {}
+
+
+def default_processes():
+    """Number of alignment processes, MOSI_ALIGN_PROCESSES or the number of cores"""
+    return int(os.environ.get('MOSI_ALIGN_PROCESSES', multiprocessing.cpu_count()))
+
+
+def _subset(dataset, vids, modalities):
+    """Copy of a merged Dataset restricted to the given videos"""
+    subset = copy.copy(dataset)
+    subset.feature_dict = dict((modality, dict((vid, dataset[modality][vid]) for vid in vids if vid in dataset[modality]))
+                               for modality in modalities)
+    return subset
+
+
+def _align_partition(args):
+    vids, anchor, modalities, payload = args
+    dataset = payload if payload is not None else _subset(_SHARED['dataset'], vids, modalities)
+    aligned = dataset.align(anchor)
+    return dict((modality, dict((vid, aligned[modality][vid]) for vid in vids if vid in aligned[modality]))
+                for modality in modalities)
+
+
+def partition_videos(dataset, modalities, anchor, n_partitions, vids=None):
+    """Split the video IDs (all videos of the anchor by default) into n_partitions groups of roughly equal size (number of time steps over all modalities)"""
+    sizes = []
+    for vid in (dataset[anchor].keys() if vids is None else vids):
+        size = sum(len(segment) for modality in modalities if vid in dataset[modality]
+                   for segment in dataset[modality][vid].values())
+        sizes.append((size, vid))
+    # largest videos first, each to the currently smallest partition
+    partitions = [[] for _ in range(n_partitions)]
+    loads = np.zeros(n_partitions)
+    for size, vid in sorted(sizes, key=lambda pair: -pair[0]):
+        i = int(np.argmin(loads))
+        partitions[i].append(vid)
+        loads[i] += size
+    return [partition for partition in partitions if partition]
+
+
+def parallel_align(dataset, anchor, modalities, processes=None, vids=None):
+    """Align a merged Dataset according to the timestamps of anchor using a process pool.
+
+    Returns {modality: {vid: {sid: aligned segment}}}, indexed like the Dataset returned by
+    dataset.align(anchor), with the videos in the order of the anchor modality. If vids is
+    given only those videos are aligned and returned.
+    """
+    processes = processes or default_processes()
+    if vids is not None:
+        wanted = set(vids)
+        vids = [vid for vid in dataset[anchor].keys() if vid in wanted]
+    if not hasattr(dataset, 'feature_dict'):
+        warnings.warn('This mmdata version does not expose Dataset.feature_dict, falling back to serial alignment of all videos')
+        return _restrict(dataset.align(anchor), modalities, vids)
+    if processes <= 1:
+        return dataset.align(anchor) if vids is None else _restrict(_subset(dataset, vids, modalities).align(anchor), modalities, vids)
+
+    # several partitions per process, so that a slow partition does not leave the other processes idle
+    partitions = partition_videos(dataset, modalities, anchor, processes * 4, vids)
+    fork = not hasattr(multiprocessing, 'get_start_method') or multiprocessing.get_start_method() == 'fork'
+    _SHARED['dataset'] = dataset
+    try:
+        jobs = [(part, anchor, modalities, None if fork else _subset(dataset, part, modalities)) for part in partitions]
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_align_partition, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _SHARED.clear()
+
+    merged = dict((modality, {}) for modality in modalities)
+    for result in results:
+        for modality in modalities:
+            merged[modality].update(result[modality])
+    return _restrict(merged, modalities, list(dataset[anchor].keys()) if vids is None else vids)
+
+
+def _restrict(aligned, modalities, vids):
+    """The given videos of an aligned dataset as a plain dict, in the order of vids (all videos if None)"""
+    if vids is None:
+        return aligned
+    return dict((modality, dict((vid, aligned[modality][vid]) for vid in vids if vid in aligned[modality]))
+                for modality in modalities)
+
+
+def same_alignment(a, b, modalities):
+    """True if two aligned datasets hold the same segments and feature values"""
+    for modality in modalities:
+        if set(a[modality].keys()) != set(b[modality].keys()):
+            return False
+        for vid in a[modality].keys():
+            if set(a[modality][vid].keys()) != set(b[modality][vid].keys()):
+                return False
+            for sid in a[modality][vid].keys():
+                seg_a, seg_b = a[modality][vid][sid], b[modality][vid][sid]
+                if len(seg_a) != len(seg_b):
+                    return False
+                for step_a, step_b in zip(seg_a, seg_b):
+                    if step_a[0] != step_b[0] or step_a[1] != step_b[1]:
+                        return False
+                    x, y = np.asarray(step_a[2]), np.asarray(step_b[2])
+                    # NaN values (common in covarep) count as equal
+                    if x.shape != y.shape or not np.all((x == y) | ((x != x) & (y != y))):
+                        return False
+    return True
@@ -0,0 +1,132 @@
+# Length-bucketed batching: utterances of similar word counts are batched together and every
+# batch is padded only to its own longest utterance instead of max_len, so the LSTMs do not run
+# over padding. This needs models built with a variable number of time steps, Input(shape=(None, dim)),
+# i.e. the T, FL, DL and HL graphs; TFN and the A/V unimodal models depend on the fixed max_len.
+
+from __future__ import print_function
+import numpy as np
+
+from common.streaming import BatchStream, prefetch
+
+
+def sequence_lengths(inputs, padding='pre', chunk_size=4096):
+    """Number of steps of every padded sample, i.e. max_len minus the all-zero steps on the padding side.
+
+    inputs is one (N, max_len, dim) array or a list of them (a step counts if it is non-zero in
+    any input). Every sample keeps at least one step.
+    """
+    inputs = inputs if isinstance(inputs, (list, tuple)) else [inputs]
+    n_samples, max_len = inputs[0].shape[:2]
+    lengths = np.zeros(n_samples, dtype='int32')
+    for start in range(0, n_samples, chunk_size):
+        nonzero = np.zeros((min(chunk_size, n_samples - start), max_len), dtype=bool)
+        for x in inputs:
+            nonzero |= np.any(x[start:start + chunk_size] != 0, axis=2)
+        if padding == 'pre':
+            first = np.argmax(nonzero, axis=1)
+        else:
+            first = np.argmax(nonzero[:, ::-1], axis=1)
+        lengths[start:start + chunk_size] = np.where(nonzero.any(axis=1), max_len - first, 0)
+    return np.maximum(lengths, 1)
+
+
+def bucket_batches(lengths, batch_size=128, shuffle=False, rng=None):
+    """Sample indices of every batch, with samples of similar length in the same batch.
+
+    The samples are sorted by length (in random order among equal lengths if shuffle) and cut
+    into batches of batch_size; with shuffle the order of the batches is random as well.
+    """
+    lengths = np.asarray(lengths)
+    if shuffle:
+        rng = rng or np.random
+        order = np.lexsort((rng.rand(len(lengths)), lengths))
+    else:
+        order = np.argsort(lengths, kind='mergesort')
+    batches = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+    if shuffle:
+        batches = [batches[i] for i in rng.permutation(len(batches))]
+    return batches
+
+
+def padded_steps(lengths, batches):
+    """Time steps computed per epoch when every batch is padded to its longest sample"""
+    return int(sum(len(index) * np.max(lengths[index]) for index in batches))
+
+
+class BucketStream(BatchStream):
+    """BatchStream whose batches hold samples of similar length, cut to the longest of them.
+
+    The inputs are the max_len padded arrays; padding is the side they are padded on ('pre' for
+    the aligned data, 'post' for the text-only data), so that only padding is cut off.
+    """
+
+    def __init__(self, inputs, targets=None, lengths=None, batch_size=128, padding='pre', shuffle=False,
+                 merge_inputs=False, seed=None):
+        BatchStream.__init__(self, inputs, targets, batch_size, shuffle, merge_inputs, seed)
+        self.padding = padding
+        self.lengths = np.asarray(lengths) if lengths is not None else sequence_lengths(inputs, padding)
+
+    def _trim(self, x, width):
+        if isinstance(x, list):
+            return [self._trim(array, width) for array in x]
+        return x[:, -width:] if self.padding == 'pre' else x[:, :width]
+
+    def batch(self, index):
+        width = int(np.max(self.lengths[index]))
+        x = self._trim(self._take(self.inputs, index), width)
+        if self.targets is None:
+            return x
+        return x, self._take(self.targets, index)
+
+    def epoch_batches(self):
+        """Sample indices of the batches of the next epoch"""
+        return bucket_batches(self.lengths, self.batch_size, self.shuffle, self.rng)
+
+    def batches(self, epochs=None):
+        epoch = 0
+        while epochs is None or epoch < epochs:
+            for index in self.epoch_batches():
+                # sorted indices keep the reads from memory-mapped files sequential
+                yield self.batch(np.sort(index))
+            epoch += 1
+
+    def saved_steps(self):
+        """(bucketed, fixed length) number of time steps per epoch"""
+        max_len = (self.inputs[0] if isinstance(self.inputs, (list, tuple)) else self.inputs).shape[1]
+        return padded_steps(self.lengths, self.epoch_batches()), self.n_samples * max_len
+
+
+def fit_buckets(model, x_train, y_train, x_valid, y_valid, batch_size=128, epochs=1, callbacks=None,
+                padding='pre', merge_inputs=False, queue_size=10, verbose=1, initial_epoch=0):
+    """model.fit() equivalent with length-bucketed training and validation batches"""
+    train = BucketStream(x_train, y_train, None, batch_size, padding, shuffle=True, merge_inputs=merge_inputs)
+    valid = BucketStream(x_valid, y_valid, None, batch_size, padding, merge_inputs=merge_inputs)
+    bucketed, fixed = train.saved_steps()
+    print('Bucketed batching: %d instead of %d time steps per training epoch (%.1f%% fewer)'
+          % (bucketed, fixed, 100.0 * (fixed - bucketed) / max(fixed, 1)))
+    return model.fit_generator(prefetch(train.batches(), queue_size),
+                               steps_per_epoch=len(train),
+                               epochs=epochs,
+                               verbose=verbose,
+                               callbacks=callbacks,
+                               validation_data=prefetch(valid.batches(), queue_size),
+                               validation_steps=len(valid),
+                               initial_epoch=initial_epoch)
+
+
+def evaluate_buckets(model, x, y, batch_size=128, padding='pre', merge_inputs=False, queue_size=10):
+    """model.evaluate() equivalent with length-bucketed batches"""
+    stream = BucketStream(x, y, None, batch_size, padding, merge_inputs=merge_inputs)
+    return model.evaluate_generator(prefetch(stream.batches(), queue_size), steps=len(stream))
+
+
+def predict_buckets(model, x, batch_size=128, padding='pre', merge_inputs=False, queue_size=10):
+    """model.predict() equivalent with length-bucketed batches, the predictions are in the order of x"""
+    stream = BucketStream(x, None, None, batch_size, padding, merge_inputs=merge_inputs)
+    order = np.concatenate([np.sort(index) for index in stream.epoch_batches()])
+    pred = model.predict_generator(prefetch(stream.batches(epochs=1), queue_size), steps=len(stream))
+    # undo the length ordering of the batches
+    inverse = np.argsort(order)
+    if isinstance(pred, list):
+        return [p[inverse] for p in pred]
+    return pred[inverse]
@@ -0,0 +1,294 @@
+# On-disk cache of the MOSI features, so repeated runs skip downloading, merging, aligning and padding.
+# Two levels are kept under the cache directory:
+#   aligned_<modalities>_<anchor>_<hash>/         word-aligned features in memory-mapped FeatureStores
+#   <modalities>_<anchor>_<max_len>_<hash>/       padded, normalized arrays as .npy files
+# Both are opened with mmap, so concurrent runs share one copy of the data through the page cache.
+# The aligned store is updated incrementally: when the mmdata files change, only the videos
+# whose features are new or different are aligned again and appended to the store.
+
+from __future__ import print_function
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows, updates of the aligned store are not locked
+    fcntl = None
+
+from common.featstore import append_features, open_features, write_features
+from common.normalization import load_normalizers, save_normalizers
+from common.preprocessing import align_features, build_arrays, load_mosi_features, prepare_arrays, segment_ids, split_unaligned, FEATURE_DTYPE, SPLITS
+from common.profiling import phase
+from common.synthetic import synthetic_config
+
+# bump this whenever the preprocessing changes so that old cache files are not reused
+CACHE_VERSION = 6
+DEFAULT_CACHE_DIR = os.environ.get('MOSI_CACHE_DIR', 'cache')
+
+
+def mmdata_dir():
+    """Directory holding the mmdata downloads, by default the installed mmdata package"""
+    if os.environ.get('MMDATA_DIR'):
+        return os.environ['MMDATA_DIR']
+    import mmdata
+    return os.path.dirname(os.path.abspath(mmdata.__file__))
+
+
+def upstream_fingerprint(data_dir=None):
+    """Hash of the names, sizes and modification times of the mmdata files, changes when they are re-downloaded"""
+    if data_dir is None and synthetic_config() is not None:
+        return 'synthetic_' + hashlib.sha1(json.dumps(synthetic_config(), sort_keys=True).encode('utf-8')).hexdigest()
+    data_dir = data_dir or mmdata_dir()
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(data_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(('.py', '.pyc')):
+                continue
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            digest.update(('%s:%d:%d\n' % (os.path.relpath(path, data_dir), stat.st_size, int(stat.st_mtime))).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _key(name, config):
+    config = json.dumps(dict(config, version=CACHE_VERSION), sort_keys=True)
+    return '%s_%s' % (name, hashlib.sha1(config.encode('utf-8')).hexdigest()[:12])
+
+
+def aligned_key(modalities, anchor):
+    """Cache directory name of the aligned features for a modality set and anchor modality"""
+    name = 'aligned_%s_%s' % ('-'.join(sorted(modalities)), anchor or 'unaligned')
+    config = {'modalities': sorted(modalities), 'anchor': anchor}
+    if synthetic_config() is not None:
+        # synthetic data is kept apart from the store of the real corpus
+        name = 'synthetic_' + name
+        config['synthetic'] = synthetic_config()
+    return _key(name, config)
+
+
+def cache_key(modalities, anchor, max_len, revision, storage_dtype=FEATURE_DTYPE):
+    """Cache directory name of the padded arrays for a modality set, anchor modality and sequence length,
+    built from the given revision of the aligned store"""
+    name = '%s_%s_%d' % ('-'.join(sorted(modalities)), anchor or 'unaligned', max_len)
+    return _key(name, {'modalities': sorted(modalities), 'anchor': anchor, 'max_len': max_len, 'revision': revision,
+                       'storage_dtype': np.dtype(storage_dtype).name})
+
+
+def video_fingerprint(features, modalities, vid):
+    """Hash of the raw features[modality][vid] of one video in every modality (segment IDs, times and feature values)"""
+    digest = hashlib.sha1()
+    for modality in sorted(modalities):
+        segments = features[modality][vid] if vid in features[modality] else {}
+        for sid in sorted(segments.keys(), key=str):
+            segment = segments[sid]
+            digest.update(('%s:%s:%d\n' % (modality, sid, len(segment))).encode('utf-8'))
+            if len(segment):
+                digest.update(np.array([(step[0], step[1]) for step in segment], dtype='float64').tobytes())
+                digest.update(np.array([step[2] for step in segment], dtype='float64').tobytes())
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def _lock(path):
+    """Exclusive lock on path, so that only one process updates a cache entry at a time"""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            return json.load(f)
+    except IOError:
+        return None
+
+
+def _write_meta(path, meta):
+    tmp_path = os.path.join(path, 'meta.json.tmp.%d' % os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.rename(tmp_path, os.path.join(path, 'meta.json'))
+
+
+def publish(tmp_path, path):
+    """Move a finished cache entry into place, another process may have written the same entry meanwhile"""
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+        shutil.rmtree(tmp_path)
+
+
+def _write_entry(path, data):
+    """Save the arrays that are not already memory-mapped files in path, the (vid, sid) lists to ids.json
+    and the normalizers to normalizers.npz"""
+    ids = {}
+    for key, value in data.items():
+        if key == 'normalizers':
+            save_normalizers(os.path.join(path, 'normalizers.npz'), value)
+        elif key.startswith('ids_'):
+            ids[key] = [[vid, sid] for (vid, sid) in value]
+        elif isinstance(value, np.memmap):
+            value.flush()
+        else:
+            np.save(os.path.join(path, key + '.npy'), value)
+    with open(os.path.join(path, 'ids.json'), 'w') as f:
+        json.dump(ids, f)
+
+
+def _convert(path, key, array, dtype, chunk_size=4096):
+    """Copy an array into the memory-mapped file path/key.npy with another dtype, chunk_size samples at a time"""
+    converted = np.lib.format.open_memmap(os.path.join(path, key + '.npy'), mode='w+', dtype=dtype, shape=array.shape)
+    for start in range(0, len(array), chunk_size):
+        converted[start:start + chunk_size] = array[start:start + chunk_size]
+    return converted
+
+
+def save_arrays(path, data):
+    """Write the arrays as .npy files into the directory path atomically, the (vid, sid) lists go to ids.json"""
+    tmp_path = path + '.tmp.%d' % os.getpid()
+    os.makedirs(tmp_path)
+    _write_entry(tmp_path, data)
+    publish(tmp_path, path)
+
+
+def load_arrays(path, mmap_mode='r'):
+    """Read arrays written by save_arrays, memory-mapped read-only by default"""
+    data = {}
+    for name in os.listdir(path):
+        if name.endswith('.npy'):
+            data[name[:-4]] = np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+    if os.path.exists(os.path.join(path, 'normalizers.npz')):
+        data['normalizers'] = load_normalizers(os.path.join(path, 'normalizers.npz'))
+    with open(os.path.join(path, 'ids.json')) as f:
+        for key, ids in json.load(f).items():
+            data[key] = [(vid, sid) for (vid, sid) in ids]
+    return data
+
+
+def update_aligned(path, modalities, anchor, fingerprint, processes=None):
+    """Bring the aligned store at path up to date with the mmdata files and return its metadata.
+
+    Videos whose raw features are unchanged since the last update keep their aligned segments,
+    only new or changed videos are aligned and appended to the store. Without an anchor the
+    single modality is stored unaligned.
+    """
+    modalities = list(modalities)
+    if anchor is None and len(modalities) != 1:
+        raise ValueError('Unaligned data can only be prepared for a single modality, got %s' % modalities)
+    meta = _read_meta(path)
+    if meta is None and os.path.isdir(path):
+        shutil.rmtree(path) # an interrupted first build
+
+    features, sentiments, split_vids = load_mosi_features(modalities)
+    # note that even a Dataset with one feature requires explicit indexing of the feature
+    raw = dict((modality, features[modality][modality]) for modality in modalities)
+    key_modality = anchor or modalities[0]
+    vids = list(raw[key_modality].keys())
+    videos = dict((vid, video_fingerprint(raw, modalities, vid)) for vid in vids)
+    known = meta['videos'] if meta is not None else {}
+    changed = [vid for vid in vids if known.get(vid) != videos[vid]]
+    print("Preparing train and test data (%d of %d videos new or changed)..." % (len(changed), len(vids)))
+
+    video_sids = dict((vid, sids) for vid, sids in (meta['video_sids'] if meta is not None else {}).items() if vid in videos)
+    if changed:
+        if anchor is None:
+            dataset = raw
+        else:
+            dataset = align_features(features, modalities, anchor, processes, changed)
+        del features, raw
+        for vid in changed:
+            video_sids[vid] = segment_ids(dataset, vid, modalities, key_modality) if vid in dataset[key_modality] else []
+        ids = [(vid, sid) for vid in changed for sid in video_sids[vid]]
+        if meta is None:
+            write_features(path, dataset, modalities, ids)
+        else:
+            append_features(path, dataset, modalities, ids)
+        del dataset
+
+    if anchor is None:
+        set_ids = split_unaligned([(vid, video_sids[vid]) for vid in vids], split_vids)
+    else:
+        set_ids = dict((split, [(vid, sid) for vid in split_vids[split] for sid in video_sids.get(vid, [])]) for split in SPLITS)
+    scores = dict((split, [sentiments[vid][sid] for (vid, sid) in set_ids[split]]) for split in SPLITS)
+    meta = {'upstream': fingerprint, 'videos': videos, 'video_sids': video_sids,
+            'set_ids': set_ids, 'scores': scores}
+    # the padded arrays are keyed by the revision, so they are rebuilt only if the aligned data changed
+    meta['revision'] = hashlib.sha1(json.dumps([videos, set_ids, scores], sort_keys=True).encode('utf-8')).hexdigest()
+    _write_meta(path, meta)
+    return meta
+
+
+def load_aligned(modalities, anchor='embeddings', cache_dir=DEFAULT_CACHE_DIR, fingerprint=None):
+    """Aligned features as memory-mapped stores, with the (vid, sid) pairs and sentiment scores per split.
+
+    Returns (features, set_ids, scores, revision): the first three as aligned_features() does, and
+    the revision of the store. The stores are built from mmdata on the first call and updated
+    incrementally (see update_aligned) when the mmdata files change.
+    """
+    fingerprint = fingerprint or upstream_fingerprint()
+    path = os.path.join(cache_dir, aligned_key(modalities, anchor))
+    meta = _read_meta(path)
+    if meta is None or meta['upstream'] != fingerprint:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with _lock(path + '.lock'):
+            # another process may have finished the update while we were waiting for the lock
+            meta = _read_meta(path)
+            if meta is None or meta['upstream'] != fingerprint:
+                meta = update_aligned(path, modalities, anchor, fingerprint)
+
+    set_ids = dict((split, [(vid, sid) for (vid, sid) in meta['set_ids'][split]]) for split in SPLITS)
+    return open_features(path, modalities), set_ids, meta['scores'], meta['revision']
+
+
+def load_mosi(modalities, anchor='embeddings', max_len=15, cache_dir=DEFAULT_CACHE_DIR, mmap_mode='r',
+              storage_dtype=FEATURE_DTYPE):
+    """Aligned, padded and normalized MOSI arrays (see build_arrays), read from the cache when possible.
+
+    The cache is keyed by modality set, anchor modality and max_len, and rebuilt when the
+    aligned data changes with the mmdata files. The arrays are memory-mapped read-only unless mmap_mode=None.
+    Pass cache_dir=None to always recompute.
+
+    The feature arrays are float32. With storage_dtype='float16' they are computed in float32
+    but cached and returned as float16, which halves the disk and page cache use again at the
+    cost of a cast to float32 per batch.
+    """
+    if cache_dir is None:
+        return prepare_arrays(modalities, anchor, max_len)
+
+    with phase('aligned features'):
+        features, set_ids, scores, revision = load_aligned(modalities, anchor, cache_dir)
+    path = os.path.join(cache_dir, cache_key(modalities, anchor, max_len, revision, storage_dtype))
+    if os.path.isdir(path):
+        print("Loading preprocessed data from cache " + path)
+    else:
+        # pad straight into memory-mapped files, so the padded arrays never have to fit in memory
+        tmp_path = path + '.tmp.%d' % os.getpid()
+        os.makedirs(tmp_path)
+        convert = np.dtype(storage_dtype) != np.dtype(FEATURE_DTYPE)
+        suffix = '.build.npy' if convert else '.npy'
+        allocate = lambda key, shape, dtype: np.lib.format.open_memmap(os.path.join(tmp_path, key + suffix), mode='w+', dtype=dtype, shape=shape)
+        data = build_arrays(features, modalities, set_ids, scores, max_len, 'pre' if anchor else 'post', allocate=allocate)
+        if convert:
+            # padding and normalization are done in float32, only the normalized values are stored in storage_dtype
+            for key in [key for key in data if key.startswith('x_')]:
+                data[key] = _convert(tmp_path, key, data[key], storage_dtype)
+                os.remove(os.path.join(tmp_path, key + '.build.npy'))
+        _write_entry(tmp_path, data)
+        del data
+        publish(tmp_path, path)
+        print("Preprocessed data saved to cache " + path)
+    return load_arrays(path, mmap_mode)
@@ -0,0 +1,141 @@
+# Gradient checkpointing (rematerialization) of parts of a Keras graph. The activations between the
+# inputs and the output of a segment are not kept for the backward pass but computed again from the
+# segment inputs when the gradients are needed, trading compute for memory, e.g. to train TFN with
+# larger batches. The layers of a segment stay in the model, so the weights, the layer names and the
+# saved weight files are the same with and without checkpointing. Needs the TensorFlow backend
+# (TensorFlow 1.7 or later, for tf.custom_gradient).
+
+import numpy as np
+from keras import backend as K
+from keras.engine.topology import Layer
+
+
+def _inbound_nodes(layer):
+    # renamed to _inbound_nodes in Keras 2.1.3
+    return getattr(layer, '_inbound_nodes', None) or layer.inbound_nodes
+
+
+def _walk(output, sources, visit):
+    # calls visit(layer, node, input values) for every node from the sources to output (or a list of
+    # outputs), inputs first
+    values = dict((id(keras_tensor), tensor) for keras_tensor, tensor in sources)
+
+    def value(keras_tensor):
+        if id(keras_tensor) not in values:
+            if not hasattr(keras_tensor, '_keras_history'):
+                raise ValueError('%s is not computed from the inputs of the segment' % keras_tensor)
+            layer, node_index, _ = keras_tensor._keras_history
+            node = _inbound_nodes(layer)[node_index]
+            if not node.inbound_layers:
+                raise ValueError('The segment reaches the input %s, which is not one of its inputs' % layer.name)
+            inputs = [value(_inbound_nodes(inbound)[i].output_tensors[j])
+                      for inbound, i, j in zip(node.inbound_layers, node.node_indices, node.tensor_indices)]
+            outputs = visit(layer, node, inputs)
+            outputs = outputs if isinstance(outputs, list) else [outputs]
+            for keras_output, output_tensor in zip(node.output_tensors, outputs):
+                values[id(keras_output)] = output_tensor
+        return values[id(keras_tensor)]
+
+    return [value(keras_tensor) for keras_tensor in output] if isinstance(output, list) else value(output)
+
+
+def segment_layers(output, sources):
+    """The layers between the Keras tensors sources and output"""
+    layers = []
+
+    def visit(layer, node, inputs):
+        if layer not in layers:
+            layers.append(layer)
+        return [None] * len(node.output_tensors)
+
+    _walk(output, [(source, None) for source in sources], visit)
+    return layers
+
+
+def replay(output, sources):
+    """The Keras tensor output computed again, with new ops, from the given sources.
+
+    sources is a list of (Keras tensor, tensor) replacing the Keras tensors the segment starts
+    from. Every layer between them and output is called again on the new tensors.
+    """
+    def visit(layer, node, inputs):
+        return layer.call(inputs if len(inputs) > 1 else inputs[0], **(node.arguments or {}))
+
+    return _walk(output, sources, visit)
+
+
+def reconnect(outputs, sources):
+    """The Keras tensors outputs computed again by the same layers from other Keras tensors.
+
+    sources is a list of (Keras tensor, Keras tensor), the second replacing the first. Every layer
+    between them and outputs is called again, so the new graph shares the weights of the old one,
+    e.g. for a model of the upper part of another one.
+    """
+    def visit(layer, node, inputs):
+        return layer(inputs if len(inputs) > 1 else inputs[0], **(node.arguments or {}))
+
+    return _walk(outputs, sources, visit)
+
+
+class Recompute(Layer):
+    """The output of a segment of the graph, with its activations recomputed in the backward pass.
+
+    Called on the segment inputs followed by the segment output, e.g.
+        fused = Recompute(name='TFN_checkpoint')([covarep_layer_5, facet_layer_5, text_layer_3, TFN_layer_2])
+    and used in place of the segment output. The forward pass computes the segment once more
+    without keeping its activations, the backward pass computes them again from the inputs. The
+    layers of the segment draw the same dropout masks in both passes, as the op seeds of Keras'
+    dropout come from numpy's random state, which is restored for the second pass (each training
+    step runs both passes once, so the random streams of the two dropout ops stay in step).
+    """
+
+    def __init__(self, **kwargs):
+        super(Recompute, self).__init__(**kwargs)
+        self.segment = None
+
+    def __call__(self, inputs, **kwargs):
+        if self.segment is None:
+            # the Keras tensors the segment is replayed between
+            self.segment = (list(inputs[:-1]), inputs[-1])
+        return super(Recompute, self).__call__(inputs, **kwargs)
+
+    def call(self, inputs):
+        if K.backend() != 'tensorflow':
+            raise ValueError('Gradient checkpointing needs the TensorFlow backend')
+        import tensorflow as tf
+        sources, output = self.segment
+        inputs = list(inputs[:-1])
+        weights = [weight for layer in segment_layers(output, sources) for weight in layer.trainable_weights]
+        random_state = np.random.get_state()
+
+        @tf.custom_gradient
+        def segment(*args):
+            result = replay(output, list(zip(sources, args[:len(inputs)])))
+
+            def gradient(result_gradient, variables=None):
+                # recompute once the gradient of the output is there, not ahead of the backward pass
+                with tf.control_dependencies([result_gradient]):
+                    args_again = [tf.identity(arg) for arg in args[:len(inputs)]]
+                state = np.random.get_state()
+                np.random.set_state(random_state)
+                try:
+                    result_again = replay(output, list(zip(sources, args_again)))
+                finally:
+                    np.random.set_state(state)
+                # with respect to the weights as the replayed layers read them (the snapshot of a variable
+                # or its handle), which need not be the weight tensors passed in
+                gradients = tf.gradients(result_again, args_again + weights, grad_ys=result_gradient)
+                if variables is not None:
+                    # the weights get their gradients as arguments, not a second time as the variables read in the segment
+                    return gradients, [None] * len(variables)
+                return gradients
+
+            return result, gradient
+
+        return segment(*(inputs + weights))
+
+    def compute_output_shape(self, input_shape):
+        return input_shape[-1]
+
+    def compute_mask(self, inputs, mask=None):
+        return None
@@ -0,0 +1,89 @@
+# Names of the unimodal and multimodal configurations and the data they are trained on.
+# Kept free of Keras, so that processes that only schedule runs do not import it.
+
+import numpy as np
+
+FUSION_MODELS = ('FL', 'DL', 'HL', 'TFN')
+UNIMODAL_MODELS = ('A', 'V', 'T')
+TASKS = ('uno', 'pol', 'int', 'tri')
+# models whose graph works with any number of time steps, see common.bucketing
+VARIABLE_LENGTH_MODELS = ('FL', 'DL', 'HL', 'T')
+# fusion of the TFN models: the outer product as in the scripts, its low-rank approximation, or the
+# outer product formed a chunk at a time (common.fusion)
+TFN_FUSIONS = ('tensor', 'lowrank', 'chunked')
+# parts of the models whose activations can be recomputed in the backward pass instead of kept
+# (gradient checkpointing, common.checkpointing): the dense stacks of the vocal and visual branches,
+# and the fusion from the branch outputs to the fusion LSTM output (with the TFN tensor)
+CHECKPOINT_SEGMENTS = {'DL': ('branches', 'fusion'), 'HL': ('branches', 'fusion'), 'TFN': ('branches', 'fusion')}
+# the branch layers of the fusion models that can start from the trunk layers of the unimodal models
+# (common.warmstart), in the order of the unimodal layers
+_BRANCHES = {'A': ('covarep_layer_3', 'covarep_layer_4', 'covarep_layer_5'),
+             'V': ('facet_layer_3', 'facet_layer_4', 'facet_layer_5'),
+             'T': ('text_layer_2', 'text_layer_3')}
+WARM_START_BRANCHES = {'DL': _BRANCHES, 'TFN': _BRANCHES,
+                       'HL': {'A': ('covarep_layer_3', 'covarep_layer_4', 'covarep_layer_5'),
+                              'V': ('facet_layer_4', 'facet_layer_5', 'facet_layer_6'),
+                              'T': ('text_layer_3', 'text_layer_4')}}
+
+# the branch outputs the fusion layers of a model start from, which are computed once and cached when
+# the branches stay fixed during training (common.encodings)
+ENCODER_OUTPUTS = {'DL': ('covarep_layer_5', 'facet_layer_5', 'text_layer_3'), 'TFN': ('covarep_layer_5', 'facet_layer_5', 'text_layer_3'),
+                   'HL': ('text_layer_4',)}
+
+
+def parse_name(name):
+    """(model, task) of a configuration name as used by the scripts, e.g. 'DL_tri' or 'A_unimodal_pol'"""
+    parts = name.split('_')
+    model, task = parts[0], parts[-1]
+    if (model not in FUSION_MODELS + UNIMODAL_MODELS or task not in TASKS
+            or parts[1:-1] != (['unimodal'] if model in UNIMODAL_MODELS else [])):
+        raise ValueError('Unknown configuration %r, expected e.g. DL_tri or A_unimodal_pol' % name)
+    return model, task
+
+
+def config_name(model, task):
+    return '%s_unimodal_%s' % (model, task) if model in UNIMODAL_MODELS else '%s_%s' % (model, task)
+
+
+def all_names():
+    """Names of all configurations, the fusion models first"""
+    return [config_name(model, task) for model in FUSION_MODELS + UNIMODAL_MODELS for task in TASKS]
+
+
+def dataset_spec(model):
+    """(modalities, anchor) of the data a model is trained on, as the scripts load it"""
+    if model == 'A':
+        return ('embeddings', 'covarep'), 'embeddings'
+    if model == 'V':
+        return ('embeddings', 'facet'), 'embeddings'
+    if model == 'T':
+        return ('embeddings',), None
+    return ('embeddings', 'facet', 'covarep'), 'embeddings'
+
+
+def inputs_for(model, data, split, merge=True):
+    """The model inputs of a split, from the arrays returned by load_mosi.
+
+    With merge=False the FL inputs are the list of the modality arrays, to be concatenated per
+    batch (see common.streaming).
+    """
+    if model == 'FL' and merge:
+        # Early fusion - concatenate the input features of all modalities
+        return np.concatenate((data['x_V_' + split], data['x_A_' + split], data['x_T_' + split]), axis=2)
+    if model == 'FL':
+        return [data['x_V_' + split], data['x_A_' + split], data['x_T_' + split]]
+    if model in UNIMODAL_MODELS:
+        return data['x_%s_%s' % (model, split)]
+    return [data['x_A_' + split], data['x_V_' + split], data['x_T_' + split]]
+
+
+def targets_for(task, data, split):
+    """The targets of a split for the output heads of a task"""
+    y, z1, z2 = data['y_' + split], data['z1_' + split], data['z2_' + split]
+    if task == 'uno':
+        return y
+    if task == 'pol':
+        return {'main_output': y, 'aux_output': z1}
+    if task == 'int':
+        return {'main_output': y, 'aux_output': z2}
+    return {'main_output': y, 'aux_output_1': z1, 'aux_output_2': z2}
@@ -0,0 +1,89 @@
+# Training of the fusion layers on cached branch outputs. When the vocal, visual and verbal branches
+# of a DL, HL or TFN model stay fixed, e.g. warm-started from the unimodal models while the fusion
+# is tuned, they compute the same outputs in every epoch. These are computed once per split and
+# stored as memory-mapped .npy files under the cache directory, and only the fusion layers
+# (DL_layer_*, HL_layer_*, TFN_layer_*) and the output heads are trained on them. The entries are
+# keyed by the branch weights and the input data, so runs with the same branches share them.
+
+from __future__ import print_function
+import hashlib
+import os
+import numpy as np
+from keras import backend as K
+from keras.layers import Input
+from keras.models import Model
+
+from common.cache import publish, DEFAULT_CACHE_DIR
+from common.checkpointing import reconnect
+from common.configs import ENCODER_OUTPUTS
+from common.preprocessing import SPLITS
+
+
+def encoder_outputs(model, model_type):
+    """The Keras tensors of the branch outputs the fusion layers of a model start from"""
+    return [model.get_layer(name).output for name in ENCODER_OUTPUTS[model_type]]
+
+
+def fusion_model(model, model_type):
+    """Model of the fusion layers and output heads of model, with the branch outputs as its inputs.
+
+    It is made of the layers of model, so training it trains them in model as well.
+    """
+    sources = encoder_outputs(model, model_type)
+    inputs = [Input(shape=K.int_shape(source)[1:], dtype='float32', name='%s_encoding' % name)
+              for source, name in zip(sources, ENCODER_OUTPUTS[model_type])]
+    return Model(inputs=inputs, outputs=reconnect(model.outputs, list(zip(sources, inputs))))
+
+
+def _update(digest, array, chunk_size=4096):
+    digest.update(str(array.shape).encode('utf-8'))
+    if isinstance(array, np.memmap) and array.filename:
+        # the files of the data cache are named by their content
+        stat = os.stat(array.filename)
+        digest.update(('%s:%d:%d\n' % (os.path.abspath(array.filename), stat.st_size, int(stat.st_mtime))).encode('utf-8'))
+    else:
+        for start in range(0, len(array), chunk_size):
+            digest.update(np.ascontiguousarray(array[start:start + chunk_size]).tobytes())
+
+
+def encodings_key(model_type, encoder, x):
+    """Cache directory name of the branch outputs of an encoder model on the inputs x ({split: inputs})"""
+    digest = hashlib.sha1()
+    for weights in encoder.get_weights():
+        _update(digest, weights)
+    for split in SPLITS:
+        for array in x[split]:
+            _update(digest, array)
+    return 'encodings_%s_%s' % (model_type, digest.hexdigest()[:12])
+
+
+def encode(model, model_type, x, batch_size=128, cache_dir=DEFAULT_CACHE_DIR, chunk_size=4096):
+    """{split: [branch outputs]} of the model inputs x ({split: inputs}), memory-mapped from the cache.
+
+    The branches are computed in inference mode, i.e. without the dropout on their inputs, and
+    chunk_size samples at a time straight into the memory-mapped files.
+    """
+    names = ENCODER_OUTPUTS[model_type]
+    encoder = Model(inputs=model.inputs, outputs=encoder_outputs(model, model_type))
+    path = os.path.join(cache_dir, encodings_key(model_type, encoder, x))
+    if os.path.isdir(path):
+        print('Loading the branch outputs from cache ' + path)
+    else:
+        tmp_path = path + '.tmp.%d' % os.getpid()
+        os.makedirs(tmp_path)
+        for split in SPLITS:
+            n_samples = len(x[split][0])
+            encodings = [np.lib.format.open_memmap(os.path.join(tmp_path, '%s_%s.npy' % (split, name)), mode='w+', dtype='float32',
+                                                   shape=(n_samples,) + K.int_shape(output)[1:])
+                         for name, output in zip(names, encoder.outputs)]
+            for start in range(0, n_samples, chunk_size):
+                outputs = encoder.predict([array[start:start + chunk_size] for array in x[split]], batch_size=batch_size)
+                for encoding, output in zip(encodings, outputs if isinstance(outputs, list) else [outputs]):
+                    encoding[start:start + chunk_size] = output
+            for encoding in encodings:
+                encoding.flush()
+            del encodings
+        publish(tmp_path, path)
+        print('Branch outputs saved to cache ' + path)
+    return dict((split, [np.load(os.path.join(path, '%s_%s.npy' % (split, name)), mmap_mode='r') for name in names])
+                for split in SPLITS)
@@ -0,0 +1,391 @@
+# Train and evaluate any of the unimodal and multimodal configurations in one process, with the
+# same outputs as the scripts (output_<name>.txt, pred_<name>.txt and the saved weights).
+# Every dataset is loaded once and shared by all configurations that use it.
+
+from __future__ import print_function
+import gc
+import os
+import sys
+import pandas as pd
+from keras.callbacks import EarlyStopping
+from keras import backend as K
+
+from common.bucketing import fit_buckets, evaluate_buckets, predict_buckets
+from common.cache import load_mosi
+from common.configs import config_name, dataset_spec, inputs_for, parse_name, targets_for, ENCODER_OUTPUTS, VARIABLE_LENGTH_MODELS, WARM_START_BRANCHES
+from common.encodings import encode, fusion_model
+from common.instrumentation import instrument
+from common.models import build_model, compile_model, optimizer, BATCH_SIZE, NB_EPOCH, PATIENCE
+from common.normalization import normalizers_path, save_normalizers
+from common.preprocessing import SPLITS
+from common.profiling import phase, profiler
+from common.snapshots import BestWeights, Snapshot
+from common.streaming import fit_stream, evaluate_stream, predict_stream
+from common.variants import output_name, Variants, VariantStopping
+from common.warmstart import FreezeLayers, warm_start as warm_start_branches
+
+SPLIT_TITLES = {'train': 'Train', 'valid': 'Validation', 'test': 'Test'}
+SPLIT_NAMES = {'train': 'train', 'valid': 'valisation', 'test': 'test'}
+
+
+def report(task, split, scores):
+    """Print the evaluation results of a split as the scripts do and return them as a dict"""
+    title = SPLIT_TITLES[split]
+    if task == 'uno':
+        results = {'loss': scores[0], 'cc': scores[1], 'mae': scores[2]}
+    elif task in ('pol', 'int'):
+        results = {'loss': scores[0], 'cc': scores[3], 'mae': scores[4], task + '_accuracy': scores[5]}
+    else:
+        results = {'loss': scores[0], 'cc': scores[4], 'mae': scores[5], 'pol_accuracy': scores[6], 'int_accuracy': scores[7]}
+    print('Valence %s cc:' % title, results['cc'])
+    print('Valence %s mae:' % title, results['mae'])
+    if task == 'tri':
+        print('Binary Polarity %s accuracy:' % title, results['pol_accuracy'])
+        print('Intensity %s accuracy:' % title, results['int_accuracy'])
+    return dict((key, float(value)) for key, value in results.items())
+
+
+def run_experiment(name, data, output_dir='prediction', maxlen=15, bucketing=False, verbose=1, tfn_fusion='tensor', checkpoint=(),
+                   batch_size=BATCH_SIZE, accumulation_steps=1, snapshot_dir=None, snapshot_period=1, warm_start=None,
+                   freeze_epochs=0, cache_encodings=False, streaming=False):
+    """Build, train and evaluate one configuration (e.g. 'DL_tri') on the arrays returned by load_mosi.
+
+    The log, the timing records and phase timeline, the test predictions and the weights are
+    written to output_dir as the scripts do.
+    With bucketing the model is trained on length-bucketed batches (common.bucketing). Otherwise with
+    streaming the batches are read lazily from the memory-mapped arrays through a prefetch queue
+    (common.streaming), and the FL inputs are concatenated per batch instead of for the whole split.
+    tfn_fusion selects the fusion of the TFN models (see common.fusion), checkpoint the segments of
+    the model whose activations are recomputed in the backward pass (see common.checkpointing).
+    The model is trained and evaluated on batches of batch_size, and with accumulation_steps above 1
+    updated once every accumulation_steps batches, i.e. with an effective batch of
+    batch_size * accumulation_steps (see common.optimizers).
+    The model is left with the weights of the epoch with the best validation loss, which are
+    evaluated, used for the predictions and saved. The training state is saved every snapshot_period epochs (0: never) to
+    snapshot_dir/snapshot_<name>.npz (output_dir by default), and a run that finds the snapshot of an
+    interrupted run there continues from it (see common.snapshots).
+    With warm_start, a directory with the saved A, V and T unimodal models of the same task, the
+    branches of a DL, HL or TFN model start from their weights, kept fixed for the first
+    freeze_epochs epochs (see common.warmstart). With cache_encodings the warm-started branches stay
+    as they are: their outputs are computed once, cached, and only the fusion layers and output heads
+    are trained and evaluated on them (see common.encodings).
+    Returns {split: {metric: value}}.
+    """
+    model_type, task = parse_name(name)
+    if bucketing and model_type not in VARIABLE_LENGTH_MODELS:
+        raise ValueError('%s does not support length-bucketed batches' % name)
+    if warm_start and model_type not in WARM_START_BRANCHES:
+        raise ValueError('%s has no branches to warm-start' % name)
+    if cache_encodings:
+        if model_type not in ENCODER_OUTPUTS:
+            raise ValueError('%s has no branch outputs to cache' % name)
+        if not warm_start:
+            raise ValueError('The branches of %s are not trained with cached encodings, they need a warm start' % name)
+        if bucketing or freeze_epochs or 'branches' in checkpoint:
+            raise ValueError('The branches of %s are fixed with cached encodings, they can not be bucketed, '
+                             'unfrozen or checkpointed' % name)
+    # the text-only data is padded at the end, the aligned data at the front
+    padding = 'post' if model_type == 'T' else 'pre'
+    streaming = streaming and not bucketing
+    merge_inputs = streaming and model_type == 'FL'
+    x = dict((split, inputs_for(model_type, data, split, merge=not merge_inputs)) for split in SPLITS)
+    y = dict((split, targets_for(task, data, split)) for split in SPLITS)
+
+    # save outputs to a log file in case there is a broken pipe
+    stdout = sys.stdout
+    logger = open(os.path.join(output_dir, 'output_%s.txt' % name), 'w')
+    sys.stdout = logger
+    since = profiler.elapsed()
+    try:
+        print("Data preprocessing finished! Begin compiling and training model.")
+        # the whole model, whose weights are saved, and the model that is trained, the same unless the encodings are cached
+        full_model = model = build_model(model_type, task, maxlen, variable_length=bucketing, tfn_fusion=tfn_fusion,
+                                         checkpoint=checkpoint, accumulation_steps=accumulation_steps)
+        if warm_start:
+            with phase('warm start'):
+                branches = warm_start_branches(full_model, model_type, task, warm_start, maxlen)
+
+        # if the validation loss isn't decreasing for a number of epochs, stop training to prevent over-fitting
+        early_stopping = EarlyStopping(monitor='val_loss', patience=PATIENCE)
+        # the model is evaluated, used for the predictions and saved with the weights of the best validation loss
+        best_weights = BestWeights('val_loss')
+        callbacks, initial_epoch = [early_stopping, best_weights], 0
+        if snapshot_period:
+            snapshot_dir = snapshot_dir or output_dir
+            if not os.path.isdir(snapshot_dir):
+                os.makedirs(snapshot_dir)
+            snapshot = Snapshot(os.path.join(snapshot_dir, 'snapshot_%s.npz' % name), early_stopping, best_weights,
+                                snapshot_period, full_model)
+            callbacks.append(snapshot)
+            initial_epoch = snapshot.resume(full_model)
+        if cache_encodings:
+            with phase('encode'):
+                x = encode(full_model, model_type, x, batch_size)
+            with phase('compile'):
+                model = compile_model(fusion_model(full_model, model_type), task, optimizer(accumulation_steps))
+        if warm_start and freeze_epochs:
+            callbacks.insert(0, FreezeLayers(model, branches, freeze_epochs))
+        # record step times, throughput and epoch durations of fit/evaluate/predict
+        instrument(model, os.path.join(output_dir, 'timing_%s.jsonl' % name))
+
+        print('Training...')
+        if cache_encodings:
+            print('Training the fusion layers and output heads on the cached branch outputs')
+        if accumulation_steps > 1:
+            print('Batches of %d, accumulated over %d batches (effective batch size %d)'
+                  % (batch_size, accumulation_steps, batch_size * accumulation_steps))
+        profiler.switch('fit')
+        if bucketing:
+            fit_buckets(model, x['train'], y['train'], x['valid'], y['valid'], batch_size, NB_EPOCH,
+                        callbacks=callbacks, padding=padding, verbose=verbose, initial_epoch=initial_epoch)
+        elif streaming:
+            fit_stream(model, x['train'], y['train'], x['valid'], y['valid'], batch_size, NB_EPOCH,
+                       callbacks=callbacks, merge_inputs=merge_inputs, verbose=verbose, initial_epoch=initial_epoch)
+        else:
+            model.fit(x['train'], y['train'],
+                      batch_size=batch_size,
+                      epochs=NB_EPOCH,
+                      validation_data=[x['valid'], y['valid']],
+                      callbacks=callbacks,
+                      initial_epoch=initial_epoch,
+                      verbose=verbose)
+
+        # Evaluation
+        results = {}
+        for split in SPLITS:
+            profiler.switch('evaluate ' + split)
+            print(('\n\n\n\n' if split == 'train' else '\n') + 'Evaluating on %s set...' % SPLIT_NAMES[split])
+            if bucketing:
+                scores = evaluate_buckets(model, x[split], y[split], batch_size, padding)
+            elif streaming:
+                scores = evaluate_stream(model, x[split], y[split], batch_size, merge_inputs)
+            else:
+                scores = model.evaluate(x[split], y[split], batch_size=batch_size)
+            results[split] = report(task, split, scores)
+
+        # output predictions
+        print('Printing predictions...')
+        profiler.switch('predict')
+        if bucketing:
+            tst_pred = predict_buckets(model, x['test'], batch_size, padding)
+        elif streaming:
+            tst_pred = predict_stream(model, x['test'], batch_size, merge_inputs)
+        else:
+            tst_pred = model.predict(x['test'])
+        profiler.switch('csv')
+        tst_df = pd.DataFrame(tst_pred[0] if isinstance(tst_pred, list) else tst_pred)
+        tst_df.to_csv(os.path.join(output_dir, 'pred_%s.txt' % name), index=False, header=False)
+
+        # save the weights with the feature normalizers fitted on the training set
+        profiler.switch('save weights')
+        weights_file = os.path.join(output_dir, 'weights_%s.h5' % name)
+        full_model.save_weights(weights_file)
+        save_normalizers(normalizers_path(weights_file), data['normalizers'])
+
+        profiler.stop()
+        profiler.write(os.path.join(output_dir, 'profile_%s.jsonl' % name), since)
+        print('\n' + profiler.summary(since))
+        print('\nDone!')
+        return results
+    finally:
+        profiler.stop()
+        # Flush outputs to log file
+        sys.stdout = stdout
+        logger.flush()
+        logger.close()
+
+
+def run_variants(model_type, tasks, data, output_dir='prediction', maxlen=15, bucketing=False, verbose=1, tfn_fusion='tensor',
+                 checkpoint=(), batch_size=BATCH_SIZE, accumulation_steps=1, snapshot_dir=None, snapshot_period=1,
+                 warm_start=None, freeze_epochs=0, streaming=False):
+    """Train and evaluate the variants of a model for several tasks (e.g. 'FL' and ('uno', 'pol', 'int', 'tri')) in one run.
+
+    Every variant has its own weights, output heads and loss weights, but they are trained,
+    evaluated and used for the predictions on the same batches (see common.variants). Each stops
+    and keeps its best weights as in run_experiment, and its evaluation, test predictions and
+    weights are written to output_dir as run_experiment writes them for the variant alone
+    (output_<name>.txt, pred_<name>.txt, weights_<name>.h5). The training log, the timing records,
+    the phase timeline and the snapshots are those of the run, e.g. output_FL_uno-pol-int-tri.txt.
+    The other arguments are those of run_experiment. Returns {name: {split: {metric: value}}}.
+    """
+    if len(tasks) < 2 or len(set(tasks)) != len(tasks):
+        raise ValueError('Training variants needs two or more different tasks, got %s' % ', '.join(tasks))
+    if bucketing and model_type not in VARIABLE_LENGTH_MODELS:
+        raise ValueError('%s does not support length-bucketed batches' % model_type)
+    if warm_start and model_type not in WARM_START_BRANCHES:
+        raise ValueError('%s has no branches to warm-start' % model_type)
+    run = config_name(model_type, '-'.join(tasks))
+    # the text-only data is padded at the end, the aligned data at the front
+    padding = 'post' if model_type == 'T' else 'pre'
+    streaming = streaming and not bucketing
+    merge_inputs = streaming and model_type == 'FL'
+    x = dict((split, inputs_for(model_type, data, split, merge=not merge_inputs)) for split in SPLITS)
+
+    # save outputs to a log file in case there is a broken pipe
+    stdout = sys.stdout
+    logger = open(os.path.join(output_dir, 'output_%s.txt' % run), 'w')
+    sys.stdout = logger
+    since = profiler.elapsed()
+    try:
+        print("Data preprocessing finished! Begin compiling and training model.")
+        variants = Variants(model_type, tasks, maxlen, variable_length=bucketing, tfn_fusion=tfn_fusion, checkpoint=checkpoint,
+                            accumulation_steps=accumulation_steps)
+        model = variants.model
+        y = dict((split, variants.targets(data, split)) for split in SPLITS)
+        branches = []
+        if warm_start:
+            with phase('warm start'):
+                for name, variant in variants.variants.items():
+                    branches += warm_start_branches(variant, model_type, parse_name(name)[1], warm_start, maxlen)
+
+        # every variant stops when its validation loss isn't decreasing, with the weights of its best validation loss
+        stopping = VariantStopping(variants, PATIENCE)
+        callbacks, initial_epoch = [stopping], 0
+        if snapshot_period:
+            snapshot_dir = snapshot_dir or output_dir
+            if not os.path.isdir(snapshot_dir):
+                os.makedirs(snapshot_dir)
+            snapshot = Snapshot(os.path.join(snapshot_dir, 'snapshot_%s.npz' % run), stopping.early_stopping, stopping.best_weights,
+                                snapshot_period)
+            callbacks.append(snapshot)
+            initial_epoch = snapshot.resume(model)
+        if freeze_epochs and branches:
+            callbacks.insert(0, FreezeLayers(model, branches, freeze_epochs))
+        # record step times, throughput and epoch durations of fit/evaluate/predict
+        instrument(model, os.path.join(output_dir, 'timing_%s.jsonl' % run))
+
+        print('Training %s...' % ', '.join(variants.variants))
+        if accumulation_steps > 1:
+            print('Batches of %d, accumulated over %d batches (effective batch size %d)'
+                  % (batch_size, accumulation_steps, batch_size * accumulation_steps))
+        profiler.switch('fit')
+        if bucketing:
+            fit_buckets(model, x['train'], y['train'], x['valid'], y['valid'], batch_size, NB_EPOCH,
+                        callbacks=callbacks, padding=padding, verbose=verbose, initial_epoch=initial_epoch)
+        elif streaming:
+            fit_stream(model, x['train'], y['train'], x['valid'], y['valid'], batch_size, NB_EPOCH,
+                       callbacks=callbacks, merge_inputs=merge_inputs, verbose=verbose, initial_epoch=initial_epoch)
+        else:
+            model.fit(x['train'], y['train'],
+                      batch_size=batch_size,
+                      epochs=NB_EPOCH,
+                      validation_data=[x['valid'], y['valid']],
+                      callbacks=callbacks,
+                      initial_epoch=initial_epoch,
+                      verbose=verbose)
+
+        # evaluate all variants at once, the scores are split by variant
+        scores = {}
+        for split in SPLITS:
+            profiler.switch('evaluate ' + split)
+            if bucketing:
+                scores[split] = variants.scores(evaluate_buckets(model, x[split], y[split], batch_size, padding))
+            elif streaming:
+                scores[split] = variants.scores(evaluate_stream(model, x[split], y[split], batch_size, merge_inputs))
+            else:
+                scores[split] = variants.scores(model.evaluate(x[split], y[split], batch_size=batch_size))
+        profiler.switch('predict')
+        if bucketing:
+            tst_pred = predict_buckets(model, x['test'], batch_size, padding)
+        elif streaming:
+            tst_pred = predict_stream(model, x['test'], batch_size, merge_inputs)
+        else:
+            tst_pred = model.predict(x['test'])
+        tst_pred = dict(zip(model.output_names, tst_pred))
+
+        # the outputs of every variant as the scripts write them
+        results = {}
+        for name, variant in variants.variants.items():
+            task = parse_name(name)[1]
+            with open(os.path.join(output_dir, 'output_%s.txt' % name), 'w') as variant_logger:
+                sys.stdout = variant_logger
+                print('Trained with %s, see output_%s.txt' % (', '.join(variants.variants), run))
+                results[name] = {}
+                for split in SPLITS:
+                    print(('\n\n\n\n' if split == 'train' else '\n') + 'Evaluating on %s set...' % SPLIT_NAMES[split])
+                    results[name][split] = report(task, split, scores[split][name])
+                print('Printing predictions...')
+                profiler.switch('csv')
+                tst_df = pd.DataFrame(tst_pred[output_name(name, 'main_output')])
+                tst_df.to_csv(os.path.join(output_dir, 'pred_%s.txt' % name), index=False, header=False)
+                # save the weights with the feature normalizers fitted on the training set
+                profiler.switch('save weights')
+                weights_file = os.path.join(output_dir, 'weights_%s.h5' % name)
+                variant.save_weights(weights_file)
+                save_normalizers(normalizers_path(weights_file), data['normalizers'])
+                print('\nDone!')
+            sys.stdout = logger
+
+        profiler.stop()
+        profiler.write(os.path.join(output_dir, 'profile_%s.jsonl' % run), since)
+        print('\n' + profiler.summary(since))
+        print('\nDone!')
+        return results
+    finally:
+        profiler.stop()
+        # Flush outputs to log file
+        sys.stdout = stdout
+        logger.flush()
+        logger.close()
+
+
+def run_experiments(names, output_dir='prediction', maxlen=15, bucketing=False, verbose=1, tfn_fusion='tensor', checkpoint=None,
+                    batch_size=BATCH_SIZE, accumulation_steps=1, snapshot_period=1, warm_start=None, freeze_epochs=0,
+                    cache_encodings=False, variants=False, streaming=False):
+    """Run a list of configurations in sequence, loading every dataset only once.
+
+    The Keras session is cleared after every model, so the graphs of finished models do not
+    accumulate. bucketing applies to the configurations that support it, streaming to the others.
+    checkpoint maps model
+    types to the segments to checkpoint, e.g. {'TFN': ('fusion',)}. batch_size, accumulation_steps
+    and snapshot_period apply to every configuration, warm_start and freeze_epochs to the DL, HL and
+    TFN models, as in run_experiment. With cache_encodings the DL, HL and TFN models train only their fusion
+    layers and output heads on the cached outputs of the warm-started branches, without bucketing.
+    With variants the configurations of the same model for different tasks are trained in one run
+    (see run_variants), without cache_encodings. Returns {name: results}.
+    """
+    if variants and cache_encodings:
+        raise ValueError('Variants are trained without cached encodings')
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    # (model, tasks) of every run, the tasks of a model together with variants
+    runs = []
+    for name in names:
+        model_type, task = parse_name(name)
+        grouped = [tasks for run_type, tasks in runs if variants and run_type == model_type]
+        if grouped:
+            grouped[0].append(task)
+        else:
+            runs.append((model_type, [task]))
+    datasets = {}
+    results = {}
+    for model_type, tasks in runs:
+        spec = dataset_spec(model_type)
+        if spec not in datasets:
+            modalities, anchor = spec
+            with phase('load data'):
+                datasets[spec] = load_mosi(list(modalities), anchor=anchor, max_len=maxlen)
+        cached = cache_encodings and model_type in ENCODER_OUTPUTS
+        run_names = [config_name(model_type, task) for task in tasks]
+        print('Running %s...' % ', '.join(run_names))
+        try:
+            if len(tasks) > 1:
+                results.update(run_variants(model_type, tasks, datasets[spec], output_dir, maxlen,
+                                            bucketing and model_type in VARIABLE_LENGTH_MODELS, verbose, tfn_fusion,
+                                            (checkpoint or {}).get(model_type, ()), batch_size, accumulation_steps,
+                                            snapshot_period=snapshot_period,
+                                            warm_start=warm_start if model_type in WARM_START_BRANCHES else None,
+                                            freeze_epochs=freeze_epochs, streaming=streaming))
+            else:
+                results[run_names[0]] = run_experiment(run_names[0], datasets[spec], output_dir, maxlen,
+                                                       bucketing and model_type in VARIABLE_LENGTH_MODELS and not cached, verbose,
+                                                       tfn_fusion, (checkpoint or {}).get(model_type, ()), batch_size,
+                                                       accumulation_steps, snapshot_period=snapshot_period,
+                                                       warm_start=warm_start if model_type in WARM_START_BRANCHES else None,
+                                                       freeze_epochs=freeze_epochs, cache_encodings=cached, streaming=streaming)
+        finally:
+            K.clear_session()
+            gc.collect()
+        for name in run_names:
+            print('%s test cc: %.4f  test mae: %.4f' % (name, results[name]['test']['cc'], results[name]['test']['mae']))
+    return results
@@ -0,0 +1,179 @@
+# Columnar, memory-mapped store for per-segment sequence features (covarep, facet, embeddings)
+# so that the features are not held as Python dicts of tuple lists, and concurrent
+# training processes share one copy of the data through the page cache
+
+import json
+import os
+import shutil
+import numpy as np
+
+
+def _write_part(path, features, ids, dtype):
+    """Write features[vid][sid] for the given (vid, sid) pairs as one set of contiguous arrays"""
+    if os.path.isdir(path):
+        shutil.rmtree(path) # left over by an interrupted write, it is not listed in parts.json
+    os.makedirs(path)
+    lengths = np.array([len(features[vid][sid]) for (vid, sid) in ids], dtype='int64')
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    dim = next((len(features[vid][sid][0][2]) for (vid, sid) in ids if len(features[vid][sid])), 0)
+
+    # fill the files segment by segment so that the whole modality never has to be copied in memory
+    values = np.lib.format.open_memmap(os.path.join(path, 'values.npy'), mode='w+', dtype=dtype, shape=(int(offsets[-1]), dim))
+    intervals = np.lib.format.open_memmap(os.path.join(path, 'intervals.npy'), mode='w+', dtype='float64', shape=(int(offsets[-1]), 2))
+    for i, (vid, sid) in enumerate(ids):
+        if lengths[i]:
+            segment = features[vid][sid]
+            values[offsets[i]:offsets[i + 1]] = [step[2] for step in segment]
+            intervals[offsets[i]:offsets[i + 1]] = [(step[0], step[1]) for step in segment]
+    values.flush()
+    intervals.flush()
+    del values, intervals
+    np.save(os.path.join(path, 'offsets.npy'), offsets)
+    with open(os.path.join(path, 'index.json'), 'w') as f:
+        json.dump([[vid, sid] for (vid, sid) in ids], f)
+
+
+class FeatureStore(object):
+    """One modality stored as contiguous arrays on disk, in one or more parts:
+
+    values.npy     float32 (total_steps, dim) feature vectors of all segments, back to back
+    intervals.npy  float64 (total_steps, 2) start and end time of every step
+    offsets.npy    int64 (n_segments + 1,) segment i spans values[offsets[i]:offsets[i + 1]]
+    index.json     the (vid, sid) pair of every segment
+
+    New segments are added with append(), which writes a new part; a segment in a later part
+    replaces the same (vid, sid) in earlier parts. The parts are listed in parts.json.
+
+    The arrays are memory-mapped on first access. store[vid][sid] returns the (steps, dim)
+    values of a segment as a view into the mapped file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._parts = None
+        self._ids = None
+        self._index = None
+
+    @staticmethod
+    def write(path, features, ids, dtype='float32'):
+        """Create a store with features[vid][sid] (lists of (start_time, end_time, feature_vector) tuples) for the given (vid, sid) pairs"""
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        _write_part(os.path.join(path, 'part-00000'), features, ids, dtype)
+        with open(os.path.join(path, 'parts.json'), 'w') as f:
+            json.dump(['part-00000'], f)
+        return FeatureStore(path)
+
+    def part_names(self):
+        with open(os.path.join(self.path, 'parts.json')) as f:
+            return json.load(f)
+
+    def append(self, features, ids, dtype='float32'):
+        """Add (or replace) the given (vid, sid) pairs in a new part"""
+        names = self.part_names()
+        name = 'part-%05d' % len(names)
+        _write_part(os.path.join(self.path, name), features, ids, dtype)
+        # publish the new part list atomically, readers see either the old or the new list
+        tmp_path = os.path.join(self.path, 'parts.json.tmp.%d' % os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(names + [name], f)
+        os.rename(tmp_path, os.path.join(self.path, 'parts.json'))
+        self._index = None
+
+    def _load(self):
+        if self._index is None:
+            parts = []
+            ids = []
+            index = {}
+            for p, name in enumerate(self.part_names()):
+                part_path = os.path.join(self.path, name)
+                parts.append((np.load(os.path.join(part_path, 'values.npy'), mmap_mode='r'),
+                              np.load(os.path.join(part_path, 'intervals.npy'), mmap_mode='r'),
+                              np.load(os.path.join(part_path, 'offsets.npy'))))
+                with open(os.path.join(part_path, 'index.json')) as f:
+                    for i, (vid, sid) in enumerate(json.load(f)):
+                        if sid not in index.get(vid, {}):
+                            ids.append((vid, sid))
+                        index.setdefault(vid, {})[sid] = (p, i)
+            self._parts = parts
+            self._ids = ids
+            self._index = index
+
+    def _slice(self, vid, sid, column):
+        self._load()
+        p, i = self._index[vid][sid]
+        offsets = self._parts[p][2]
+        return self._parts[p][column][offsets[i]:offsets[i + 1]]
+
+    @property
+    def dim(self):
+        self._load()
+        return max(part[0].shape[1] for part in self._parts)
+
+    def ids(self):
+        """All (vid, sid) pairs in the store"""
+        self._load()
+        return list(self._ids)
+
+    def length(self, vid, sid):
+        """Number of steps of a segment"""
+        self._load()
+        p, i = self._index[vid][sid]
+        offsets = self._parts[p][2]
+        return int(offsets[i + 1] - offsets[i])
+
+    def values(self, vid, sid):
+        """(steps, dim) feature vectors of a segment"""
+        return self._slice(vid, sid, 0)
+
+    def intervals(self, vid, sid):
+        """(steps, 2) start and end times of a segment"""
+        return self._slice(vid, sid, 1)
+
+    def keys(self):
+        self._load()
+        return self._index.keys()
+
+    def __contains__(self, vid):
+        self._load()
+        return vid in self._index
+
+    def __getitem__(self, vid):
+        self._load()
+        if vid not in self._index:
+            raise KeyError(vid)
+        return _VideoView(self, vid)
+
+
+class _VideoView(object):
+    """The segments of one video in a FeatureStore, store[vid][sid] returns the segment values"""
+
+    def __init__(self, store, vid):
+        self.store = store
+        self.vid = vid
+
+    def keys(self):
+        return self.store._index[self.vid].keys()
+
+    def __contains__(self, sid):
+        return sid in self.store._index[self.vid]
+
+    def __getitem__(self, sid):
+        return self.store.values(self.vid, sid)
+
+
+def write_features(path, dataset, modalities, ids):
+    """Write the given modalities of a Dataset (or dict of features) into one store per modality under path"""
+    for modality in modalities:
+        FeatureStore.write(os.path.join(path, modality), dataset[modality], ids)
+
+
+def append_features(path, dataset, modalities, ids):
+    """Append the given (vid, sid) pairs of a Dataset (or dict of features) to the stores under path"""
+    for modality in modalities:
+        FeatureStore(os.path.join(path, modality)).append(dataset[modality], ids)
+
+
+def open_features(path, modalities):
+    """Lazily opened stores for the given modalities, indexed like a Dataset: features[modality][vid][sid]"""
+    return dict((modality, FeatureStore(os.path.join(path, modality))) for modality in modalities)
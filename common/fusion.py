@@ -0,0 +1,218 @@
+# Fusion layers for the Tensor Fusion Network. TFN multiplies out the acoustic, visual and text
+# features into a 32 * 32 * 64 (65,536 values per step) tensor before the fusion LSTM, whose input
+# weights then hold ~33M parameters. LowRankFusion (after Liu et al., "Efficient Low-rank Multimodal
+# Fusion with Modality-Specific Factors", ACL 2018) is a different fusion rather than an
+# approximation of this one: a factorized projection of the outer product of the per-step modality
+# vectors, without forming the tensor.
+# TensorFusionLSTM is the exact TFN fusion and LSTM, with the tensor formed a chunk at a time.
+
+import numpy as np
+from keras import backend as K
+from keras import activations, initializers
+from keras.engine.topology import Layer
+
+LOW_RANK = 4 # rank of the factorized fusion weights
+LOW_RANK_UNITS = 64 # size of the fused vector of every time step
+TFN_CHUNK_SIZE = 4096 # fused values per step formed at a time by TensorFusionLSTM
+
+
+class LowRankFusion(Layer):
+    """Low-rank tensor fusion of per-step modality features, an adaptation of the TFN fusion.
+
+    Takes a list of (batch, steps, dim_m) tensors and returns (batch, steps, units): at every step
+    the projection of the outer product of the modality vectors, with the projection weights
+    factorized into rank modality-specific factors:
+        sum_r prod_m ([x_m, 1] . W_m[r]) + bias
+    It differs from the TFN graph of the scripts in two ways, so its results are not those of an
+    approximation of the tensor runs: every vector is extended with a constant 1, which adds the
+    unimodal and bimodal terms to the trimodal products the TFN graph has alone, and the modalities
+    are fused step by step instead of as the sequence flattened across the steps.
+    """
+
+    def __init__(self, units=LOW_RANK_UNITS, rank=LOW_RANK, kernel_initializer='glorot_uniform', **kwargs):
+        super(LowRankFusion, self).__init__(**kwargs)
+        self.units = units
+        self.rank = rank
+        self.kernel_initializer = initializers.get(kernel_initializer)
+
+    def build(self, input_shape):
+        self.factors = [self.add_weight(shape=(self.rank, shape[-1] + 1, self.units), initializer=self.kernel_initializer,
+                                        name='factor_%d' % i)
+                        for i, shape in enumerate(input_shape)]
+        self.bias = self.add_weight(shape=(self.units,), initializer='zeros', name='bias')
+        super(LowRankFusion, self).build(input_shape)
+
+    def call(self, inputs):
+        # the constant 1 appended to every modality vector
+        extended = [K.concatenate([x, K.ones_like(x[:, :, :1])], axis=-1) for x in inputs]
+        fused = None
+        for r in range(self.rank):
+            product = None
+            for x, factor in zip(extended, self.factors):
+                projection = K.dot(x, factor[r])
+                product = projection if product is None else product * projection
+            fused = product if fused is None else fused + product
+        return fused + self.bias
+
+    def compute_output_shape(self, input_shape):
+        return input_shape[0][:-1] + (self.units,)
+
+    def get_config(self):
+        config = {'units': self.units, 'rank': self.rank, 'kernel_initializer': initializers.serialize(self.kernel_initializer)}
+        base_config = super(LowRankFusion, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+class TensorFusionLSTM(Layer):
+    """The TFN fusion (outer product, dropout and LSTM of the TFN graph) without the full fused tensor.
+
+    Takes the [acoustic, visual, text] branch outputs of shapes (batch, steps, 32), (batch, steps, 32)
+    and (batch, steps, 64) and returns the last LSTM output as the TFN graph does: the acoustic-visual
+    product summed over the steps, times the text of all steps, is cut into steps LSTM steps of
+    32 * 32 * 64 values. The LSTM input projection of every step is accumulated over chunks of
+    chunk_size fused values, so only one chunk of the tensor exists at a time instead of
+    (batch, steps, 65536) values, in training as well with TensorFlow (see _projections). The weights have the shapes, order and initialization of the
+    Keras LSTM they replace, so the weights of a TFN model with the full tensor can be loaded.
+    """
+
+    def __init__(self, units, chunk_size=TFN_CHUNK_SIZE, dropout=0.2, steps=15, activation='tanh',
+                 recurrent_activation='hard_sigmoid', **kwargs):
+        super(TensorFusionLSTM, self).__init__(**kwargs)
+        self.units = units
+        self.chunk_size = chunk_size
+        self.dropout = dropout
+        self.steps = steps
+        self.activation = activations.get(activation)
+        self.recurrent_activation = activations.get(recurrent_activation)
+
+    def build(self, input_shape):
+        acoustic_shape, visual_shape, text_shape = input_shape
+        self.bimodal_size = acoustic_shape[-1] * visual_shape[-1]
+        self.text_size = text_shape[1] * text_shape[2]
+        if (self.bimodal_size * self.text_size) % self.steps:
+            raise ValueError('The fused tensor of %d values can not be cut into %d steps' % (self.bimodal_size * self.text_size, self.steps))
+        self.input_dim = self.bimodal_size * self.text_size // self.steps
+        units = self.units
+
+        def bias_initializer(shape, *args, **kwargs):
+            # the forget gate starts open, as with the unit_forget_bias of Keras' LSTM
+            return K.concatenate([initializers.Zeros()((units,), *args, **kwargs),
+                                  initializers.Ones()((units,), *args, **kwargs),
+                                  initializers.Zeros()((units * 2,), *args, **kwargs)])
+
+        self.kernel = self.add_weight(shape=(self.input_dim, units * 4), initializer='glorot_uniform', name='kernel')
+        self.recurrent_kernel = self.add_weight(shape=(units, units * 4), initializer='orthogonal', name='recurrent_kernel')
+        self.bias = self.add_weight(shape=(units * 4,), initializer=bias_initializer, name='bias')
+        super(TensorFusionLSTM, self).build(input_shape)
+
+    def _chunks(self, bimodal, text, training=None):
+        """(step, start, stop, dropped out chunk of the fused tensor of that step) in the order they are formed"""
+        for step in range(self.steps):
+            begin, end = step * self.input_dim, (step + 1) * self.input_dim
+            for start in range(begin, end, self.chunk_size):
+                stop = min(start + self.chunk_size, end)
+                # fused value n is bimodal[n // text_size] * text[n % text_size], form the rows this chunk needs
+                first, last = start // self.text_size, (stop - 1) // self.text_size + 1
+                rows = K.reshape(K.expand_dims(bimodal[:, first:last], 2) * K.expand_dims(text, 1),
+                                 (-1, (last - first) * self.text_size))
+                fused = rows[:, start - first * self.text_size:stop - first * self.text_size]
+                if self.dropout > 0:
+                    fused = K.in_train_phase(K.dropout(fused, self.dropout), fused, training=training)
+                yield step, start - begin, stop - begin, fused
+
+    def _projections(self, acoustic, visual, text, training=None):
+        """The LSTM input projections (batch, steps, 4 * units) of the fused tensor.
+
+        With TensorFlow every chunk is formed once the projection of the one before is computed,
+        and the backward pass forms the chunks again, one after the other and with the same dropout
+        masks, instead of keeping them all for the gradient (as common.checkpointing.Recompute does).
+        """
+        bimodal = K.reshape(K.batch_dot(acoustic, visual, axes=[1, 1]), (-1, self.bimodal_size))
+        text = K.reshape(text, (-1, self.text_size))
+        if K.backend() != 'tensorflow':
+            projections = [None] * self.steps
+            for step, start, stop, fused in self._chunks(bimodal, text, training):
+                part = K.dot(fused, self.kernel[start:stop])
+                projections[step] = part if projections[step] is None else projections[step] + part
+            return K.stack(projections, axis=1) + self.bias
+        import tensorflow as tf
+        random_state = np.random.get_state()
+
+        def forward(bimodal, text, kernel):
+            projections, previous = [None] * self.steps, []
+            chunks = self._chunks(bimodal, text, training)
+            while True:
+                # the next chunk is formed after the projection of the previous one is summed up
+                with tf.control_dependencies(previous):
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        return K.stack(projections, axis=1)
+                    step, start, stop, fused = chunk
+                    part = K.dot(fused, kernel[start:stop])
+                projections[step] = part if projections[step] is None else projections[step] + part
+                previous = [projections[step]]
+
+        @tf.custom_gradient
+        def projections(bimodal, text, kernel):
+
+            def gradient(result_gradient):
+                # form the chunks again once the gradient of the projections is there, each after the last one's gradient
+                with tf.control_dependencies([result_gradient]):
+                    bimodal_again, text_again = tf.identity(bimodal), tf.identity(text)
+                bimodal_gradient, text_gradient = tf.zeros_like(bimodal), tf.zeros_like(text)
+                kernel_gradients, previous = {}, [result_gradient]
+                state = np.random.get_state()
+                np.random.set_state(random_state)
+                try:
+                    chunks = self._chunks(bimodal_again, text_again, training)
+                    while True:
+                        with tf.control_dependencies(previous):
+                            chunk = next(chunks, None)
+                            if chunk is None:
+                                break
+                            step, start, stop, fused = chunk
+                            kernel_part = kernel[start:stop]
+                            part = K.dot(fused, kernel_part)
+                        gradients = tf.gradients(part, [bimodal_again, text_again, kernel_part],
+                                                 grad_ys=result_gradient[:, step])
+                        bimodal_gradient += gradients[0]
+                        text_gradient += gradients[1]
+                        # every step uses the same kernel rows
+                        kernel_gradients[start] = gradients[2] + kernel_gradients[start] if start in kernel_gradients else gradients[2]
+                        # the gradients of the chunk are summed up before the next one is formed
+                        previous = [bimodal_gradient, text_gradient, kernel_gradients[start]]
+                finally:
+                    np.random.set_state(state)
+                return [bimodal_gradient, text_gradient, K.concatenate([kernel_gradients[start] for start in sorted(kernel_gradients)], axis=0)]
+
+            return forward(bimodal, text, kernel), gradient
+
+        return projections(bimodal, text, self.kernel) + self.bias
+
+    def call(self, inputs, training=None):
+        projections = self._projections(*inputs, training=training)
+        units = self.units
+
+        def step(x, states):
+            h_tm1, c_tm1 = states
+            z = x + K.dot(h_tm1, self.recurrent_kernel)
+            i = self.recurrent_activation(z[:, :units])
+            f = self.recurrent_activation(z[:, units:2 * units])
+            c = f * c_tm1 + i * self.activation(z[:, 2 * units:3 * units])
+            o = self.recurrent_activation(z[:, 3 * units:])
+            h = o * self.activation(c)
+            return h, [h, c]
+
+        initial_state = K.zeros_like(projections[:, 0, :units])
+        last_output, _, _ = K.rnn(step, projections, [initial_state, initial_state])
+        return last_output
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0][0], self.units)
+
+    def get_config(self):
+        config = {'units': self.units, 'chunk_size': self.chunk_size, 'dropout': self.dropout, 'steps': self.steps,
+                  'activation': activations.serialize(self.activation),
+                  'recurrent_activation': activations.serialize(self.recurrent_activation)}
+        base_config = super(TensorFusionLSTM, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
@@ -0,0 +1,177 @@
+# Timing of training and inference: per-batch step times, throughput, epoch durations and the
+# time until early stopping, written as JSON lines (one record per epoch and per call) so runs
+# of different models can be compared on cost as well as on accuracy
+
+from __future__ import print_function
+import json
+import time
+import numpy as np
+from keras.callbacks import Callback
+
+# step time histogram bins in seconds, 4 per decade from 0.1 ms to 100 s
+HISTOGRAM_EDGES = 10.0 ** np.arange(-4, 2.01, 0.25)
+
+
+def step_summary(step_times, n_samples, total_time):
+    """Statistics of a list of step times in seconds"""
+    step_times = np.asarray(step_times, dtype='float64')
+    summary = {'steps': len(step_times), 'samples': int(n_samples), 'seconds': total_time,
+               'samples_per_second': n_samples / total_time if total_time > 0 else None}
+    if len(step_times):
+        counts, _ = np.histogram(np.clip(step_times, HISTOGRAM_EDGES[0], HISTOGRAM_EDGES[-1]), HISTOGRAM_EDGES)
+        summary.update({'step_mean': float(step_times.mean()),
+                        'step_p50': float(np.percentile(step_times, 50)),
+                        'step_p90': float(np.percentile(step_times, 90)),
+                        'step_p99': float(np.percentile(step_times, 99)),
+                        'step_max': float(step_times.max()),
+                        'step_histogram': {'edges': [float(edge) for edge in HISTOGRAM_EDGES], 'counts': [int(c) for c in counts]}})
+    return summary
+
+
+class JsonLog(object):
+    """Appends one JSON record per line to a file, the file is truncated when the log is created"""
+
+    def __init__(self, path):
+        self.path = path
+        open(path, 'w').close()
+
+    def write(self, event, **record):
+        record = dict(record, event=event, time=time.time())
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+class StepTimer(Callback):
+    """Records the time of every training step and epoch, and when training stopped.
+
+    Writes an 'epoch' record per epoch and a 'fit' record at the end of training with the
+    step time statistics, the throughput, the best validation loss and when it was reached.
+    """
+
+    def __init__(self, log, monitor='val_loss'):
+        super(StepTimer, self).__init__()
+        self.log = log
+        self.monitor = monitor
+
+    def on_train_begin(self, logs=None):
+        self.train_start = time.time()
+        self.step_times = []
+        self.samples = 0
+        self.epochs = 0
+        self.best = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.time()
+        self.epoch_steps = []
+        self.epoch_samples = 0
+
+    def on_batch_begin(self, batch, logs=None):
+        self.batch_start = time.time()
+
+    def on_batch_end(self, batch, logs=None):
+        self.epoch_steps.append(time.time() - self.batch_start)
+        self.epoch_samples += int((logs or {}).get('size', 0))
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        now = time.time()
+        self.epochs = epoch + 1
+        self.step_times.extend(self.epoch_steps)
+        self.samples += self.epoch_samples
+        current = logs.get(self.monitor)
+        if current is not None and (self.best is None or current < self.best['value']):
+            self.best = {'value': float(current), 'epoch': epoch + 1, 'seconds': now - self.train_start}
+        record = step_summary(self.epoch_steps, self.epoch_samples, now - self.epoch_start)
+        record.pop('step_histogram', None)
+        record.update(dict((key, float(value)) for key, value in logs.items()))
+        self.log.write('epoch', epoch=epoch + 1, **record)
+
+    def on_train_end(self, logs=None):
+        total = time.time() - self.train_start
+        record = step_summary(self.step_times, self.samples, total)
+        max_epochs = self.params.get('epochs', self.params.get('nb_epoch'))
+        self.log.write('fit', epochs=self.epochs, max_epochs=max_epochs, stopped_early=bool(max_epochs and self.epochs < max_epochs),
+                       time_to_stop=total, best=self.best, **record)
+
+
+def _batches(n_samples, batch_size):
+    return [slice(start, min(start + batch_size, n_samples)) for start in range(0, n_samples, batch_size)]
+
+
+def _take(x, index):
+    if isinstance(x, dict):
+        return dict((name, array[index]) for name, array in x.items())
+    if isinstance(x, (list, tuple)):
+        return [array[index] for array in x]
+    return x[index]
+
+
+def _n_samples(x):
+    return len(x[0] if isinstance(x, (list, tuple)) else x)
+
+
+def instrument(model, path, monitor='val_loss'):
+    """Time every fit/evaluate/predict of a compiled Keras model and write the records to path (JSON lines).
+
+    fit and fit_generator get a StepTimer callback. evaluate and predict run batch by batch
+    (with the same results as Keras' own loops) so every step is timed; the *_generator
+    variants are timed as a whole. Returns the model.
+    """
+    log = JsonLog(path)
+    fit, fit_generator = model.fit, model.fit_generator
+    evaluate_generator, predict_generator = model.evaluate_generator, model.predict_generator
+
+    def with_timer(kwargs):
+        kwargs['callbacks'] = list(kwargs.get('callbacks') or []) + [StepTimer(log, monitor)]
+        return kwargs
+
+    def timed_fit(*args, **kwargs):
+        return fit(*args, **with_timer(kwargs))
+
+    def timed_fit_generator(*args, **kwargs):
+        return fit_generator(*args, **with_timer(kwargs))
+
+    def timed_evaluate(x, y, batch_size=32, verbose=1, sample_weight=None):
+        if sample_weight is not None:
+            raise ValueError('sample_weight is not supported by the instrumented evaluate')
+        n_samples = _n_samples(x)
+        start, step_times, totals = time.time(), [], None
+        for index in _batches(n_samples, batch_size):
+            step_start = time.time()
+            outs = model.test_on_batch(_take(x, index), _take(y, index))
+            step_times.append(time.time() - step_start)
+            # weighted by the batch size as in Keras' test loop
+            outs = np.atleast_1d(np.asarray(outs, dtype='float64')) * (index.stop - index.start)
+            totals = outs if totals is None else totals + outs
+        log.write('evaluate', **step_summary(step_times, n_samples, time.time() - start))
+        results = [float(value) for value in totals / n_samples]
+        return results if len(results) > 1 else results[0]
+
+    def timed_predict(x, batch_size=32, verbose=0):
+        n_samples = _n_samples(x)
+        start, step_times, outputs = time.time(), [], []
+        for index in _batches(n_samples, batch_size):
+            step_start = time.time()
+            outs = model.predict_on_batch(_take(x, index))
+            step_times.append(time.time() - step_start)
+            outputs.append(outs if isinstance(outs, list) else [outs])
+        log.write('predict', **step_summary(step_times, n_samples, time.time() - start))
+        pred = [np.concatenate(parts) for parts in zip(*outputs)]
+        return pred if len(pred) > 1 else pred[0]
+
+    def timed(kind, method):
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            result = method(*args, **kwargs)
+            steps = kwargs.get('steps', args[1] if len(args) > 1 else None)
+            log.write(kind, steps=steps, seconds=time.time() - start)
+            return result
+        return wrapper
+
+    model.fit = timed_fit
+    model.fit_generator = timed_fit_generator
+    model.evaluate = timed_evaluate
+    model.predict = timed_predict
+    model.evaluate_generator = timed('evaluate_generator', evaluate_generator)
+    model.predict_generator = timed('predict_generator', predict_generator)
+    return model
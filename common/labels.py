@@ -0,0 +1,37 @@
+# Polarity and intensity labels derived from the sentiment scores, used as auxiliary tasks
+
+import numpy as np
+
+# |score| thresholds between the neutral, weak, medium and strong intensity classes
+INTENSITY_THRESHOLDS = (0.5, 1.5, 2.5)
+INTENSITY_CLASSES = ('Neutral', 'Weak', 'Medium', 'Strong')
+POLARITY_CLASSES = ('Negative', 'Positive')
+
+
+def polarity_classes(scores):
+    """Binarize the Valence labels for polarity: 1 for scores >= 0, else 0"""
+    return (np.asarray(scores) >= 0).astype('int8')
+
+
+def intensity_classes(scores):
+    """Group the Valence labels to intensity classes 0-3 (neutral, weak, medium, strong) by their absolute value"""
+    magnitude = np.abs(np.asarray(scores))
+    classes = np.zeros(magnitude.shape, dtype='int8')
+    for threshold in INTENSITY_THRESHOLDS:
+        # comparisons with NaN are False, so a missing score stays neutral as in the original if/elif chain
+        classes += magnitude >= threshold
+    return classes
+
+
+def one_hot(classes, n_classes, dtype='int8'):
+    """One-hot encode an integer class array"""
+    return np.eye(n_classes, dtype=dtype)[np.asarray(classes)]
+
+
+def encode_labels(scores, one_hot_intensity=True):
+    """Polarity classes and intensity classes (one-hot by default, as used with categorical_crossentropy)"""
+    polarity = polarity_classes(scores)
+    intensity = intensity_classes(scores)
+    if one_hot_intensity:
+        intensity = one_hot(intensity, len(INTENSITY_CLASSES))
+    return polarity, intensity
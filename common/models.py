@@ -0,0 +1,271 @@
+# The model graphs and training settings of the unimodal and multimodal scripts, so that any
+# configuration (e.g. DL_tri, T_unimodal_pol) can be built in one process by the experiment runner
+
+from keras.models import Model
+from keras.layers import Dense, Dropout, LSTM, Input, Flatten, Reshape, merge
+from keras.optimizers import Adamax
+from keras.regularizers import l2
+from keras import backend as K
+
+from common.checkpointing import Recompute
+from common.configs import CHECKPOINT_SEGMENTS, FUSION_MODELS, TFN_FUSIONS, VARIABLE_LENGTH_MODELS
+from common.fusion import LowRankFusion, TensorFusionLSTM
+from common.optimizers import AccumulatedAdamax
+from common.profiling import phase
+
+# meta parameters shared by all scripts
+BATCH_SIZE = 128
+NB_EPOCH = 1000 # number of total epochs to train the model
+PATIENCE = 5 # stop if the validation loss isn't decreasing for this many epochs
+LOSS_MAIN, METRIC_MAIN, WEIGHT_MAIN = 'mae', 'mae', 1.0 # valence regression
+LOSS_POL, METRIC_POL, WEIGHT_POL = 'binary_crossentropy', 'binary_accuracy', 0.5 # valence polarity classification
+LOSS_INT, METRIC_INT, WEIGHT_INT = 'categorical_crossentropy', 'accuracy', 0.5 # valence intensity classification
+
+
+def pearson_cc(y_true, y_pred):
+    """Pearson correlation of the predictions, the custom evaluation metric of all scripts"""
+    fsp = y_pred - K.mean(y_pred,axis=0)
+    fst = y_true - K.mean(y_true,axis=0)
+    devP = K.std(y_pred,axis=0)
+    devT = K.std(y_true,axis=0)
+
+    return K.sum(K.mean(fsp*fst,axis=0)/(devP*devT))
+
+
+def _av_trunk(timesteps, dim):
+    all_input = Input(shape=(timesteps, dim), dtype='float32', name='input')
+    h1 = Dropout(0.2)(all_input)
+    h2 = Dense(32, activation='relu', W_regularizer=l2(0.0), trainable=True)(h1)
+    h3 = Dense(32, activation='relu', W_regularizer=l2(0.0), trainable=True)(h2)
+    h4 = Dense(32, activation='relu', W_regularizer=l2(0.0), trainable=True)(h3)
+    h5 = Flatten()(h4)
+    return all_input, h5
+
+
+def _t_trunk(timesteps):
+    all_input = Input(shape=(timesteps, 300), dtype='float32', name='input')
+    h1 = LSTM(128, return_sequences=False, trainable=True)(all_input)
+    h2 = Dense(64, W_regularizer=l2(0.0), trainable=True)(h1)
+    return all_input, h2
+
+
+def _fl_trunk(timesteps):
+    all_input = Input(shape=(timesteps, 420), dtype='float32', name='input')
+    FL_layer_1 = Dropout(0.2, name='FL_layer_1')(all_input)
+    FL_layer_2 = LSTM(128, return_sequences=False, trainable=True, name='FL_layer_2')(FL_layer_1)
+    FL_layer_3 = Dense(32, activation='relu', W_regularizer=l2(0.0), trainable=True, name='FL_layer_3')(FL_layer_2)
+    FL_layer_4 = Dense(32, activation='relu', W_regularizer=l2(0.0), trainable=True, name='FL_layer_4')(FL_layer_3)
+    FL_layer_5 = Dense(32, activation='relu', W_regularizer=l2(0.0), trainable=True, name='FL_layer_5')(FL_layer_4)
+    return all_input, FL_layer_5
+
+
+def _checkpointed(inputs, output, name, checkpoint):
+    """output, with the activations between the inputs and output recomputed in the backward pass if checkpoint"""
+    if not checkpoint:
+        return output
+    return Recompute(name=name)(list(inputs) + [output])
+
+
+def _branch(layer, name, first=3, checkpoint=False):
+    """The three Dense(32) layers of the vocal and visual branches"""
+    branch_input = layer
+    for i in range(first, first + 3):
+        layer = Dense(32, activation='relu', W_regularizer=l2(0.0), trainable=True, name='%s_layer_%d' % (name, i))(layer)
+    return _checkpointed([branch_input], layer, '%s_checkpoint' % name, checkpoint)
+
+
+def _modality_inputs(timesteps):
+    covarep_layer_0 = Input(shape=(timesteps,74), dtype='float32', name = 'covarep_layer_0')
+    facet_layer_0 = Input(shape=(timesteps,46), dtype='float32', name = 'facet_layer_0')
+    text_layer_0 = Input(shape=(timesteps, 300), dtype='float32', name='text_layer_0')
+    return covarep_layer_0, facet_layer_0, text_layer_0
+
+
+def _fusion_head(layer, name, first=3):
+    """The three regularized Dense(32) layers after the fusion LSTM"""
+    for i in range(first, first + 3):
+        layer = Dense(32, activation='relu', W_regularizer=l2(0.01), name='%s_layer_%d' % (name, i))(layer)
+    return layer
+
+
+def _dl_trunk(timesteps, checkpoint=()):
+    covarep_layer_0, facet_layer_0, text_layer_0 = _modality_inputs(timesteps)
+    # Vocal
+    covarep_layer_5 = _branch(Dropout(0.2, name='covarep_layer_2')(covarep_layer_0), 'covarep', checkpoint='branches' in checkpoint)
+    # Visual
+    facet_layer_5 = _branch(Dropout(0.2, name='facet_layer_2')(facet_layer_0), 'facet', checkpoint='branches' in checkpoint)
+    # Verbal
+    text_layer_2 = LSTM(128, return_sequences=True, trainable=True, name='text_layer_2')(text_layer_0)
+    text_layer_3 = Dense(64, activation='relu', W_regularizer=l2(0.0), trainable=True, name='text_layer_3')(text_layer_2)
+    # Modality fusion - DL
+    DL_layer_0 = merge([covarep_layer_5, facet_layer_5, text_layer_3], mode='concat', name='DL_layer_0')
+    DL_layer_1 = Dropout(0.2, name='DL_layer_1')(DL_layer_0)
+    DL_layer_2 = LSTM(128, return_sequences=False, trainable=True, name='DL_layer_2')(DL_layer_1)
+    DL_layer_2 = _checkpointed([covarep_layer_5, facet_layer_5, text_layer_3], DL_layer_2, 'DL_checkpoint', 'fusion' in checkpoint)
+    return [covarep_layer_0, facet_layer_0, text_layer_0], _fusion_head(DL_layer_2, 'DL')
+
+
+def _hl_trunk(timesteps, checkpoint=()):
+    covarep_layer_0, facet_layer_0, text_layer_0 = _modality_inputs(timesteps)
+    # Vocal
+    covarep_layer_5 = _branch(Dropout(0.2, name='covarep_layer_2')(covarep_layer_0), 'covarep', checkpoint='branches' in checkpoint)
+    # Visual, fused with the vocal features
+    facet_layer_2 = merge([covarep_layer_5, facet_layer_0], mode='concat', name='facet_layer_2')
+    facet_layer_6 = _branch(Dropout(0.2, name='facet_layer_3')(facet_layer_2), 'facet', first=4, checkpoint='branches' in checkpoint)
+    # Verbal, fused with the vocal-visual features
+    text_layer_2 = merge([facet_layer_6, text_layer_0], mode='concat', name='text_layer_2')
+    text_layer_3 = LSTM(128, return_sequences=True, trainable=True, name='text_layer_3')(text_layer_2)
+    text_layer_4 = Dense(64, activation='relu', W_regularizer=l2(0.0), trainable=True, name='text_layer_4')(text_layer_3)
+    # Modality fusion - HL
+    HL_layer_1 = Dropout(0.2, name='HL_layer_1')(text_layer_4)
+    HL_layer_2 = LSTM(128, return_sequences=False, trainable=True, name='HL_layer_2')(HL_layer_1)
+    HL_layer_2 = _checkpointed([facet_layer_6, text_layer_0], HL_layer_2, 'HL_checkpoint', 'fusion' in checkpoint)
+    return [covarep_layer_0, facet_layer_0, text_layer_0], _fusion_head(HL_layer_2, 'HL')
+
+
+def _tfn_trunk(timesteps, fusion='tensor', checkpoint=()):
+    covarep_layer_0, facet_layer_0, text_layer_0 = _modality_inputs(timesteps)
+    # Vocal
+    covarep_layer_5 = _branch(Dropout(0.2, name='covarep_layer_2')(covarep_layer_0), 'covarep', checkpoint='branches' in checkpoint)
+    # Visual
+    facet_layer_5 = _branch(Dropout(0.2, name='facet_layer_2')(facet_layer_0), 'facet', checkpoint='branches' in checkpoint)
+    # Verbal
+    text_layer_2 = LSTM(128, return_sequences=True, trainable=True, name='text_layer_2')(text_layer_0)
+    text_layer_3 = Dense(64, activation='relu', W_regularizer=l2(0.0), trainable=True, name='text_layer_3')(text_layer_2)
+    TFN_layer_2 = tfn_fusion_layer(covarep_layer_5, facet_layer_5, text_layer_3, fusion)
+    TFN_layer_2 = _checkpointed([covarep_layer_5, facet_layer_5, text_layer_3], TFN_layer_2, 'TFN_checkpoint', 'fusion' in checkpoint)
+    return [covarep_layer_0, facet_layer_0, text_layer_0], _fusion_head(TFN_layer_2, 'TFN')
+
+
+def tfn_fusion_layer(covarep_layer_5, facet_layer_5, text_layer_3, fusion='tensor'):
+    """The output of the TFN fusion LSTM (TFN_layer_2) on the vocal, visual and verbal branch outputs.
+
+    fusion is one of TFN_FUSIONS: the outer product of the scripts, its low-rank adaptation or the
+    outer product in chunks (see common.fusion). The TFN scripts build their fusion with it as well.
+    """
+    if fusion == 'chunked':
+        # Modality fusion - the exact tensor fusion, dropout and LSTM, the tensor formed a chunk at a time
+        return TensorFusionLSTM(128, dropout=0.2, name='TFN_layer_2')([covarep_layer_5, facet_layer_5, text_layer_3])
+    if fusion == 'lowrank':
+        # Modality fusion - low-rank fusion at every step, with the unimodal and bimodal terms
+        TFN_layer_0 = LowRankFusion(name='TFN_layer_0')([covarep_layer_5, facet_layer_5, text_layer_3])
+    elif fusion == 'tensor':
+        TFN_layer_0 = _tensor_fusion(covarep_layer_5, facet_layer_5, text_layer_3)
+    else:
+        raise ValueError('Unknown TFN fusion %r' % fusion)
+    TFN_layer_1 = Dropout(0.2, name='TFN_layer_1')(TFN_layer_0)
+    return LSTM(128, return_sequences=False, trainable=True, name='TFN_layer_2')(TFN_layer_1)
+
+
+def _tensor_fusion(covarep_layer_5, facet_layer_5, text_layer_3):
+    """The outer product of the scripts: the vocal-visual product summed over the steps, times the text of all steps"""
+    covarep_layer_6 = Reshape((15, 32), name='covarep_layer_6')(covarep_layer_5)
+    facet_layer_6 = Reshape((15, 32), name='facet_layer_6')(facet_layer_5)
+    text_layer_4 = Reshape((1, 15 * 64), name='text_layer_4')(text_layer_3)
+    # Modality fusion - TFN
+    dot_layer1 = merge([covarep_layer_6, facet_layer_6], mode='dot', dot_axes=1, name='dot_layer1')
+    dot_layer1_reshape = Reshape((1, 32 * 32), name='dot_layer1_reshape')(dot_layer1)
+    dot_layer2 = merge([dot_layer1_reshape, text_layer_4], mode='dot', dot_axes=1, name='dot_layer2')
+    return Reshape((15, 32 * 32 * 64), name='TFN_layer_0')(dot_layer2)
+
+
+def build_trunk(model, maxlen=15, variable_length=False, tfn_fusion='tensor', checkpoint=()):
+    """(inputs, last hidden layer) of a model graph, without the output heads.
+
+    With variable_length the inputs accept any number of time steps, for length-bucketed
+    batches (only the models in VARIABLE_LENGTH_MODELS). tfn_fusion selects the fusion of the
+    TFN model (one of TFN_FUSIONS). checkpoint lists the segments of the model (see
+    CHECKPOINT_SEGMENTS) whose activations are recomputed in the backward pass.
+    """
+    if tfn_fusion not in TFN_FUSIONS:
+        raise ValueError('Unknown TFN fusion %r' % tfn_fusion)
+    unknown = set(checkpoint) - set(CHECKPOINT_SEGMENTS.get(model, ()))
+    if unknown:
+        raise ValueError('The %s model has no segments %s to checkpoint' % (model, ', '.join(sorted(unknown))))
+    if variable_length and model not in VARIABLE_LENGTH_MODELS:
+        raise ValueError('The %s model needs inputs of exactly maxlen steps' % model)
+    timesteps = None if variable_length else maxlen
+    if model == 'A':
+        return _av_trunk(timesteps, 74)
+    if model == 'V':
+        return _av_trunk(timesteps, 46)
+    if model == 'T':
+        return _t_trunk(timesteps)
+    if model == 'FL':
+        return _fl_trunk(timesteps)
+    if model == 'DL':
+        return _dl_trunk(timesteps, checkpoint)
+    if model == 'HL':
+        return _hl_trunk(timesteps, checkpoint)
+    if model == 'TFN':
+        if maxlen != 15:
+            raise ValueError('The TFN graph is built for maxlen=15')
+        return _tfn_trunk(timesteps, tfn_fusion, checkpoint)
+    raise ValueError('Unknown model %r' % model)
+
+
+def add_heads(inputs, hidden, task, regularize_main=True, name=None):
+    """Model with the output heads of a task on top of the hidden layer"""
+    main_regularizer = l2(0.01) if regularize_main else None
+    main_output = Dense(1, activation='tanh', W_regularizer=main_regularizer, name='main_output')(hidden) # valence regression
+    if task == 'uno':
+        outputs = [main_output]
+    elif task == 'pol':
+        outputs = [main_output, Dense(1, activation='sigmoid', name='aux_output')(hidden)] # Polarity classification
+    elif task == 'int':
+        outputs = [main_output, Dense(4, activation='softmax', name='aux_output')(hidden)] # Intensity classification
+    elif task == 'tri':
+        outputs = [main_output,
+                   Dense(1, activation='sigmoid', name='aux_output_1')(hidden), # Polarity classification
+                   Dense(4, activation='softmax', name='aux_output_2')(hidden)] # Intensity classification
+    else:
+        raise ValueError('Unknown task %r' % task)
+    return Model(inputs=inputs, outputs=outputs, name=name)
+
+
+def optimizer(accumulation_steps=1):
+    """Adamax of the scripts, updating once every accumulation_steps batches with their mean gradient if above 1"""
+    if accumulation_steps > 1:
+        return AccumulatedAdamax(accumulation_steps, lr=0.0005, beta_1=0.9, beta_2=0.999, epsilon=1e-08)
+    return Adamax(lr=0.0005, beta_1=0.9, beta_2=0.999, epsilon=1e-08) # optimization function
+
+
+def task_losses(task):
+    """(losses, loss weights, metrics) of the output heads of a task, as dicts keyed by output name"""
+    if task == 'uno':
+        return {'main_output': LOSS_MAIN}, {'main_output': WEIGHT_MAIN}, {'main_output': [pearson_cc, METRIC_MAIN]}
+    if task == 'tri':
+        loss = {'main_output': LOSS_MAIN, 'aux_output_1': LOSS_POL, 'aux_output_2': LOSS_INT}
+        loss_weights = {'main_output': WEIGHT_MAIN, 'aux_output_1': WEIGHT_POL, 'aux_output_2': WEIGHT_INT}
+        metrics = {'main_output': [pearson_cc, METRIC_MAIN], 'aux_output_1': METRIC_POL, 'aux_output_2': METRIC_INT}
+    else:
+        loss_aux, metric_aux, weight_aux = (LOSS_POL, METRIC_POL, WEIGHT_POL) if task == 'pol' else (LOSS_INT, METRIC_INT, WEIGHT_INT)
+        loss = {'main_output': LOSS_MAIN, 'aux_output': loss_aux}
+        loss_weights = {'main_output': WEIGHT_MAIN, 'aux_output': weight_aux}
+        metrics = {'main_output': [pearson_cc, METRIC_MAIN], 'aux_output': metric_aux}
+    return loss, loss_weights, metrics
+
+
+def compile_model(model, task, opt=None):
+    """Compile with the losses, loss weights and metrics of a task as the scripts do"""
+    opt = opt or optimizer()
+    if task == 'uno':
+        model.compile(opt, LOSS_MAIN, metrics=[pearson_cc, METRIC_MAIN])
+        return model
+    loss, loss_weights, metrics = task_losses(task)
+    model.compile(optimizer=opt, loss=loss, loss_weights=loss_weights, metrics=metrics)
+    return model
+
+
+def build_model(model, task, maxlen=15, variable_length=False, tfn_fusion='tensor', checkpoint=(), accumulation_steps=1):
+    """Compiled Keras model of a configuration, e.g. build_model('DL', 'tri').
+
+    With accumulation_steps above 1 the weights are updated once every accumulation_steps
+    batches, with the mean of their gradients (see common.optimizers).
+    """
+    with phase('model build'):
+        inputs, hidden = build_trunk(model, maxlen, variable_length, tfn_fusion, checkpoint)
+        # only the fusion models regularize the valence regression output
+        keras_model = add_heads(inputs, hidden, task, regularize_main=model in FUSION_MODELS)
+    with phase('compile'):
+        return compile_model(keras_model, task, optimizer(accumulation_steps))
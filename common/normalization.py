@@ -0,0 +1,64 @@
+# Feature normalizers that can be saved with a model, so that new data is scaled with the
+# statistics of the training set without refitting (or even loading) it
+
+import os
+import numpy as np
+
+
+class MaxAbsNormalizer(object):
+    """Scales every feature dimension by its maximum absolute value in the training data.
+
+    fit() reads the data chunk by chunk (partial_fit() for data that arrives in pieces), so it
+    works on memory-mapped arrays larger than RAM. Dimensions whose maximum is 0 are left as
+    they are; as in the original scripts a NaN anywhere in the training data makes the maximum
+    of its dimension NaN, and NaN values are set to 0 after scaling.
+    """
+
+    def __init__(self, feature_max=None):
+        self.feature_max = None if feature_max is None else np.asarray(feature_max)
+
+    def partial_fit(self, x):
+        """Update the maxima with a (samples, steps, dim) chunk of training data"""
+        chunk_max = np.max(np.max(np.abs(x), axis=0), axis=0)
+        self.feature_max = chunk_max if self.feature_max is None else np.maximum(self.feature_max, chunk_max)
+        return self
+
+    def fit(self, x, chunk_size=4096):
+        self.feature_max = None
+        for start in range(0, len(x), chunk_size):
+            self.partial_fit(x[start:start + chunk_size])
+        return self
+
+    @property
+    def scale(self):
+        if self.feature_max is None:
+            raise ValueError('The normalizer has not been fitted')
+        scale = self.feature_max.copy()
+        scale[scale == 0] = 1 # if the maximum is 0 we don't normalize this dimension
+        return scale
+
+    def transform(self, x, chunk_size=4096):
+        """Scale x in place (it can be a writable memory-mapped file) and remove possible NaN values, returns x"""
+        scale = self.scale.astype(x.dtype)
+        for start in range(0, len(x), chunk_size):
+            chunk = x[start:start + chunk_size]
+            chunk /= scale
+            chunk[chunk != chunk] = 0
+        return x
+
+
+def normalizers_path(weights_path):
+    """File the normalizers of a model are saved to, next to its weights file"""
+    return os.path.splitext(weights_path)[0] + '_normalizers.npz'
+
+
+def save_normalizers(path, normalizers):
+    """Save a dict of fitted normalizers, keyed by modality, to an .npz file"""
+    with open(path, 'wb') as f:
+        np.savez(f, **dict((modality, normalizer.feature_max) for modality, normalizer in normalizers.items()))
+
+
+def load_normalizers(path):
+    """The dict of normalizers saved by save_normalizers"""
+    with np.load(path) as stats:
+        return dict((modality, MaxAbsNormalizer(stats[modality])) for modality in stats.files)
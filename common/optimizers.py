@@ -0,0 +1,94 @@
+# Gradient accumulation for training with a large effective batch when the activations of the
+# whole batch do not fit in memory: the gradients of several micro-batches are summed and the
+# optimizer takes one step with their mean, as it would with the gradient of the large batch.
+
+import contextlib
+from keras import backend as K
+from keras.optimizers import Adamax
+
+
+def _update_arguments(args, kwargs):
+    # Keras calls get_updates(params, constraints, loss) before 2.0.7, get_updates(loss=, params=) since
+    if len(args) == 3:
+        params, constraints, loss = args
+        return loss, params, constraints
+    kwargs = dict(zip(('loss', 'params'), args), **kwargs)
+    return kwargs['loss'], kwargs['params'], kwargs.get('constraints') or {}
+
+
+@contextlib.contextmanager
+def _after(tensors):
+    # ops created in the block run after the tensors are computed (Theano applies all updates at the end anyway)
+    if K.backend() == 'tensorflow':
+        import tensorflow as tf
+        with tf.control_dependencies(tensors):
+            yield
+    else:
+        yield
+
+
+class AccumulatedAdamax(Adamax):
+    """Adamax that updates the weights once every accumulation_steps batches.
+
+    The gradients of accumulation_steps consecutive (micro-)batches are summed, and their mean is
+    used for one Adamax step, with the step count, learning rate decay and moments of Adamax
+    advancing only on the update. Since the Keras losses are means over the batch, this is the
+    update of one batch of accumulation_steps * batch_size samples, except that a smaller last
+    batch of an epoch counts as much as a full one. Accumulated gradients carry over to the next
+    epoch.
+    """
+
+    def __init__(self, accumulation_steps=2, **kwargs):
+        super(AccumulatedAdamax, self).__init__(**kwargs)
+        self.accumulation_steps = accumulation_steps
+        self.micro_batches = K.variable(0., name='micro_batches')
+
+    def get_updates(self, *args, **kwargs):
+        loss, params, constraints = _update_arguments(args, kwargs)
+        grads = self.get_gradients(loss, params)
+        micro_batches = self.micro_batches + 1
+        # 1 on the micro-batch that completes an accumulation, else 0
+        apply = K.cast(K.equal(micro_batches % self.accumulation_steps, 0), K.floatx())
+        new_values = [(self.micro_batches, micro_batches),
+                      (self.iterations, self.iterations + K.cast(apply, K.dtype(self.iterations)))]
+
+        iterations = K.cast(self.iterations, K.floatx())
+        lr = self.lr
+        if self.initial_decay > 0:
+            lr *= (1. / (1. + self.decay * iterations))
+        t = iterations + 1
+        lr_t = lr / (1. - K.pow(self.beta_1, t))
+
+        shapes = [K.int_shape(p) for p in params]
+        accumulators = [K.zeros(shape) for shape in shapes]
+        ms = [K.zeros(shape) for shape in shapes]
+        us = [K.zeros(shape) for shape in shapes]
+        self.weights = [self.iterations] + ms + us + [self.micro_batches] + accumulators
+
+        for p, g, a, m, u in zip(params, grads, accumulators, ms, us):
+            a_t = a + g
+            g_t = a_t / self.accumulation_steps
+            m_t = (self.beta_1 * m) + (1. - self.beta_1) * g_t
+            u_t = K.maximum(self.beta_2 * u, K.abs(g_t))
+            p_t = p - lr_t * m_t / (u_t + self.epsilon)
+            if p in constraints:
+                p_t = constraints[p](p_t)
+            elif getattr(p, 'constraint', None) is not None:
+                p_t = p.constraint(p_t)
+
+            # the accumulator starts again after an update, the moments and weights only change on one
+            new_values += [(a, (1. - apply) * a_t),
+                           (m, apply * m_t + (1. - apply) * m),
+                           (u, apply * u_t + (1. - apply) * u),
+                           (p, apply * p_t + (1. - apply) * p)]
+
+        # all new values are computed from the old ones before any variable is assigned, as whether
+        # to apply the update depends on the micro-batch counter
+        with _after([value for _, value in new_values]):
+            self.updates = [K.update(variable, value) for variable, value in new_values]
+        return self.updates
+
+    def get_config(self):
+        config = {'accumulation_steps': self.accumulation_steps}
+        base_config = super(AccumulatedAdamax, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
@@ -0,0 +1,228 @@
+# Data preprocessing shared by the unimodal and multimodal scripts:
+# loading MOSI, word level alignment, padding, labels and normalization
+
+from __future__ import print_function
+import numpy as np
+
+from common.alignment import parallel_align
+from common.labels import encode_labels
+from common.normalization import MaxAbsNormalizer
+from common.profiling import phase
+from common.synthetic import synthetic_config, synthetic_mosi
+
+# short names used for the feature arrays, e.g. x_A_train holds the covarep features
+MODALITY_CODES = {'covarep': 'A', 'facet': 'V', 'embeddings': 'T'}
+# only the acoustic and visual features are normalized, the word embeddings are used as they are
+NORMALIZED_MODALITIES = ('covarep', 'facet')
+SPLITS = ('train', 'valid', 'test')
+# dtype of the feature arrays from padding to the model input, Keras computes in float32 anyway
+FEATURE_DTYPE = 'float32'
+
+
+def pad(data, max_len):
+    """A funtion for padding/truncating sequence data to a given lenght"""
+    # recall that data at each time step is a tuple (start_time, end_time, feature_vector), we only take the vector
+    data = np.array([feature[2] for feature in data])
+    n_rows = data.shape[0]
+    dim = data.shape[1]
+    if max_len >= n_rows:
+        diff = max_len - n_rows
+        padding = np.zeros((diff, dim), dtype=data.dtype)
+        padded = np.concatenate((padding, data))
+        return padded
+    else:
+        return data[-max_len:]
+
+
+def feature_vectors(steps):
+    """Feature vectors of a sequence of (start_time, end_time, feature_vector) tuples, arrays are used as they are"""
+    if isinstance(steps, np.ndarray):
+        return steps
+    return [step[2] for step in steps]
+
+
+def pad_sequences(sequences, max_len, padding='pre', truncating='pre', dtype=FEATURE_DTYPE, dim=None, out=None):
+    """Pad/truncate a whole split of sequences into one preallocated (N, max_len, dim) array.
+
+    Each sequence is a list of (start_time, end_time, feature_vector) tuples, or a (steps, dim)
+    array of feature vectors as returned by a FeatureStore. The default keeps
+    the last max_len steps and pads zeros at the front, as pad() does for a single sequence;
+    padding='post' and truncating='post' keep the first max_len steps and pad at the end.
+    The result is written into out if given, e.g. a slice of a memory-mapped array.
+    """
+    if out is not None:
+        padded = out
+        padded[...] = 0
+    else:
+        if dim is None:
+            dim = next((len(feature_vectors(seq[:1])[0]) for seq in sequences if len(seq)), None)
+            if dim is None:
+                raise ValueError('Cannot infer the feature dimension from empty sequences, please pass dim')
+        padded = np.zeros((len(sequences), max_len, dim), dtype=dtype)
+    for i, seq in enumerate(sequences):
+        steps = seq[-max_len:] if truncating == 'pre' else seq[:max_len]
+        if not len(steps):
+            continue
+        if padding == 'pre':
+            padded[i, max_len - len(steps):] = feature_vectors(steps)
+        else:
+            padded[i, :len(steps)] = feature_vectors(steps)
+    return padded
+
+
+def normalize(x_train, x_valid, x_test, chunk_size=4096):
+    """Scale features in place by the per-dimension max absolute value of the training set, remove possible NaN values.
+
+    The arrays are processed chunk_size samples at a time, so they can be memory-mapped files
+    larger than RAM. Returns the arrays.
+    """
+    normalizer = MaxAbsNormalizer().fit(x_train, chunk_size)
+    for x in (x_train, x_valid, x_test):
+        normalizer.transform(x, chunk_size)
+    return x_train, x_valid, x_test
+
+
+def load_mosi_features(modalities):
+    """Download the data if not present and return (features, sentiments, split video ids).
+
+    With MOSI_SYNTHETIC set the features are synthetic (see common.synthetic) instead.
+    """
+    config = synthetic_config()
+    if config is not None:
+        with phase('mosi load'):
+            return synthetic_mosi(modalities, config['scale'], config['seed'])
+    from mmdata import MOSI
+    with phase('mosi load'):
+        mosi = MOSI()
+        features = dict((modality, getattr(mosi, modality)()) for modality in modalities)
+        split_vids = {'train': mosi.train(), 'valid': mosi.valid(), 'test': mosi.test()}
+        return features, mosi.sentiments(), split_vids
+
+
+def align_features(features, modalities, anchor, processes=None, vids=None):
+    """Merge different features and do word level feature alignment (align according to timestamps of the anchor).
+
+    The videos are aligned in parallel by a pool of processes (all cores by default, see
+    common.alignment), processes=1 runs mmdata's serial alignment. If vids is given only
+    those videos are aligned.
+    """
+    with phase('merge'):
+        # mmdata's Dataset.merge, or the one of the synthetic datasets
+        merge = type(features[anchor]).merge
+        merged = features[anchor]
+        for modality in modalities:
+            if modality != anchor:
+                merged = merge(merged, features[modality])
+    with phase('align'):
+        return parallel_align(merged, anchor, modalities, processes, vids)
+
+
+def segment_ids(dataset, vid, modalities, anchor):
+    """IDs of the segments of a video that have data in every modality, in the order of the anchor"""
+    return [sid for sid in dataset[anchor][vid].keys()
+            if all(len(dataset[modality][vid][sid]) for modality in modalities)]
+
+
+def aligned_set_ids(dataset, vids, modalities, anchor):
+    """Sort through all the video ID, segment ID pairs that have data in every modality"""
+    return [(vid, sid) for vid in vids for sid in segment_ids(dataset, vid, modalities, anchor)]
+
+
+def split_unaligned(video_sids, split_vids):
+    """Partition the segments of every video as in the text-only scripts, video_sids is an ordered list of (vid, sids)"""
+    set_ids = dict((split, []) for split in SPLITS)
+    for vid, sids in video_sids:
+        if vid in split_vids['train']:
+            split = 'train'
+        elif vid in split_vids['valid']:
+            split = 'valid'
+        else:
+            split = 'test'
+        set_ids[split].extend((vid, sid) for sid in sids)
+    return set_ids
+
+
+def unaligned_set_ids(dataset, modality, split_vids):
+    """Segment IDs of a single unaligned feature, partitioned as in the text-only scripts"""
+    # note that even Dataset with one feature will require explicit indexing of features
+    video_sids = [(vid, segment_ids(dataset, vid, [modality], modality)) for vid in dataset[modality].keys()]
+    return split_unaligned(video_sids, split_vids)
+
+
+def aligned_features(modalities, anchor='embeddings', processes=None):
+    """Load MOSI and return (dataset, set_ids, scores) with the features, (vid, sid) pairs and sentiment scores per split.
+
+    With an anchor the modalities are aligned to its word timestamps. Without an anchor a
+    single modality is used unaligned and partitioned as in the text-only scripts.
+    """
+    modalities = list(modalities)
+    features, sentiments, split_vids = load_mosi_features(modalities)
+
+    print("Preparing train and test data...")
+    if anchor is None:
+        if len(modalities) != 1:
+            raise ValueError('Unaligned data can only be prepared for a single modality, got %s' % modalities)
+        dataset = features[modalities[0]]
+        set_ids = unaligned_set_ids(dataset, modalities[0], split_vids)
+    else:
+        dataset = align_features(features, modalities, anchor, processes)
+        set_ids = dict((split, aligned_set_ids(dataset, split_vids[split], modalities, anchor)) for split in SPLITS)
+    scores = dict((split, [sentiments[vid][sid] for (vid, sid) in set_ids[split]]) for split in SPLITS)
+    return dataset, set_ids, scores
+
+
+def build_arrays(dataset, modalities, set_ids, scores, max_len=15, pad_side='pre', allocate=None, chunk_size=4096,
+                 dtype=FEATURE_DTYPE, normalizers=None):
+    """Build the padded, normalized feature arrays and labels for every split.
+
+    dataset is indexed as dataset[modality][vid][sid], either a mmdata Dataset or the stores
+    from open_features(). pad_side='pre' keeps the last max_len steps and pads zeros at the
+    front, 'post' keeps the first max_len steps and pads at the end. The feature arrays are
+    created with allocate(key, shape, dtype) (np.zeros by default, e.g. a memory-mapped file
+    instead) and filled chunk_size samples at a time. The features and scores are dtype arrays.
+    The acoustic and visual features are scaled with the given normalizers ({modality:
+    MaxAbsNormalizer}, e.g. loaded with a trained model), or with ones fitted on the training split.
+    Returns a dict with x_<code>_<split>, y_<split>, z1_<split>, z2_<split>, ids_<split> and
+    the normalizers used.
+    """
+    if allocate is None:
+        allocate = lambda key, shape, dtype: np.zeros(shape, dtype=dtype)
+    normalizers = dict(normalizers or {})
+
+    # data will have shape (dataset_size, max_len, feature_dim)
+    data = {}
+    for modality in modalities:
+        code = MODALITY_CODES[modality]
+        all_ids = [pair for split in SPLITS for pair in set_ids[split]]
+        dim = next(len(feature_vectors(dataset[modality][vid][sid][:1])[0]) for (vid, sid) in all_ids if len(dataset[modality][vid][sid]))
+        for split in SPLITS:
+            key = 'x_%s_%s' % (code, split)
+            ids = set_ids[split]
+            data[key] = allocate(key, (len(ids), max_len, dim), dtype)
+            with phase('padding'):
+                for start in range(0, len(ids), chunk_size):
+                    sequences = [dataset[modality][vid][sid] for (vid, sid) in ids[start:start + chunk_size]]
+                    pad_sequences(sequences, max_len, padding=pad_side, truncating=pad_side, out=data[key][start:start + chunk_size])
+        if modality in NORMALIZED_MODALITIES:
+            with phase('normalization'):
+                if modality not in normalizers:
+                    normalizers[modality] = MaxAbsNormalizer().fit(data['x_%s_train' % code], chunk_size)
+                for split in SPLITS:
+                    normalizers[modality].transform(data['x_%s_%s' % (code, split)], chunk_size)
+
+    for split in SPLITS:
+        # sentiment scores, binary polarity and intensity classes
+        # the classes are derived from the exact scores, so that rounding can not move a score across a threshold
+        y = np.array(scores[split], dtype='float64')
+        data['y_' + split] = y.astype(dtype)
+        data['z1_' + split], data['z2_' + split] = encode_labels(y)
+        data['ids_' + split] = set_ids[split]
+    data['normalizers'] = normalizers
+    return data
+
+
+def prepare_arrays(modalities, anchor='embeddings', max_len=15, dtype=FEATURE_DTYPE, normalizers=None):
+    """Padded, normalized feature arrays and labels for every split, computed directly from mmdata"""
+    dataset, set_ids, scores = aligned_features(modalities, anchor)
+    return build_arrays(dataset, modalities, set_ids, scores, max_len, 'pre' if anchor else 'post', dtype=dtype,
+                        normalizers=normalizers)
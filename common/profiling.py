@@ -0,0 +1,144 @@
+# Phase timeline of a run: wall time, CPU time and peak resident memory of every phase (loading,
+# alignment, padding, training, ...), so that the phase that dominates the time or the memory of a
+# run can be found. The library code marks its phases on the module's profiler, the scripts mark
+# the phases of the model with profiler.switch().
+
+from __future__ import print_function
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows, no RSS is recorded
+    resource = None
+
+MB = 1024.0 * 1024.0
+
+
+def current_rss():
+    """Resident set size of this process in bytes (the peak so far where /proc is not available)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        if resource is None:
+            return 0
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def cpu_times():
+    """(CPU time of this process, CPU time of its finished child processes) in seconds"""
+    times = os.times()
+    return times[0] + times[1], times[2] + times[3]
+
+
+class PhaseProfiler(object):
+    """Records the wall time, CPU time and peak RSS of named phases.
+
+    Phases are marked with the phase(name) context manager, which can be nested, or one after
+    another with switch(name), which ends the phase started by the previous switch(). While a
+    phase is open, a background thread samples the RSS every sample_interval seconds.
+    """
+
+    def __init__(self, sample_interval=0.01):
+        self.sample_interval = sample_interval
+        self._reset()
+
+    def _reset(self):
+        self.records = []
+        self._open = []
+        self._current = None
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._origin = time.time()
+        self._pid = os.getpid()
+
+    def _sample(self):
+        while True:
+            time.sleep(self.sample_interval)
+            rss = current_rss()
+            with self._lock:
+                for record in self._open:
+                    record['peak_rss'] = max(record['peak_rss'], rss)
+
+    def start(self, name):
+        if self._pid != os.getpid():
+            # a forked worker starts its own timeline, without the sampler thread and lock of the parent
+            self._reset()
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample)
+            self._sampler.daemon = True
+            self._sampler.start()
+        rss = current_rss()
+        cpu, cpu_children = cpu_times()
+        with self._lock:
+            record = {'phase': name, 'parent': self._open[-1]['phase'] if self._open else None, 'depth': len(self._open),
+                      'start': time.time() - self._origin, 'rss_start': rss, 'peak_rss': rss,
+                      '_cpu': cpu, '_cpu_children': cpu_children}
+            self._open.append(record)
+        return record
+
+    def end(self, record):
+        rss = current_rss()
+        cpu, cpu_children = cpu_times()
+        with self._lock:
+            self._open.remove(record)
+            record['wall'] = time.time() - self._origin - record['start']
+            record['cpu'] = cpu - record.pop('_cpu')
+            record['cpu_children'] = cpu_children - record.pop('_cpu_children')
+            record['rss_end'] = rss
+            record['peak_rss'] = max(record['peak_rss'], rss)
+            self.records.append(record)
+        return record
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        record = self.start(name)
+        try:
+            yield record
+        finally:
+            self.end(record)
+
+    def switch(self, name):
+        """End the phase of the previous switch() and start the phase name"""
+        self.stop()
+        self._current = self.start(name)
+
+    def stop(self):
+        """End the phase of the last switch()"""
+        if self._current is not None:
+            self.end(self._current)
+            self._current = None
+
+    def elapsed(self):
+        """Seconds since the profiler was created, the time base of the timeline"""
+        return time.time() - self._origin
+
+    def timeline(self, since=0.0):
+        """The finished phases that started after since (see elapsed()), in the order they started"""
+        return sorted([record for record in self.records if record['start'] >= since], key=lambda record: record['start'])
+
+    def write(self, path, since=0.0):
+        """Write the timeline to path, one JSON record per phase (times in seconds, memory in bytes)"""
+        with open(path, 'w') as f:
+            for record in self.timeline(since):
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def summary(self, since=0.0):
+        """The timeline as a table, nested phases indented under the phase they ran in"""
+        lines = ['%-32s %10s %10s %10s %12s' % ('Phase', 'Wall (s)', 'CPU (s)', 'Child CPU', 'Peak RSS MB')]
+        for record in self.timeline(since):
+            lines.append('%-32s %10.2f %10.2f %10.2f %12.1f' % ('  ' * record['depth'] + record['phase'], record['wall'],
+                                                              record['cpu'], record['cpu_children'], record['peak_rss'] / MB))
+        return '\n'.join(lines)
+
+
+# the profiler of this process, on which the library code and the scripts mark their phases
+profiler = PhaseProfiler()
+phase = profiler.phase
@@ -0,0 +1,155 @@
+# Run a matrix of configurations on a process pool. Every job gets a share of the cores (the
+# TensorFlow and BLAS thread pools are capped), writes into its own directory that is moved into
+# place only when the run finished, and the state of the sweep is kept in sweep.json so that an
+# interrupted sweep resumes with the runs that did not finish.
+
+from __future__ import print_function
+import contextlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import traceback
+
+from common.cache import load_mosi
+from common.configs import dataset_spec, parse_name, ENCODER_OUTPUTS, VARIABLE_LENGTH_MODELS, WARM_START_BRANCHES
+
+STATE_FILE = 'sweep.json'
+# the thread counts of the BLAS and OpenMP libraries, read when they are loaded
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+# the training snapshots of the runs, outside of their temporary directories that are removed on failure
+SNAPSHOT_DIR = '.snapshots'
+
+
+def read_state(sweep_dir):
+    """{name: {'status': 'pending'|'done'|'failed', ...}} of a sweep, empty for a new one"""
+    try:
+        with open(os.path.join(sweep_dir, STATE_FILE)) as f:
+            return json.load(f)
+    except IOError:
+        return {}
+
+
+def write_state(sweep_dir, state):
+    tmp_path = os.path.join(sweep_dir, STATE_FILE + '.tmp.%d' % os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.rename(tmp_path, os.path.join(sweep_dir, STATE_FILE))
+
+
+@contextlib.contextmanager
+def thread_environment(threads):
+    """Set the thread variables for the processes started in the block"""
+    saved = dict((var, os.environ.get(var)) for var in THREAD_VARIABLES)
+    os.environ.update((var, str(threads)) for var in THREAD_VARIABLES)
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+def limit_threads(threads):
+    """Cap the threads of the numerical libraries loaded from now on and the TensorFlow session of this process"""
+    os.environ.update((var, str(threads)) for var in THREAD_VARIABLES)
+    from keras import backend as K
+    if K.backend() == 'tensorflow':
+        import tensorflow as tf
+        config = tf.ConfigProto(intra_op_parallelism_threads=threads, inter_op_parallelism_threads=threads)
+        K.set_session(tf.Session(config=config))
+
+
+def _run_job(job):
+    """Run one configuration in a pool worker, returns (name, status, results or error)"""
+    (name, sweep_dir, maxlen, bucketing, threads, tfn_fusion, checkpoint, batch_size, accumulation_steps, snapshot_period,
+     warm_start, freeze_epochs, cache_encodings, streaming) = job
+    tmp_dir = os.path.join(sweep_dir, '.%s.tmp.%d' % (name, os.getpid()))
+    try:
+        limit_threads(threads)
+        from common.experiments import run_experiment
+        model_type, task = parse_name(name)
+        modalities, anchor = dataset_spec(model_type)
+        data = load_mosi(list(modalities), anchor=anchor, max_len=maxlen)
+        os.makedirs(tmp_dir)
+        cached = cache_encodings and model_type in ENCODER_OUTPUTS
+        results = run_experiment(name, data, tmp_dir, maxlen, bucketing and model_type in VARIABLE_LENGTH_MODELS and not cached, verbose=0,
+                                 tfn_fusion=tfn_fusion, checkpoint=checkpoint.get(model_type, ()),
+                                 batch_size=batch_size, accumulation_steps=accumulation_steps,
+                                 snapshot_dir=os.path.join(sweep_dir, SNAPSHOT_DIR), snapshot_period=snapshot_period,
+                                 warm_start=warm_start if model_type in WARM_START_BRANCHES else None, freeze_epochs=freeze_epochs,
+                                 cache_encodings=cached, streaming=streaming)
+        with open(os.path.join(tmp_dir, 'results.json'), 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        # publish the outputs of the finished run at once
+        run_dir = os.path.join(sweep_dir, name)
+        if os.path.isdir(run_dir):
+            shutil.rmtree(run_dir)
+        os.rename(tmp_dir, run_dir)
+        return name, 'done', results
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return name, 'failed', traceback.format_exc()
+
+
+def run_sweep(names, sweep_dir, jobs=2, threads_per_job=None, maxlen=15, bucketing=False, retry_failed=True, tfn_fusion='tensor',
+              checkpoint=None, batch_size=128, accumulation_steps=1, snapshot_period=1, warm_start=None, freeze_epochs=0,
+              cache_encodings=False, streaming=False):
+    """Run the configurations on a pool of jobs processes, resuming the sweep in sweep_dir.
+
+    Every run writes into sweep_dir/<name>/ (log, predictions, weights and results.json).
+    Runs that are done in sweep.json are skipped; runs that are still pending because the sweep
+    was interrupted, and failed ones if retry_failed, are run again. Every job uses threads_per_job threads, by default the
+    cores divided by jobs. checkpoint maps model types to the segments to checkpoint, batch_size
+    and accumulation_steps set the (micro-)batches, as in run_experiments. The training state of the
+    runs is saved every snapshot_period epochs to sweep_dir/.snapshots/, from where a run interrupted
+    with the sweep continues on resume. warm_start and freeze_epochs apply to the DL, HL and TFN
+    models, from unimodal models of an earlier run or sweep, and with cache_encodings their fusion layers
+    are trained on the cached branch outputs (shared by the jobs through the cache directory).
+    streaming applies to the configurations without bucketing, as in run_experiments.
+    Returns the state of the sweep.
+    """
+    if not os.path.isdir(sweep_dir):
+        os.makedirs(sweep_dir)
+    threads_per_job = threads_per_job or max(1, multiprocessing.cpu_count() // jobs)
+    state = read_state(sweep_dir)
+    todo = [name for name in names
+            if state.get(name, {}).get('status') != 'done' and (retry_failed or state.get(name, {}).get('status') != 'failed')]
+    print('Sweep %s: %d of %d runs to do, %d jobs with %d threads each'
+          % (sweep_dir, len(todo), len(names), jobs, threads_per_job))
+    if not todo:
+        return state
+
+    # prepare the cached arrays once, before the workers memory-map them
+    for spec in sorted(set(dataset_spec(parse_name(name)[0]) for name in todo)):
+        load_mosi(list(spec[0]), anchor=spec[1], max_len=maxlen)
+
+    for name in todo:
+        state[name] = {'status': 'pending', 'queued': time.time(), 'attempts': state.get(name, {}).get('attempts', 0) + 1}
+    write_state(sweep_dir, state)
+    # a fresh process per run, so that nothing of a finished model stays in memory. The workers are
+    # new interpreters, which load numpy and BLAS with the thread variables: forked workers would
+    # inherit the thread pools of this process, where numpy is loaded already (Python 2 only forks)
+    context = multiprocessing.get_context('spawn') if hasattr(multiprocessing, 'get_context') else multiprocessing
+    with thread_environment(threads_per_job):
+        pool = context.Pool(jobs, maxtasksperchild=1)
+        try:
+            for name, status, outcome in pool.imap_unordered(_run_job, [(name, sweep_dir, maxlen, bucketing, threads_per_job, tfn_fusion, checkpoint or {},
+                                                                           batch_size, accumulation_steps, snapshot_period, warm_start, freeze_epochs,
+                                                                           cache_encodings, streaming)
+                                                                          for name in todo]):
+                state[name].update({'status': status, 'finished': time.time()})
+                state[name]['results' if status == 'done' else 'error'] = outcome
+                write_state(sweep_dir, state)
+                print('%-16s %s' % (name, status if status == 'failed' else 'done, test cc: %.4f' % outcome['test']['cc']))
+            pool.close()
+        except BaseException:
+            # the interrupted runs stay 'pending' in sweep.json and are repeated on resume
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    return state
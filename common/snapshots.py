@@ -0,0 +1,159 @@
+# Snapshots of a running fit (model weights, optimizer state, epoch and early stopping state), so
+# that a training run that is interrupted, e.g. by a preempted cluster job, continues from its last
+# snapshot instead of epoch 0. The state is copied at the end of an epoch and written to disk by a
+# background thread while training goes on. BestWeights keeps the weights of the best validation
+# epoch and puts them back into the model when training stops.
+
+from __future__ import print_function
+import json
+import os
+import threading
+import numpy as np
+from keras import backend as K
+from keras.callbacks import Callback
+
+# the lists of arrays of a snapshot: model weights, optimizer weights and the best weights so far
+WEIGHT_LISTS = ('weights', 'optimizer', 'best_weights')
+
+
+def save_snapshot(path, state):
+    """Write a snapshot atomically: the arrays and a JSON record of the scalar state"""
+    tmp_path = path + '.tmp.%d.npz' % os.getpid()
+    arrays = {}
+    meta = dict((key, value) for key, value in state.items() if key not in WEIGHT_LISTS)
+    for key in WEIGHT_LISTS:
+        values = state.get(key) or []
+        arrays.update(('%s_%d' % (key, i), value) for i, value in enumerate(values))
+        meta['n_' + key] = len(values)
+    np.savez(tmp_path, meta=np.array(json.dumps(meta)), **arrays)
+    os.rename(tmp_path, path)
+
+
+def load_snapshot(path):
+    """The state written by save_snapshot, None if there is no snapshot"""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as arrays:
+        state = json.loads(str(arrays['meta']))
+        for key in WEIGHT_LISTS:
+            state[key] = [arrays['%s_%d' % (key, i)] for i in range(state.pop('n_' + key))]
+    return state
+
+
+def _as_list(callbacks):
+    if callbacks is None:
+        return []
+    return list(callbacks) if isinstance(callbacks, (list, tuple)) else [callbacks]
+
+
+class BestWeights(Callback):
+    """Keeps a copy of the weights of the epoch with the lowest monitor value and restores them when training ends.
+
+    EarlyStopping stops patience epochs after the best epoch, with the weights of the last one;
+    with this callback the model is left with the best weights instead, for the evaluation,
+    predictions and saved weights of the run.
+    """
+
+    def __init__(self, monitor='val_loss'):
+        super(BestWeights, self).__init__()
+        self.monitor = monitor
+        self.best = np.inf
+        self.best_epoch = None
+        self.weights = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        current = (logs or {}).get(self.monitor)
+        if current is not None and current < self.best:
+            self.best, self.best_epoch = float(current), epoch
+            self.weights = self.model.get_weights()
+
+    def on_train_end(self, logs=None):
+        if self.weights is not None:
+            print('Restoring the weights of epoch %d (%s %.4f)' % (self.best_epoch + 1, self.monitor, self.best))
+            self.model.set_weights(self.weights)
+
+
+class Snapshot(Callback):
+    """Saves the training state to path every period epochs and restores it with resume().
+
+    Use it after the EarlyStopping and BestWeights callbacks, so that the snapshot holds their
+    state after the epoch and the restored state replaces the one EarlyStopping resets at the
+    start of training:
+        snapshot = Snapshot(path, early_stopping, best_weights)
+        model.fit(..., initial_epoch=snapshot.resume(model), callbacks=[early_stopping, best_weights, snapshot])
+    The snapshot is deleted when training ends, as a finished fit has nothing to resume.
+    The weights saved are those of weights_model if given, by default of the model being trained;
+    pass the whole model when only a part of it is trained (see common.encodings), and resume it.
+    early_stopping and best_weights can also be lists, e.g. one of each per variant of a
+    multi-variant model (see common.variants).
+    """
+
+    def __init__(self, path, early_stopping=None, best_weights=None, period=1, weights_model=None):
+        super(Snapshot, self).__init__()
+        self.path = path
+        self.weights_model = weights_model
+        self.early_stopping = _as_list(early_stopping)
+        self.best_weights = _as_list(best_weights)
+        self.period = period
+        self._restore = None
+        self._writer = None
+
+    def resume(self, model):
+        """Load the weights of the last snapshot into model, returns the epoch to continue from (0 if there is none).
+
+        The optimizer, early stopping and best weights state are restored when training begins.
+        """
+        state = load_snapshot(self.path)
+        if state is None:
+            return 0
+        model.set_weights(state['weights'])
+        self._restore = state
+        print('Resuming training after epoch %d from %s' % (state['epoch'], self.path))
+        return state['epoch']
+
+    def on_train_begin(self, logs=None):
+        if self._restore is None:
+            return
+        state, self._restore = self._restore, None
+        # the optimizer weights exist once fit has made the training function
+        weights = self.model.optimizer.weights
+        if len(weights) != len(state['optimizer']):
+            raise ValueError('The snapshot %s holds %d optimizer weights, the optimizer has %d'
+                             % (self.path, len(state['optimizer']), len(weights)))
+        K.batch_set_value(list(zip(weights, state['optimizer'])))
+        for early_stopping, saved in zip(self.early_stopping, state['early_stopping']):
+            early_stopping.wait, early_stopping.best = saved['wait'], saved['best']
+            early_stopping.stopped_epoch = saved['stopped_epoch']
+        # the best weights of all callbacks are stored one after the other
+        start = 0
+        for best_weights, saved in zip(self.best_weights, state['best']):
+            if saved['count']:
+                best_weights.weights = state['best_weights'][start:start + saved['count']]
+                best_weights.best, best_weights.best_epoch = saved['value'], saved['epoch']
+                start += saved['count']
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.period:
+            return
+        state = {'epoch': epoch + 1, 'weights': (self.weights_model or self.model).get_weights(),
+                 'optimizer': K.batch_get_value(self.model.optimizer.weights), 'best_weights': [], 'best': [],
+                 'early_stopping': [{'wait': early_stopping.wait, 'best': float(early_stopping.best),
+                                     'stopped_epoch': early_stopping.stopped_epoch} for early_stopping in self.early_stopping]}
+        for best_weights in self.best_weights:
+            weights = best_weights.weights or []
+            state['best_weights'] += weights
+            state['best'].append({'value': best_weights.best, 'epoch': best_weights.best_epoch, 'count': len(weights)})
+        # at most one snapshot is written at a time, the next epoch usually takes longer than a write
+        self._join()
+        self._writer = threading.Thread(target=save_snapshot, args=(self.path, state))
+        self._writer.start()
+
+    def on_train_end(self, logs=None):
+        self._join()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _join(self):
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
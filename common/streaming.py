@@ -0,0 +1,130 @@
+# Streaming training path: padded batches are read lazily from the (memory-mapped) arrays
+# and fed to Keras through a bounded prefetch queue, instead of materializing every split
+
+import threading
+import numpy as np
+
+try:
+    from queue import Queue, Full, Empty
+except ImportError:  # Python 2
+    from Queue import Queue, Full, Empty
+
+
+class BatchStream(object):
+    """Batches of a split, read on demand from arrays that can be memory-mapped files.
+
+    inputs is one array or a list of arrays (e.g. [x_A, x_V, x_T] for the DL/HL/TFN models),
+    targets one array or a dict of arrays keyed by output name. With merge_inputs=True the
+    inputs are concatenated along the feature axis per batch, as the early fusion (FL) models
+    expect, so the concatenated split never exists in memory.
+    """
+
+    def __init__(self, inputs, targets=None, batch_size=128, shuffle=False, merge_inputs=False, seed=None):
+        self.inputs = inputs
+        self.targets = targets
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.merge_inputs = merge_inputs
+        self.rng = np.random.RandomState(seed)
+        first = inputs[0] if isinstance(inputs, (list, tuple)) else inputs
+        self.n_samples = len(first)
+
+    def __len__(self):
+        """Number of batches per epoch"""
+        return int(np.ceil(self.n_samples / float(self.batch_size)))
+
+    def _take(self, arrays, index):
+        if arrays is None:
+            return None
+        if isinstance(arrays, dict):
+            return dict((name, array[index]) for name, array in arrays.items())
+        if isinstance(arrays, (list, tuple)):
+            batch = [array[index] for array in arrays]
+            return np.concatenate(batch, axis=-1) if self.merge_inputs else batch
+        return arrays[index]
+
+    def batch(self, index):
+        """(inputs, targets) for the given sample indices, or only the inputs if there are no targets"""
+        x = self._take(self.inputs, index)
+        if self.targets is None:
+            return x
+        return x, self._take(self.targets, index)
+
+    def batches(self, epochs=None):
+        """Yield batches epoch after epoch (forever by default, as Keras' *_generator methods expect)"""
+        epoch = 0
+        while epochs is None or epoch < epochs:
+            order = self.rng.permutation(self.n_samples) if self.shuffle else np.arange(self.n_samples)
+            for start in range(0, self.n_samples, self.batch_size):
+                # sorted indices keep the reads from memory-mapped files sequential
+                yield self.batch(np.sort(order[start:start + self.batch_size]))
+            epoch += 1
+
+
+def prefetch(batches, queue_size=10):
+    """Read batches ahead in a background thread, holding at most queue_size of them in memory"""
+    queue = Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for batch in batches:
+                while not stop.is_set():
+                    try:
+                        queue.put((None, batch), timeout=0.1)
+                        break
+                    except Full:
+                        pass
+                if stop.is_set():
+                    return
+            queue.put((None, done))
+        except Exception as e:
+            queue.put((e, None))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            error, batch = queue.get()
+            if error is not None:
+                raise error
+            if batch is done:
+                return
+            yield batch
+    finally:
+        # stop the reader when Keras drops the generator
+        stop.set()
+        try:
+            while True:
+                queue.get_nowait()
+        except Empty:
+            pass
+
+
+def fit_stream(model, x_train, y_train, x_valid, y_valid, batch_size=128, epochs=1, callbacks=None,
+               merge_inputs=False, queue_size=10, verbose=1, initial_epoch=0):
+    """model.fit() equivalent that streams shuffled training batches and the validation batches"""
+    train = BatchStream(x_train, y_train, batch_size, shuffle=True, merge_inputs=merge_inputs)
+    valid = BatchStream(x_valid, y_valid, batch_size, merge_inputs=merge_inputs)
+    return model.fit_generator(prefetch(train.batches(), queue_size),
+                               steps_per_epoch=len(train),
+                               epochs=epochs,
+                               verbose=verbose,
+                               callbacks=callbacks,
+                               validation_data=prefetch(valid.batches(), queue_size),
+                               validation_steps=len(valid),
+                               initial_epoch=initial_epoch)
+
+
+def evaluate_stream(model, x, y, batch_size=128, merge_inputs=False, queue_size=10):
+    """model.evaluate() equivalent reading the batches lazily"""
+    stream = BatchStream(x, y, batch_size, merge_inputs=merge_inputs)
+    return model.evaluate_generator(prefetch(stream.batches(), queue_size), steps=len(stream))
+
+
+def predict_stream(model, x, batch_size=128, merge_inputs=False, queue_size=10):
+    """model.predict() equivalent reading the batches lazily"""
+    stream = BatchStream(x, None, batch_size, merge_inputs=merge_inputs)
+    return model.predict_generator(prefetch(stream.batches(), queue_size), steps=len(stream))
@@ -0,0 +1,167 @@
+# Synthetic MOSI-shaped data, for benchmarks and for machines that can not download the corpus.
+# The features have the structure of mmdata's Datasets (dataset[modality][vid][sid] is a list of
+# (start_time, end_time, feature_vector) steps) with MOSI's feature sizes, sampling rates, number of
+# segments and words, and can be scaled to many times the size of MOSI. The features of a video
+# are generated when it is accessed, so even a large corpus does not have to fit in memory.
+#
+# Set MOSI_SYNTHETIC=<scale> (1 for the size of MOSI, 100 for 100 times) to use it instead of mmdata
+# everywhere, MOSI_SYNTHETIC_SEED changes the random data.
+
+import os
+import zlib
+from collections import OrderedDict
+import numpy as np
+
+# videos per split, segments and words per segment of CMU-MOSI
+MOSI_VIDEOS = (('train', 52), ('valid', 10), ('test', 31))
+SEGMENTS_PER_VIDEO = 23.6
+WORDS_PER_SEGMENT = 12.0
+WORD_DURATION = 0.32 # seconds
+# feature size and frame rate (None: one step per word)
+FEATURES = {'covarep': (74, 100.0), 'facet': (46, 30.0), 'embeddings': (300, None)}
+
+
+def synthetic_config():
+    """{'scale', 'seed'} of the synthetic data selected with MOSI_SYNTHETIC, None to use mmdata"""
+    if not os.environ.get('MOSI_SYNTHETIC'):
+        return None
+    return {'scale': float(os.environ['MOSI_SYNTHETIC']), 'seed': int(os.environ.get('MOSI_SYNTHETIC_SEED', 0))}
+
+
+def _rng(seed, *keys):
+    # a stable random stream per (seed, keys), independent of the order the videos are accessed in
+    return np.random.RandomState(zlib.crc32(('%d:' % seed + ':'.join(keys)).encode('utf-8')) & 0xffffffff)
+
+
+def _layout(scale, seed):
+    """Video IDs per split and, for every video, the (sid, start time, word count) of its segments"""
+    rng = _rng(seed, 'layout')
+    split_vids, videos = {}, OrderedDict()
+    for split, n_videos in MOSI_VIDEOS:
+        split_vids[split] = []
+        for _ in range(max(1, int(round(n_videos * scale)))):
+            vid = 'synth%06d' % len(videos)
+            split_vids[split].append(vid)
+            segments, start = [], 0.0
+            for i in range(1 + rng.poisson(SEGMENTS_PER_VIDEO - 1)):
+                n_words = 1 + rng.negative_binomial(3, 3.0 / (3.0 + WORDS_PER_SEGMENT - 1))
+                segments.append((str(i + 1), start, n_words))
+                start += n_words * WORD_DURATION + rng.uniform(0.2, 1.5)
+            videos[vid] = segments
+    return split_vids, videos
+
+
+def _word_times(seed, vid, segments):
+    """(starts, ends) of the words of every segment of a video"""
+    rng = _rng(seed, 'words', vid)
+    times = {}
+    for sid, start, n_words in segments:
+        durations = rng.gamma(4.0, WORD_DURATION / 4.0, n_words)
+        ends = start + np.cumsum(durations)
+        times[sid] = (ends - durations, ends)
+    return times
+
+
+class SyntheticVideos(object):
+    """{vid: {sid: [(start, end, vector), ...]}} of one modality, generated on access"""
+
+    def __init__(self, modality, videos, seed):
+        self.modality = modality
+        self.videos = videos
+        self.seed = seed
+        dim, rate = FEATURES[modality]
+        if rate is None:
+            # word embeddings are small and centered, about as GloVe vectors
+            self.mean, self.std = np.zeros(dim), np.full(dim, 0.4)
+        else:
+            # fixed per-dimension offsets and scales, so that the dimensions differ as in real features
+            rng = _rng(seed, 'scale', modality)
+            self.mean = rng.normal(0, 1, dim)
+            self.std = rng.lognormal(0, 1, dim)
+        # the last generated video, as the segments of a video are usually read one after another
+        self._last = (None, None)
+
+    def keys(self):
+        return list(self.videos.keys())
+
+    def __iter__(self):
+        return iter(self.videos)
+
+    def __len__(self):
+        return len(self.videos)
+
+    def __contains__(self, vid):
+        return vid in self.videos
+
+    def __getitem__(self, vid):
+        if self._last[0] == vid:
+            return self._last[1]
+        dim, rate = FEATURES[self.modality]
+        rng = _rng(self.seed, self.modality, vid)
+        video = OrderedDict()
+        for sid, (starts, ends) in sorted(_word_times(self.seed, vid, self.videos[vid]).items(), key=lambda item: int(item[0])):
+            if rate is None:
+                steps = zip(starts, ends)
+            else:
+                frames = np.arange(starts[0], ends[-1], 1.0 / rate)
+                steps = zip(frames, frames + 1.0 / rate)
+            steps = list(steps)
+            vectors = (self.mean + self.std * rng.standard_normal((len(steps), dim))).astype('float32')
+            video[sid] = [(float(start), float(end), vector) for (start, end), vector in zip(steps, vectors)]
+        self._last = (vid, video)
+        return video
+
+
+class SyntheticDataset(object):
+    """The parts of mmdata's Dataset the preprocessing uses: indexing, merge and word level alignment"""
+
+    def __init__(self, feature_dict=None):
+        self.feature_dict = dict(feature_dict or {})
+
+    def __getitem__(self, modality):
+        return self.feature_dict[modality]
+
+    def keys(self):
+        return list(self.feature_dict.keys())
+
+    @staticmethod
+    def merge(dataset1, dataset2):
+        return SyntheticDataset(dict(dataset1.feature_dict, **dataset2.feature_dict))
+
+    def align(self, anchor):
+        """Average the steps of every modality over the intervals of the anchor's steps, weighted by the overlap"""
+        aligned = dict((modality, OrderedDict()) for modality in self.feature_dict)
+        for vid in self[anchor].keys():
+            words = self[anchor][vid]
+            videos = dict((modality, self[modality][vid] if vid in self[modality] else {}) for modality in self.feature_dict)
+            for modality, video in videos.items():
+                aligned[modality][vid] = OrderedDict()
+                for sid, anchor_steps in words.items():
+                    steps = video.get(sid, [])
+                    if modality == anchor or not steps:
+                        aligned[modality][vid][sid] = list(anchor_steps) if modality == anchor else []
+                        continue
+                    times = np.array([(step[0], step[1]) for step in steps])
+                    vectors = np.array([step[2] for step in steps])
+                    segment = []
+                    for start, end, _ in anchor_steps:
+                        overlap = np.minimum(times[:, 1], end) - np.maximum(times[:, 0], start)
+                        weights = np.clip(overlap, 0, None)
+                        vector = weights.dot(vectors) / weights.sum() if weights.sum() > 0 else np.zeros(vectors.shape[1], vectors.dtype)
+                        segment.append((start, end, vector))
+                    aligned[modality][vid][sid] = segment
+        return SyntheticDataset(aligned)
+
+
+def synthetic_mosi(modalities, scale=1.0, seed=0):
+    """(features, sentiments, split video ids) shaped like MOSI's, as load_mosi_features returns them.
+
+    scale multiplies the number of videos of every split (1 is the size of MOSI). The scores are
+    means of 5 annotations in [-3, 3] as in MOSI.
+    """
+    split_vids, videos = _layout(scale, seed)
+    features = dict((modality, SyntheticDataset({modality: SyntheticVideos(modality, videos, seed)})) for modality in modalities)
+    rng = _rng(seed, 'sentiments')
+    sentiments = dict((vid, dict((sid, float(rng.randint(-3, 4, 5).mean())) for sid, _, _ in segments))
+                      for vid, segments in videos.items())
+    return features, sentiments, split_vids
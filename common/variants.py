@@ -0,0 +1,145 @@
+# Training of the head variants of a model (e.g. FL_uno, FL_pol, FL_int and FL_tri) in one run. The
+# variants are the submodels of one Keras model with shared inputs: each has its own trunk, output
+# heads and loss weights, and as the loss of the model is the sum of their losses, the gradients of
+# its weights are those of a variant alone. Every batch is read, padded and fed once for all of
+# them, and the evaluation and predictions are made in one pass as well.
+
+from __future__ import print_function
+from collections import OrderedDict
+from keras import backend as K
+from keras.callbacks import Callback, EarlyStopping
+from keras.layers import Activation, Input
+from keras.models import Model
+
+from common.configs import config_name, parse_name, targets_for, FUSION_MODELS
+from common.models import add_heads, build_trunk, optimizer, task_losses
+from common.profiling import phase
+from common.snapshots import BestWeights
+
+
+def output_name(name, head):
+    """Name of the output of a head (e.g. 'main_output') of a variant (e.g. 'FL_pol') in the model of all variants"""
+    return '%s_%s' % (name, head)
+
+
+class Variants(object):
+    """The compiled Keras model of the variants of a model type for a list of tasks.
+
+    .model is the model of all variants, .variants {name: model of the variant}, whose layers
+    have the names of the scripts, so that its weights can be saved and loaded as the scripts do.
+    """
+
+    def __init__(self, model_type, tasks, maxlen=15, variable_length=False, tfn_fusion='tensor', checkpoint=(),
+                 accumulation_steps=1):
+        self.variants = OrderedDict()
+        # the output names of every variant, their losses, loss weights and metrics
+        self.heads, losses, self.loss_weights, metrics = OrderedDict(), {}, {}, {}
+        with phase('model build'):
+            for task in tasks:
+                name = config_name(model_type, task)
+                inputs, hidden = build_trunk(model_type, maxlen, variable_length, tfn_fusion, checkpoint)
+                # only the fusion models regularize the valence regression output
+                self.variants[name] = add_heads(inputs, hidden, task, regularize_main=model_type in FUSION_MODELS, name=name)
+            first = list(self.variants.values())[0]
+            inputs = [Input(shape=K.int_shape(tensor)[1:], dtype='float32', name=input_name)
+                      for tensor, input_name in zip(first.inputs, first.input_names)]
+            outputs = []
+            for name, variant in self.variants.items():
+                task_loss, task_weights, task_metrics = task_losses(parse_name(name)[1])
+                variant_outputs = variant(inputs if len(inputs) > 1 else inputs[0])
+                self.heads[name] = []
+                for head, output in zip(variant.output_names, variant_outputs if isinstance(variant_outputs, list) else [variant_outputs]):
+                    output = Activation('linear', name=output_name(name, head))(output)
+                    outputs.append(output)
+                    self.heads[name].append(output_name(name, head))
+                    losses[output_name(name, head)] = task_loss[head]
+                    self.loss_weights[output_name(name, head)] = task_weights[head]
+                    metrics[output_name(name, head)] = task_metrics[head]
+            self.model = Model(inputs=inputs, outputs=outputs, name=config_name(model_type, '-'.join(tasks)))
+            # the number of metrics of every output, in the order evaluate() returns them
+            self.metric_counts = dict((output, len(metric) if isinstance(metric, list) else 1) for output, metric in metrics.items())
+            # the weight regularization of every variant is part of the loss its own model reports
+            self.regularization = dict((name, sum(variant.losses)) for name, variant in self.variants.items() if variant.losses)
+        with phase('compile'):
+            self.model.compile(optimizer=optimizer(accumulation_steps), loss=losses, loss_weights=self.loss_weights, metrics=metrics)
+
+    def targets(self, data, split):
+        """The targets of a split for the outputs of all variants"""
+        targets = {}
+        for name, heads in self.heads.items():
+            task_targets = targets_for(parse_name(name)[1], data, split)
+            if not isinstance(task_targets, dict):
+                task_targets = {'main_output': task_targets}
+            targets.update((output_name(name, head), value) for head, value in task_targets.items())
+        return targets
+
+    def losses(self, output_losses):
+        """{name: loss} of every variant, from the loss of every output ({output name: loss})"""
+        return dict((name, sum(self.loss_weights[output] * output_losses[output] for output in heads)
+                     + (K.eval(self.regularization[name]) if name in self.regularization else 0.0))
+                    for name, heads in self.heads.items())
+
+    def scores(self, scores):
+        """{name: scores} of every variant from the scores of evaluate(), as evaluate() of the variant alone returns them"""
+        outputs = self.model.output_names
+        output_losses = dict(zip(outputs, scores[1:1 + len(outputs)]))
+        metrics, start = {}, 1 + len(outputs)
+        for output in outputs:
+            metrics[output] = list(scores[start:start + self.metric_counts[output]])
+            start += self.metric_counts[output]
+        losses = self.losses(output_losses)
+        variant_scores = {}
+        for name, heads in self.heads.items():
+            # models with one output do not report its loss apart from the total
+            variant_scores[name] = ([losses[name]] + ([output_losses[output] for output in heads] if len(heads) > 1 else [])
+                                    + [value for output in heads for value in metrics[output]])
+        return variant_scores
+
+
+class VariantStopping(Callback):
+    """Early stopping and best weights of every variant of a Variants model.
+
+    The validation loss of every variant, as its own model would report it, is added to the logs
+    of an epoch as val_<name>_loss. Each variant stops as EarlyStopping would stop its own
+    training and is left with the weights of its best epoch before (see BestWeights); training
+    ends when all variants have stopped. The weights of a stopped variant are still updated until
+    then, which does not change its results. Pass early_stopping and best_weights to Snapshot.
+    """
+
+    def __init__(self, variants, patience):
+        super(VariantStopping, self).__init__()
+        self.variants = variants
+        self.early_stopping, self.best_weights = [], []
+        for variant in variants.variants.values():
+            early_stopping = EarlyStopping(monitor='val_%s_loss' % variant.name, patience=patience)
+            best_weights = BestWeights('val_%s_loss' % variant.name)
+            # they stop and keep the weights of their variant only
+            early_stopping.set_model(variant)
+            best_weights.set_model(variant)
+            self.early_stopping.append(early_stopping)
+            self.best_weights.append(best_weights)
+
+    def on_train_begin(self, logs=None):
+        for early_stopping in self.early_stopping:
+            early_stopping.on_train_begin(logs)
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs if logs is not None else {}
+        losses = self.variants.losses(dict((output, logs['val_%s_loss' % output]) for output in self.variants.model.output_names))
+        for name, early_stopping, best_weights in zip(self.variants.variants, self.early_stopping, self.best_weights):
+            logs['val_%s_loss' % name] = losses[name]
+            if early_stopping.stopped_epoch:
+                # the later epochs of a stopped variant do not count
+                continue
+            early_stopping.on_epoch_end(epoch, logs)
+            best_weights.on_epoch_end(epoch, logs)
+            if early_stopping.stopped_epoch:
+                print('%s stopped after epoch %d' % (name, epoch + 1))
+        if all(early_stopping.stopped_epoch for early_stopping in self.early_stopping):
+            self.model.stop_training = True
+
+    def on_train_end(self, logs=None):
+        for name, best_weights in zip(self.variants.variants, self.best_weights):
+            if best_weights.weights is not None:
+                print(name + ':', end=' ')
+            best_weights.on_train_end(logs)
@@ -0,0 +1,102 @@
+# Warm start of the fusion models: the vocal, visual and verbal branches of DL, HL and TFN have the
+# architecture of the trunks of the A, V and T unimodal models, so they can start from the weights
+# of trained unimodal models instead of a random initialization, and can be kept frozen for the
+# first epochs while the fusion layers adapt to them.
+
+from __future__ import print_function
+import os
+from keras import backend as K
+from keras.callbacks import Callback
+
+from common.configs import config_name, WARM_START_BRANCHES
+from common.models import add_heads, build_trunk
+
+HEADS = ('main_output', 'aux_output', 'aux_output_1', 'aux_output_2')
+
+
+def unimodal_weights_path(directory, modality, task):
+    """The saved weights of the unimodal model of a modality and task in directory, or in its sweep run directory"""
+    name = config_name(modality, task)
+    for path in (os.path.join(directory, 'weights_%s.h5' % name), os.path.join(directory, name, 'weights_%s.h5' % name)):
+        if os.path.exists(path):
+            return path
+    raise IOError('No weights of %s in %s, train it first (e.g. python run_experiments.py %s)' % (name, directory, name))
+
+
+def trunk_weights(modality, task, path, maxlen=15):
+    """[weights of every layer] of the trunk (all but the output heads) of a saved unimodal model, in order"""
+    inputs, hidden = build_trunk(modality, maxlen)
+    unimodal = add_heads(inputs, hidden, task)
+    unimodal.load_weights(path)
+    return [layer.get_weights() for layer in unimodal.layers if layer.weights and layer.name not in HEADS]
+
+
+def _transfer(layer, weights):
+    """Set the weights of a branch layer from the unimodal layer, returns the number of values copied.
+
+    A branch layer of HL also takes the output of the previous branch: its kernel has more input
+    rows than the unimodal one, the rows of the modality's own features come last and are copied,
+    the others keep their initialization.
+    """
+    targets = layer.get_weights()
+    if len(targets) != len(weights):
+        raise ValueError('%s has %d weights, the unimodal layer %d' % (layer.name, len(targets), len(weights)))
+    copied = 0
+    for target, source in zip(targets, weights):
+        if target.shape == source.shape:
+            target[...] = source
+        elif target.ndim == 2 and target.shape[1] == source.shape[1] and target.shape[0] > source.shape[0]:
+            target[-source.shape[0]:] = source
+        else:
+            raise ValueError('Can not initialize %s %s from unimodal weights %s' % (layer.name, target.shape, source.shape))
+        copied += source.size
+    layer.set_weights(targets)
+    return copied
+
+
+def warm_start(model, model_type, task, directory, maxlen=15):
+    """Initialize the branches of a fusion model from the unimodal models of the same task saved in directory.
+
+    Returns the layers that were initialized.
+    """
+    layers = []
+    for modality, names in sorted(WARM_START_BRANCHES[model_type].items()):
+        path = unimodal_weights_path(directory, modality, task)
+        weights = trunk_weights(modality, task, path, maxlen)
+        if len(weights) != len(names):
+            raise ValueError('%s has %d trunk layers, the %s branch of %s %d' % (path, len(weights), modality, model_type, len(names)))
+        for name, layer_weights in zip(names, weights):
+            layer = model.get_layer(name)
+            copied = _transfer(layer, layer_weights)
+            print('Initialized %s with %d values of %s' % (name, copied, os.path.basename(path)))
+            layers.append(layer)
+    return layers
+
+
+class FreezeLayers(Callback):
+    """Keeps the weights of the given layers fixed for the first epochs of training.
+
+    The gradients of their weights are multiplied by a flag that is 0 during the first epochs and 1
+    afterwards, so that the model is compiled once. With Adamax the moments of the frozen weights
+    stay 0, so they do not change at all. Create it after compiling and before fit, which makes
+    the training function with the masked gradients.
+    """
+
+    def __init__(self, model, layers, epochs):
+        super(FreezeLayers, self).__init__()
+        self.epochs = epochs
+        self.trainable = K.variable(1.0, name='unfrozen')
+        frozen = [weight for layer in layers for weight in layer.trainable_weights]
+        get_gradients = model.optimizer.get_gradients
+
+        def masked_gradients(loss, params):
+            grads = get_gradients(loss, params)
+            return [g * self.trainable if any(p is weight for weight in frozen) else g for p, g in zip(params, grads)]
+
+        model.optimizer.get_gradients = masked_gradients
+
+    def on_epoch_begin(self, epoch, logs=None):
+        trainable = float(epoch >= self.epochs)
+        if trainable != K.get_value(self.trainable):
+            K.set_value(self.trainable, trainable)
+            print('%s the warm-started layers from epoch %d' % ('Training' if trainable else 'Freezing', epoch + 1))
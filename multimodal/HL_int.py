@@ -11,7 +11,14 @@ from keras.optimizers import RMSprop,Adamax
 from keras.callbacks import EarlyStopping
 from keras.regularizers import l1, l2
 from keras import backend as K
-from mmdata import MOSI, Dataset
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make the shared helpers in common/ importable
+from common.cache import load_mosi
+from common.instrumentation import instrument
+from common.normalization import normalizers_path, save_normalizers
+from common.profiling import profiler
+from common.snapshots import BestWeights, Snapshot
 
 # turn off the warnings, be careful when use this
 import warnings
@@ -32,20 +39,6 @@ def pearson_cc(y_true, y_pred):
 
     return K.sum(K.mean(fsp*fst,axis=0)/(devP*devT))
 
-def pad(data, max_len):
-    """A funtion for padding/truncating sequence data to a given lenght"""
-    # recall that data at each time step is a tuple (start_time, end_time, feature_vector), we only take the vector
-    data = np.array([feature[2] for feature in data])
-    n_rows = data.shape[0]
-    dim = data.shape[1]
-    if max_len >= n_rows:
-        diff = max_len - n_rows
-        padding = np.zeros((diff, dim))
-        padded = np.concatenate((padding, data))
-        return padded
-    else:
-        return data[-max_len:]
-
 # meta parameters
 maxlen = 15 # Each utterance will be truncated/padded to 15 words
 batch_size = 128
@@ -62,124 +55,23 @@ loss_func_aux = 'categorical_crossentropy' # loss function
 metr_aux = 'accuracy' # evaluation metric
 weight_aux = 0.5 # weight for multitask learning
 
-mosi = MOSI()
-covarep = mosi.covarep() # features
-facet = mosi.facet() # features
-embeddings = mosi.embeddings() # features
-sentiments = mosi.sentiments() # Valence labels
-train_ids = mosi.train()
-valid_ids = mosi.valid()
-test_ids = mosi.test()
-
-# Merge different features and do word level feature alignment (align according to timestamps of embeddings)
-bimodal = Dataset.merge(embeddings, facet)
-trimodal = Dataset.merge(bimodal, covarep)
-dataset = trimodal.align('embeddings')
-
-# Some data preprocessing
-print("Preparing train and test data...")
-# sort through all the video ID, segment ID pairs
-train_set_ids = []
-for vid in train_ids:
-    for sid in dataset['embeddings'][vid].keys():
-        if dataset['embeddings'][vid][sid] and dataset['facet'][vid][sid] and dataset['covarep'][vid][sid]:
-            train_set_ids.append((vid, sid))
-
-valid_set_ids = []
-for vid in valid_ids:
-    for sid in dataset['embeddings'][vid].keys():
-        if dataset['embeddings'][vid][sid] and dataset['facet'][vid][sid] and dataset['covarep'][vid][sid]:
-            valid_set_ids.append((vid, sid))
-
-test_set_ids = []
-for vid in test_ids:
-    for sid in dataset['embeddings'][vid].keys():
-        if dataset['embeddings'][vid][sid] and dataset['facet'][vid][sid] and dataset['covarep'][vid][sid]:
-           test_set_ids.append((vid, sid))
-
-# partition the training, valid and test set. all sequences will be padded/truncated to 15 steps
-# data will have shape (dataset_size, max_len, feature_dim)
-max_len = 15
-
-x_A_train = np.stack([pad(dataset['covarep'][vid][sid], max_len) for (vid, sid) in train_set_ids if dataset['covarep'][vid][sid]], axis=0)
-x_A_valid = np.stack([pad(dataset['covarep'][vid][sid], max_len) for (vid, sid) in valid_set_ids if dataset['covarep'][vid][sid]], axis=0)
-x_A_test = np.stack([pad(dataset['covarep'][vid][sid], max_len) for (vid, sid) in test_set_ids if dataset['covarep'][vid][sid]], axis=0)
-
-x_V_train = np.stack([pad(dataset['facet'][vid][sid], max_len) for (vid, sid) in train_set_ids], axis=0)
-x_V_valid = np.stack([pad(dataset['facet'][vid][sid], max_len) for (vid, sid) in valid_set_ids], axis=0)
-x_V_test = np.stack([pad(dataset['facet'][vid][sid], max_len) for (vid, sid) in test_set_ids], axis=0)
-
-x_T_train = np.stack([pad(dataset['embeddings'][vid][sid], max_len) for (vid, sid) in train_set_ids], axis=0)
-x_T_valid = np.stack([pad(dataset['embeddings'][vid][sid], max_len) for (vid, sid) in valid_set_ids], axis=0)
-x_T_test = np.stack([pad(dataset['embeddings'][vid][sid], max_len) for (vid, sid) in test_set_ids], axis=0)
+# wall time, CPU time and peak RSS of every phase of the run, written to profile_*.jsonl at the end
+profiler.switch('load data')
+# Load the features aligned according to timestamps of embeddings, padded/truncated to maxlen steps
+# and normalized, data will have shape (dataset_size, maxlen, feature_dim). Cached after the first run
+data = load_mosi(['embeddings', 'facet', 'covarep'], anchor='embeddings', max_len=maxlen)
+x_A_train, x_A_valid, x_A_test = data['x_A_train'], data['x_A_valid'], data['x_A_test']
+x_V_train, x_V_valid, x_V_test = data['x_V_train'], data['x_V_valid'], data['x_V_test']
+x_T_train, x_T_valid, x_T_test = data['x_T_train'], data['x_T_valid'], data['x_T_test']
 
 # sentiment scores
-y_train = np.array([sentiments[vid][sid] for (vid, sid) in train_set_ids])
-y_valid = np.array([sentiments[vid][sid] for (vid, sid) in valid_set_ids])
-y_test = np.array([sentiments[vid][sid] for (vid, sid) in test_set_ids])
+y_train, y_valid, y_test = data['y_train'], data['y_valid'], data['y_test']
 
 # intensity classes
-z_train = []
-for (vid, sid) in train_set_ids:
-    if abs(sentiments[vid][sid]) >= 2.5:
-        Intensity_label = [0,0,0,1] # strong
-    elif abs(sentiments[vid][sid]) >= 1.5:
-        Intensity_label = [0,0,1,0] # medium
-    elif abs(sentiments[vid][sid]) >= 0.5:
-        Intensity_label = [0,1,0,0] # weak
-    else:
-        Intensity_label = [1,0,0,0] # neutral
-    z_train.append(Intensity_label)
-
-z_valid = []
-for (vid, sid) in valid_set_ids:
-    if abs(sentiments[vid][sid]) >= 2.5:
-        Intensity_label = [0,0,0,1] # strong
-    elif abs(sentiments[vid][sid]) >= 1.5:
-        Intensity_label = [0,0,1,0] # medium
-    elif abs(sentiments[vid][sid]) >= 0.5:
-        Intensity_label = [0,1,0,0] # weak
-    else:
-        Intensity_label = [1,0,0,0] # neutral
-    z_valid.append(Intensity_label)
-
-z_test = []
-for (vid, sid) in test_set_ids:
-    if abs(sentiments[vid][sid]) >= 2.5:
-        Intensity_label = [0,0,0,1] # strong
-    elif abs(sentiments[vid][sid]) >= 1.5:
-        Intensity_label = [0,0,1,0] # medium
-    elif abs(sentiments[vid][sid]) >= 0.5:
-        Intensity_label = [0,1,0,0] # weak
-    else:
-        Intensity_label = [1,0,0,0] # neutral
-    z_test.append(Intensity_label)
-
-z_train = np.asarray(z_train)
-z_valid = np.asarray(z_valid)
-z_test = np.asarray(z_test)
-
-# normalize covarep and facet features, remove possible NaN values
-visual_max = np.max(np.max(np.abs(x_V_train), axis=0), axis=0)
-visual_max[visual_max==0] = 1 # if the maximum is 0 we don't normalize this dimension
-x_V_train = x_V_train / visual_max
-x_V_valid = x_V_valid / visual_max
-x_V_test = x_V_test / visual_max
-
-x_V_train[x_V_train != x_V_train] = 0
-x_V_valid[x_V_valid != x_V_valid] = 0
-x_V_test[x_V_test != x_V_test] = 0
-
-audio_max = np.max(np.max(np.abs(x_A_train), axis=0), axis=0)
-x_A_train = x_A_train / audio_max
-x_A_valid = x_A_valid / audio_max
-x_A_test = x_A_test / audio_max
-
-x_A_train[x_A_train != x_A_train] = 0
-x_A_valid[x_A_valid != x_A_valid] = 0
-x_A_test[x_A_test != x_A_test] = 0
+z_train, z_valid, z_test = data['z2_train'], data['z2_valid'], data['z2_test']
 
 print("Data preprocessing finished! Begin compiling and training model.")
+profiler.switch('model build')
 
 # Building model
 # Modality fusion - HL
@@ -217,6 +109,7 @@ main_output = Dense(1, activation='tanh', W_regularizer=l2(0.01), name='main_out
 auxiliary_output = Dense(4, activation='softmax', name='aux_output')(HL_layer_5) # Intensity classification
 HL_model = Model(inputs=[covarep_layer_0, facet_layer_0, text_layer_0], outputs=[main_output, auxiliary_output])
 
+profiler.switch('compile')
 # try using different optimizers and different optimizer configs
 HL_model.compile(optimizer=opt_func,
               loss={'main_output': loss_func, 'aux_output': loss_func_aux},
@@ -224,22 +117,33 @@ HL_model.compile(optimizer=opt_func,
               metrics={'main_output': [pearson_cc,metr], 'aux_output': metr_aux})	
 
 print('Training...')
+# record step times, throughput and epoch durations of fit/evaluate/predict
+instrument(HL_model, "prediction/timing_HL_int.jsonl")
+# keep the weights of the best validation loss, the model is left with them when training stops
+best_weights = BestWeights()
+# save the training state every epoch, a rerun of an interrupted training continues from there
+snapshot = Snapshot("prediction/snapshot_HL_int.npz", early_stopping, best_weights)
+profiler.switch('fit')
 HL_model.fit([x_A_train, x_V_train, x_T_train],
           {'main_output': y_train, 'aux_output': z_train},
           batch_size=batch_size,
           epochs=nb_epoch,
           validation_data=[[x_A_valid, x_V_valid, x_T_valid], {'main_output': y_valid, 'aux_output': z_valid}],
-          callbacks=[early_stopping])
+          initial_epoch=snapshot.resume(HL_model),
+          callbacks=[early_stopping, best_weights, snapshot])
 
 # Evaluation
+profiler.switch('evaluate train')
 print('\n\n\n\nEvaluating on train set...')
 trn_score, trn_score_emo, trn_score_v, trn_cc_emo, trn_mae_emo, trn_mae_v = HL_model.evaluate([x_A_train, x_V_train, x_T_train], {'main_output': y_train, 'aux_output': z_train}, batch_size=batch_size)
 print('Valence Train cc:', trn_cc_emo)
 print('Valence Train mae:', trn_mae_emo)
+profiler.switch('evaluate valid')
 print('\nEvaluating on valisation set...')
 val_score, val_score_emo, val_score_v, val_cc_emo, val_mae_emo, val_mae_v = HL_model.evaluate([x_A_valid, x_V_valid, x_T_valid], {'main_output': y_valid, 'aux_output': z_valid}, batch_size=batch_size)
 print('Valence Validation cc:', val_cc_emo)
 print('Valence Validation mae:', val_mae_emo)
+profiler.switch('evaluate test')
 print('\nEvaluating on test set...')
 tst_score, tst_score_emo, tst_score_v, tst_cc_emo, tst_mae_emo, tst_mae_v = HL_model.evaluate([x_A_test, x_V_test, x_T_test], {'main_output': y_test, 'aux_output': z_test}, batch_size=batch_size)
 print('Valence Test cc:', tst_cc_emo)
@@ -249,10 +153,22 @@ print('Valence Test mae:', tst_mae_emo)
 np.set_printoptions(threshold=np.nan)
 tst_pred_file = "prediction/pred_HL_int.txt"
 print('Printing predictions...')
+profiler.switch('predict')
 tst_pred = HL_model.predict([x_A_test, x_V_test, x_T_test])
+profiler.switch('csv')
 tst_df = pd.DataFrame(tst_pred[0])
 tst_df.to_csv(tst_pred_file, index=False, header=False)
 
+profiler.switch('save weights')
+# save the weights with the feature normalizers fitted on the training set, so that the
+# model can be applied to new data without preprocessing the training data again
+weights_file = "prediction/weights_HL_int.h5"
+HL_model.save_weights(weights_file)
+save_normalizers(normalizers_path(weights_file), data['normalizers'])
+
+profiler.stop()
+profiler.write("prediction/profile_HL_int.jsonl")
+print('\n' + profiler.summary())
 print('\nDone!')
 
 # Flush outputs to log file
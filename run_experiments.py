@@ -0,0 +1,116 @@
+# Run any list of the unimodal and multimodal configurations in one process, loading the data once
+# usage: python run_experiments.py [--output-dir prediction] [--bucketing] [--tfn-fusion lowrank] [--checkpoint TFN[:fusion]]
+#                                  [--streaming] [--micro-batch-size 128] [--accumulation-steps 1] [--snapshot-period 1]
+#                                  [--warm-start DIR [--freeze-epochs N | --cache-encodings]] [--variants]
+#                                  [--jobs N [--threads-per-job T]] [config ...]
+# configs are names as in the scripts (DL_tri, A_unimodal_pol) or patterns (DL_*, *_tri), all by default.
+# With --jobs the configurations run in parallel as a resumable sweep, see common/scheduler.py
+
+from __future__ import print_function
+import argparse
+import fnmatch
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__))) # make the shared helpers in common/ importable
+
+# turn off the warnings, be careful when use this
+import warnings
+warnings.filterwarnings("ignore")
+
+
+def select(patterns, names):
+    """The configuration names matching any of the patterns, in the order of names"""
+    selected = [name for name in names if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)]
+    unmatched = [pattern for pattern in patterns if not fnmatch.filter(names, pattern)]
+    if unmatched:
+        raise SystemExit('Unknown configurations: %s\nAvailable: %s' % (', '.join(unmatched), ', '.join(names)))
+    return selected
+
+
+def parse_checkpoint(values, segments):
+    """{model: segments} of --checkpoint MODEL[:SEGMENT,...] options, all segments of the model if none are given"""
+    checkpoint = {}
+    for value in values:
+        model, _, names = value.partition(':')
+        if model not in segments:
+            raise SystemExit('No segments to checkpoint in %s, only in %s' % (model, ', '.join(sorted(segments))))
+        names = tuple(names.split(',')) if names else segments[model]
+        unknown = [name for name in names if name not in segments[model]]
+        if unknown:
+            raise SystemExit('Unknown segments of %s: %s\nAvailable: %s' % (model, ', '.join(unknown), ', '.join(segments[model])))
+        checkpoint[model] = tuple(sorted(set(checkpoint.get(model, ()) + names)))
+    return checkpoint
+
+
+def main():
+    from common.configs import all_names, CHECKPOINT_SEGMENTS, TFN_FUSIONS
+    parser = argparse.ArgumentParser(description='Train and evaluate MOSI configurations in one process')
+    parser.add_argument('configs', nargs='*', default=['*'], help='configuration names or patterns, e.g. DL_tri TFN_* *_unimodal_uno')
+    parser.add_argument('--output-dir', default='prediction', help='directory for the logs, predictions and weights')
+    parser.add_argument('--maxlen', type=int, default=15, help='number of words every utterance is padded/truncated to')
+    parser.add_argument('--bucketing', action='store_true', help='length-bucketed batches for the T, FL, DL and HL models')
+    parser.add_argument('--streaming', action='store_true',
+                        help='read the batches of the models without bucketing lazily from the memory-mapped data through a '
+                             'prefetch queue, concatenating the FL inputs per batch')
+    parser.add_argument('--tfn-fusion', choices=TFN_FUSIONS, default='tensor',
+                        help='fusion of the TFN models: the outer product, its low-rank approximation or the outer product in chunks')
+    parser.add_argument('--checkpoint', action='append', default=[], metavar='MODEL[:SEGMENT,...]',
+                        help='recompute the activations of these segments of a model in the backward pass to save memory, '
+                             'e.g. TFN or HL:fusion (segments: branches, fusion; all by default), repeatable')
+    parser.add_argument('--micro-batch-size', type=int, default=128,
+                        help='samples per forward and backward pass, the batch size of training and evaluation')
+    parser.add_argument('--accumulation-steps', type=int, default=1,
+                        help='update the weights once every this many micro-batches with their mean gradient, '
+                             'for an effective batch size of micro-batch-size * accumulation-steps; '
+                             'an epoch whose batches are not a multiple of it is validated and early-stopped on the weights '
+                             'of its last update, and the gradients of its last micro-batches count toward the first update '
+                             'of the next epoch')
+    parser.add_argument('--snapshot-period', type=int, default=1,
+                        help='save the training state every this many epochs (0: never), '
+                             'an interrupted run continues from its last snapshot when it is run again')
+    parser.add_argument('--warm-start', default=None, metavar='DIR',
+                        help='initialize the branches of the DL, HL and TFN models from the A, V and T unimodal models '
+                             'of the same task saved in DIR by an earlier run or sweep')
+    parser.add_argument('--freeze-epochs', type=int, default=0,
+                        help='keep the warm-started branches fixed for this many epochs')
+    parser.add_argument('--cache-encodings', action='store_true',
+                        help='keep the warm-started branches fixed, compute their outputs once into the cache '
+                             'and train only the fusion layers and output heads on them')
+    parser.add_argument('--variants', action='store_true',
+                        help='train the configurations of the same model for different tasks in one run on shared batches, '
+                             'each with its own weights and results')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='run the configurations on this many processes, each in output-dir/<config>/; '
+                             'rerunning the same command resumes an interrupted sweep')
+    parser.add_argument('--threads-per-job', type=int, default=None, help='threads of every job, by default the cores divided by the jobs')
+    args = parser.parse_args()
+    names = select(args.configs, all_names())
+    checkpoint = parse_checkpoint(args.checkpoint, CHECKPOINT_SEGMENTS)
+    if args.micro_batch_size < 1 or args.accumulation_steps < 1:
+        raise SystemExit('The micro-batch size and the accumulation steps must be at least 1')
+    training = {'batch_size': args.micro_batch_size, 'accumulation_steps': args.accumulation_steps,
+                'snapshot_period': args.snapshot_period, 'warm_start': args.warm_start, 'freeze_epochs': args.freeze_epochs,
+                'cache_encodings': args.cache_encodings, 'streaming': args.streaming}
+    if (args.freeze_epochs or args.cache_encodings) and not args.warm_start:
+        raise SystemExit('--freeze-epochs and --cache-encodings need --warm-start')
+    if args.freeze_epochs and args.cache_encodings:
+        raise SystemExit('--cache-encodings keeps the branches fixed for the whole training, without --freeze-epochs')
+    if args.variants and (args.jobs or args.cache_encodings):
+        raise SystemExit('--variants trains in one process, without --jobs or --cache-encodings')
+
+    if args.jobs:
+        # the workers import Keras themselves, with their thread limits
+        from common.scheduler import run_sweep
+        state = run_sweep(names, args.output_dir, args.jobs, args.threads_per_job, args.maxlen, args.bucketing, tfn_fusion=args.tfn_fusion,
+                          checkpoint=checkpoint, **training)
+        failed = [name for name in names if state[name]['status'] == 'failed']
+        if failed:
+            raise SystemExit('Failed runs (see %s): %s' % (os.path.join(args.output_dir, 'sweep.json'), ', '.join(failed)))
+    else:
+        from common.experiments import run_experiments
+        run_experiments(names, args.output_dir, args.maxlen, args.bucketing, tfn_fusion=args.tfn_fusion, checkpoint=checkpoint,
+                        variants=args.variants, **training)
+
+
+if __name__ == '__main__':
+    main()
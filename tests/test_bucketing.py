@@ -0,0 +1,93 @@
+# Tests of the length-bucketed batching in common/bucketing.py: every sample is in exactly one batch
+# per epoch, and a batch only loses padding
+# usage: python -m pytest tests/test_bucketing.py
+
+import numpy as np
+
+from common.bucketing import BucketStream, bucket_batches, padded_steps, predict_buckets, sequence_lengths
+from common.preprocessing import pad_sequences
+
+MAX_LEN = 15
+
+
+def padded_split(lengths, dim=3, padding='pre', seed=0):
+    """(N, MAX_LEN, dim) features of utterances with the given word counts, without zero steps"""
+    rng = np.random.RandomState(seed)
+    sequences = [rng.uniform(0.5, 1.5, (length, dim)).astype('float32') for length in lengths]
+    return pad_sequences(sequences, MAX_LEN, padding=padding, truncating=padding, dim=dim)
+
+
+def assert_partition(batches, n_samples):
+    """Every sample index in exactly one batch"""
+    index = np.concatenate(batches)
+    assert len(index) == n_samples
+    assert np.array_equal(np.sort(index), np.arange(n_samples))
+
+
+def test_bucket_batches_cover_every_sample_once():
+    rng = np.random.RandomState(0)
+    lengths = rng.randint(1, MAX_LEN + 1, 1000)
+    for batch_size in (1, 7, 128, 1000, 2000):
+        batches = bucket_batches(lengths, batch_size)
+        assert_partition(batches, len(lengths))
+        assert all(len(index) == batch_size for index in batches[:-1])
+        # without shuffle the batches are in order of length
+        assert np.array_equal(lengths[np.concatenate(batches)], np.sort(lengths))
+        for epoch in range(3):
+            shuffled = bucket_batches(lengths, batch_size, shuffle=True, rng=rng)
+            assert_partition(shuffled, len(lengths))
+            # a batch still holds a run of the sorted lengths
+            assert sorted(np.sort(lengths[index]).tolist() for index in shuffled) == \
+                sorted(np.sort(lengths[index]).tolist() for index in batches)
+
+
+def test_bucket_stream_covers_every_sample_once():
+    rng = np.random.RandomState(1)
+    lengths = rng.randint(1, MAX_LEN + 1, 300)
+    x = padded_split(lengths)
+    # the sample index as target, to find every sample in the batches
+    y = np.arange(len(lengths))
+    stream = BucketStream(x, y, batch_size=32, shuffle=True, seed=0)
+    batches = list(stream.batches(epochs=2))
+    assert len(batches) == 2 * len(stream)
+    for epoch in range(2):
+        assert_partition([targets for _, targets in batches[epoch * len(stream):(epoch + 1) * len(stream)]], len(lengths))
+
+
+def test_bucket_stream_cuts_only_padding():
+    rng = np.random.RandomState(2)
+    lengths = rng.randint(1, MAX_LEN + 1, 200)
+    for padding in ('pre', 'post'):
+        x_A, x_T = padded_split(lengths, 3, padding, seed=3), padded_split(lengths, 4, padding, seed=4)
+        assert np.array_equal(sequence_lengths([x_A, x_T], padding), lengths)
+        stream = BucketStream([x_A, x_T], np.arange(len(lengths)), batch_size=16, padding=padding)
+        for (batch_A, batch_T), index in stream.batches(epochs=1):
+            width = batch_A.shape[1]
+            assert width == np.max(lengths[index]) and batch_T.shape[1] == width
+            # the steps that are cut are all zero, the rest is as in the padded split
+            kept = slice(MAX_LEN - width, None) if padding == 'pre' else slice(0, width)
+            assert np.array_equal(batch_A, x_A[index][:, kept])
+            assert np.array_equal(batch_T, x_T[index][:, kept])
+            assert not np.delete(x_A[index], np.arange(MAX_LEN)[kept], axis=1).any()
+        bucketed, fixed = stream.saved_steps()
+        assert bucketed == padded_steps(lengths, stream.epoch_batches()) and fixed == len(lengths) * MAX_LEN
+
+
+def test_sequence_lengths_keep_one_step():
+    x = padded_split([3, 1, MAX_LEN])
+    x[1] = 0 # a sample without features
+    assert sequence_lengths(x).tolist() == [3, 1, MAX_LEN]
+
+
+class SumModel(object):
+    """predict_generator() of a model that outputs the sum of the features of every sample"""
+
+    def predict_generator(self, batches, steps):
+        return np.concatenate([np.sum(next(batches), axis=(1, 2)) for _ in range(steps)])
+
+
+def test_predict_buckets_keeps_the_order():
+    lengths = np.random.RandomState(5).randint(1, MAX_LEN + 1, 100)
+    x = padded_split(lengths)
+    pred = predict_buckets(SumModel(), x, batch_size=8)
+    assert np.allclose(pred, np.sum(x, axis=(1, 2)))
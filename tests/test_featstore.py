@@ -0,0 +1,90 @@
+# Tests of the columnar feature store in common/featstore.py: what is written and appended reads back unchanged
+# usage: python -m pytest tests/test_featstore.py
+
+import os
+import numpy as np
+
+from common.featstore import FeatureStore, append_features, open_features, write_features
+
+DIM = 5
+
+
+def segment(rng, length, start=0.0):
+    """A segment of (start_time, end_time, feature_vector) tuples as mmdata returns them"""
+    return [(start + i * 0.5, start + (i + 1) * 0.5, rng.randn(DIM)) for i in range(length)]
+
+
+def features(rng, lengths):
+    """features[vid][sid] for {(vid, sid): length}"""
+    data = {}
+    for (vid, sid), length in sorted(lengths.items()):
+        data.setdefault(vid, {})[sid] = segment(rng, length)
+    return data
+
+
+def assert_segment(store, vid, sid, expected):
+    assert store.length(vid, sid) == len(expected)
+    values = store[vid][sid]
+    assert values.shape == (len(expected), DIM) and values.dtype == np.float32
+    assert np.array_equal(values, np.array([step[2] for step in expected], dtype='float32').reshape(-1, DIM))
+    assert np.array_equal(store.intervals(vid, sid), np.array([step[:2] for step in expected]).reshape(-1, 2))
+
+
+def test_round_trip_after_append(tmpdir):
+    rng = np.random.RandomState(0)
+    path = str(tmpdir.join('covarep'))
+    first = features(rng, {('v1', 's1'): 3, ('v1', 's2'): 0, ('v2', 's1'): 7})
+    ids = [('v1', 's1'), ('v1', 's2'), ('v2', 's1')]
+    store = FeatureStore.write(path, first, ids)
+    for vid, sid in ids:
+        assert_segment(store, vid, sid, first[vid][sid])
+
+    # replaces a segment of the first part and adds a segment to an old and to a new video
+    second = features(rng, {('v2', 's1'): 4, ('v2', 's2'): 2, ('v3', 's1'): 1})
+    store.append(second, [('v2', 's1'), ('v2', 's2'), ('v3', 's1')])
+    assert store.part_names() == ['part-00000', 'part-00001']
+    expected = {('v1', 's1'): first['v1']['s1'], ('v1', 's2'): first['v1']['s2'],
+                ('v2', 's1'): second['v2']['s1'], ('v2', 's2'): second['v2']['s2'], ('v3', 's1'): second['v3']['s1']}
+    # the store that appended and a store opened afterwards read the same
+    for reader in (store, FeatureStore(path)):
+        assert reader.ids() == [('v1', 's1'), ('v1', 's2'), ('v2', 's1'), ('v2', 's2'), ('v3', 's1')]
+        assert sorted(reader.keys()) == ['v1', 'v2', 'v3'] and 'v3' in reader and 'v4' not in reader
+        assert sorted(reader['v2'].keys()) == ['s1', 's2']
+        assert reader.dim == DIM
+        for (vid, sid), segment_steps in expected.items():
+            assert_segment(reader, vid, sid, segment_steps)
+
+
+def test_values_are_read_only_memory_maps(tmpdir):
+    rng = np.random.RandomState(1)
+    path = str(tmpdir.join('facet'))
+    FeatureStore.write(path, features(rng, {('v1', 's1'): 2}), [('v1', 's1')])
+    values = FeatureStore(path)['v1']['s1']
+    assert isinstance(values, np.memmap)
+    assert not values.flags.writeable
+
+
+def test_interrupted_part_is_rewritten(tmpdir):
+    rng = np.random.RandomState(2)
+    path = str(tmpdir.join('embeddings'))
+    store = FeatureStore.write(path, features(rng, {('v1', 's1'): 2}), [('v1', 's1')])
+    # a part left over by an append that did not get to update parts.json
+    os.makedirs(os.path.join(path, 'part-00001'))
+    with open(os.path.join(path, 'part-00001', 'values.npy'), 'w') as f:
+        f.write('partial')
+    new = features(rng, {('v1', 's1'): 3})
+    store.append(new, [('v1', 's1')])
+    assert_segment(FeatureStore(path), 'v1', 's1', new['v1']['s1'])
+
+
+def test_dataset_helpers(tmpdir):
+    rng = np.random.RandomState(3)
+    dataset = {'covarep': features(rng, {('v1', 's1'): 2, ('v2', 's1'): 3}),
+               'facet': features(rng, {('v1', 's1'): 4, ('v2', 's1'): 1})}
+    path = str(tmpdir)
+    write_features(path, dataset, ['covarep', 'facet'], [('v1', 's1')])
+    append_features(path, dataset, ['covarep', 'facet'], [('v2', 's1')])
+    stores = open_features(path, ['covarep', 'facet'])
+    for modality in ('covarep', 'facet'):
+        for vid in ('v1', 'v2'):
+            assert_segment(stores[modality], vid, 's1', dataset[modality][vid]['s1'])
@@ -0,0 +1,69 @@
+# Tests of the label derivation in common/labels.py against the if/elif loop of the scripts
+# usage: python -m pytest tests/test_labels.py
+
+import numpy as np
+
+from common.labels import encode_labels, intensity_classes, one_hot, polarity_classes
+
+
+def script_labels(scores):
+    """The polarity and one-hot intensity labels as the scripts derived them, one score at a time"""
+    z1, z2 = [], []
+    for score in scores:
+        Polarity_label = 1 if score >= 0 else 0 # binarize the Valence labels for polarity
+        if abs(score) >= 2.5:
+            Intensity_label = [0,0,0,1] # strong
+        elif abs(score) >= 1.5:
+            Intensity_label = [0,0,1,0] # medium
+        elif abs(score) >= 0.5:
+            Intensity_label = [0,1,0,0] # weak
+        else:
+            Intensity_label = [1,0,0,0] # neutral
+        z1.append(Polarity_label)
+        z2.append(Intensity_label)
+    return np.asarray(z1), np.asarray(z2)
+
+
+def edge_scores():
+    """Scores at, just below and just above 0 and every intensity threshold, of both signs"""
+    scores = [0.0, -0.0, 3.0, -3.0]
+    for edge in (0.5, 1.5, 2.5):
+        scores.extend([edge, np.nextafter(edge, 0), np.nextafter(edge, 3)])
+    scores.extend([np.nextafter(0, 1), np.nextafter(0, -1)])
+    return np.array(scores + [-score for score in scores])
+
+
+def test_encode_labels_matches_scripts_at_edges():
+    scores = edge_scores()
+    z1, z2 = encode_labels(scores)
+    expected_z1, expected_z2 = script_labels(scores)
+    assert np.array_equal(z1, expected_z1)
+    assert np.array_equal(z2, expected_z2)
+
+
+def test_encode_labels_matches_scripts_on_random_scores():
+    # MOSI scores are averages of the annotators' ratings in [-3, 3]
+    scores = np.random.RandomState(0).uniform(-3, 3, 1000)
+    for actual, expected in zip(encode_labels(scores), script_labels(scores)):
+        assert np.array_equal(actual, expected)
+
+
+def test_classes_at_thresholds():
+    assert polarity_classes([-0.5, -0.0, 0.0, 0.5]).tolist() == [0, 1, 1, 1]
+    assert intensity_classes([0.49, 0.5, -1.5, 2.49, -2.5, 3.0]).tolist() == [0, 1, 2, 2, 3, 3]
+    assert polarity_classes([0.0]).dtype == np.int8
+    assert intensity_classes([0.0]).dtype == np.int8
+
+
+def test_nan_is_negative_and_neutral():
+    # the comparisons of the scripts are False for a missing score
+    z1, z2 = encode_labels([np.nan])
+    expected_z1, expected_z2 = script_labels([np.nan])
+    assert np.array_equal(z1, expected_z1) and z1.tolist() == [0]
+    assert np.array_equal(z2, expected_z2) and z2.tolist() == [[1, 0, 0, 0]]
+
+
+def test_intensity_classes_without_one_hot():
+    scores = edge_scores()
+    _, classes = encode_labels(scores, one_hot_intensity=False)
+    assert np.array_equal(one_hot(classes, 4), encode_labels(scores)[1])
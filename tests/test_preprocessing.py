@@ -0,0 +1,71 @@
+# Tests of the bulk padding in common/preprocessing.py against the per-utterance padding of the scripts
+# usage: python -m pytest tests/test_preprocessing.py
+
+import numpy as np
+import pytest
+
+from common.preprocessing import pad, pad_sequences
+
+MAX_LEN = 15
+
+
+def utterances(lengths, dim, seed=0):
+    """Ragged utterances of (start_time, end_time, feature_vector) tuples"""
+    rng = np.random.RandomState(seed)
+    return [[(i * 0.3, (i + 1) * 0.3, rng.randn(dim).astype('float32')) for i in range(length)] for length in lengths]
+
+
+def text_script_pad(sdata, maxlen):
+    """The padding loop of the text-only scripts: first maxlen words, zeros at the end"""
+    example = []
+    for i, time_step in enumerate(sdata):
+        if i == maxlen:
+            break
+        example.append(time_step[2])
+    for i in range(maxlen - len(sdata)):
+        example.append(np.zeros(sdata[0][2].shape))
+    return np.asarray(example)
+
+
+# shorter than, as long as and longer than MAX_LEN
+LENGTHS = [1, 3, MAX_LEN - 1, MAX_LEN, MAX_LEN + 1, 40]
+
+
+def test_pad_sequences_matches_pad():
+    sequences = utterances(LENGTHS, 74)
+    expected = np.stack([pad(seq, MAX_LEN) for seq in sequences], axis=0)
+    padded = pad_sequences(sequences, MAX_LEN)
+    assert padded.shape == (len(LENGTHS), MAX_LEN, 74)
+    assert padded.dtype == np.float32
+    assert np.array_equal(padded, expected)
+
+
+def test_pad_sequences_post_matches_text_scripts():
+    sequences = utterances(LENGTHS, 300)
+    expected = np.stack([text_script_pad(seq, MAX_LEN) for seq in sequences], axis=0)
+    assert np.array_equal(pad_sequences(sequences, MAX_LEN, padding='post', truncating='post'), expected)
+
+
+def test_pad_sequences_into_out():
+    sequences = utterances(LENGTHS, 46)
+    out = np.ones((len(LENGTHS) + 2, MAX_LEN, 46), dtype='float32')
+    # the slice is overwritten completely, the rest of out is left alone
+    pad_sequences(sequences, MAX_LEN, out=out[1:-1])
+    assert np.array_equal(out[1:-1], pad_sequences(sequences, MAX_LEN))
+    assert np.all(out[0] == 1) and np.all(out[-1] == 1)
+
+
+def test_pad_sequences_feature_arrays():
+    # the (steps, dim) arrays of a FeatureStore pad as the tuple lists they were written from
+    sequences = utterances(LENGTHS, 46)
+    arrays = [np.array([step[2] for step in seq]) for seq in sequences]
+    assert np.array_equal(pad_sequences(arrays, MAX_LEN), pad_sequences(sequences, MAX_LEN))
+
+
+def test_pad_sequences_empty():
+    sequences = utterances([0, 2], 46)
+    padded = pad_sequences(sequences, MAX_LEN)
+    assert not padded[0].any()
+    with pytest.raises(ValueError):
+        pad_sequences(utterances([0, 0], 46), MAX_LEN)
+    assert pad_sequences(utterances([0, 0], 46), MAX_LEN, dim=46).shape == (2, MAX_LEN, 46)
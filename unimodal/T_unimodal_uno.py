@@ -11,7 +11,14 @@ from keras.optimizers import RMSprop,Adamax
 from keras.callbacks import EarlyStopping
 from keras.regularizers import l1, l2
 from keras import backend as K
-from mmdata import MOSI
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # make the shared helpers in common/ importable
+from common.cache import load_mosi
+from common.instrumentation import instrument
+from common.normalization import normalizers_path, save_normalizers
+from common.profiling import profiler
+from common.snapshots import BestWeights, Snapshot
 
 # turn off the warnings, be careful when use this
 import warnings
@@ -43,59 +50,17 @@ opt_func = Adamax(lr=0.0005, beta_1=0.9, beta_2=0.999, epsilon=1e-08) # optimiza
 loss_func = 'mae' # loss function
 metr = 'mae' # evaluation metric
 
-# Download the data if not present
-mosi = MOSI()
-embeddings = mosi.embeddings() # features
-sentiments = mosi.sentiments() # Valence labels
-train_ids = mosi.train()
-valid_ids = mosi.valid()
-test_ids = mosi.test()
-
-# Some data preprocessing
-x_train = []
-y_train = []
-x_valid = []
-y_valid = []
-x_test = []
-y_test = []
-
-print("Preparing train and test data...")
-for vid, vdata in embeddings['embeddings'].items(): # note that even Dataset with one feature will require explicit indexing of features
-    for sid, sdata in vdata.items():
-        if sdata == []:
-            continue
-        example = []
-        for i, time_step in enumerate(sdata):
-            # data is truncated for 15 words
-            if i == 15:
-                break
-            example.append(time_step[2]) # here first 2 dims (timestamps) will not be used
-
-        for i in range(maxlen - len(sdata)):
-            example.append(np.zeros(sdata[0][2].shape)) # padding each example to maxlen
-        example = np.asarray(example)
-        # Valence_label = 1 if sentiments[vid][sid] >= 0 else 0 # binarize the Valence labels
-        Valence_label = sentiments[vid][sid] # Valence regression
-
-        # train-validation-test partitions
-        if vid in train_ids:
-            x_train.append(example)
-            y_train.append(Valence_label)
-        elif vid in valid_ids:
-            x_valid.append(example)
-            y_valid.append(Valence_label)
-        else:
-            x_test.append(example)
-            y_test.append(Valence_label)
-
-# Prepare the final inputs as numpy arrays
-x_train = np.asarray(x_train)
-x_valid = np.asarray(x_valid)
-x_test = np.asarray(x_test)
-y_train = np.asarray(y_train)
-y_valid = np.asarray(y_valid)
-y_test = np.asarray(y_test)
+# wall time, CPU time and peak RSS of every phase of the run, written to profile_*.jsonl at the end
+profiler.switch('load data')
+# Load the word embeddings truncated/padded to maxlen words, cached after the first run
+data = load_mosi(['embeddings'], anchor=None, max_len=maxlen)
+x_train, x_valid, x_test = data['x_T_train'], data['x_T_valid'], data['x_T_test']
+
+# sentiment scores
+y_train, y_valid, y_test = data['y_train'], data['y_valid'], data['y_test']
+
 print("Data preprocessing finished! Begin compiling and training model.")
+profiler.switch('model build')
 
 #Building model
 all_input = Input(shape=(maxlen, 300), dtype='float32', name='input')
@@ -104,26 +69,38 @@ h2 = Dense(64, W_regularizer=l2(0.0), trainable=True)(h1)
 main_output = Dense(1, activation='tanh', name='main_output')(h2) # valence regression
 model = Model(inputs=all_input, outputs=main_output)
 
+profiler.switch('compile')
 # try using different optimizers and different optimizer configs
 model.compile(opt_func, loss_func, metrics=[pearson_cc,metr])
 
 print('Training...')
+# record step times, throughput and epoch durations of fit/evaluate/predict
+instrument(model, "prediction/timing_T_unimodal_uno.jsonl")
+# keep the weights of the best validation loss, the model is left with them when training stops
+best_weights = BestWeights()
+# save the training state every epoch, a rerun of an interrupted training continues from there
+snapshot = Snapshot("prediction/snapshot_T_unimodal_uno.npz", early_stopping, best_weights)
+profiler.switch('fit')
 model.fit(x_train,
           y_train,
           batch_size=batch_size,
           epochs=nb_epoch,
           validation_data=[x_valid, y_valid],
-          callbacks=[early_stopping])
+          initial_epoch=snapshot.resume(model),
+          callbacks=[early_stopping, best_weights, snapshot])
 
 # Evaluation
+profiler.switch('evaluate train')
 print('\n\n\n\nEvaluating on train set...')
 trn_score, trn_cc_emo, trn_mae_emo = model.evaluate(x_train, y_train, batch_size=batch_size)
 print('Valence Train cc:', trn_cc_emo)
 print('Valence Train mae:', trn_mae_emo)
+profiler.switch('evaluate valid')
 print('\nEvaluating on valisation set...')
 val_score, val_cc_emo, val_mae_emo = model.evaluate(x_valid, y_valid, batch_size=batch_size)
 print('Valence Validation cc:', val_cc_emo)
 print('Valence Validation mae:', val_mae_emo)
+profiler.switch('evaluate test')
 print('\nEvaluating on test set...')
 tst_score, tst_cc_emo, tst_mae_emo = model.evaluate(x_test, y_test, batch_size=batch_size)
 print('Valence Test cc:', tst_cc_emo)
@@ -133,10 +110,22 @@ print('Valence Test mae:', tst_mae_emo)
 np.set_printoptions(threshold=np.nan)
 tst_pred_file = "prediction/pred_T_unimodal_uno.txt"
 print('Printing predictions...')
+profiler.switch('predict')
 tst_pred = model.predict(x_test)
+profiler.switch('csv')
 tst_df = pd.DataFrame(tst_pred)
 tst_df.to_csv(tst_pred_file, index=False, header=False)
 
+profiler.switch('save weights')
+# save the weights with the feature normalizers fitted on the training set, so that the
+# model can be applied to new data without preprocessing the training data again
+weights_file = "prediction/weights_T_unimodal_uno.h5"
+model.save_weights(weights_file)
+save_normalizers(normalizers_path(weights_file), data['normalizers'])
+
+profiler.stop()
+profiler.write("prediction/profile_T_unimodal_uno.jsonl")
+print('\n' + profiler.summary())
 print('\nDone!')
 
 # Flush outputs to log file